@@ -0,0 +1,131 @@
+"""Admission control: bounds the requests served at once by the WSGI
+application, shedding the ones it cannot take in time.
+
+A request that finds ``max_requests`` others in flight waits at most
+``max_wait`` seconds for one of them to end, then is answered straight away
+with a ``503``::
+
+    >>> from djc.recipe.admission import AdmissionMiddleware
+    >>> from djc.recipe.metrics import Registry
+    >>> def app(environ, start_response):
+    ...     start_response('200 OK', [('Content-Type', 'text/plain')])
+    ...     return ['Hello']
+    >>> registry = Registry()
+    >>> wrapped = AdmissionMiddleware(app, max_requests=1, max_wait=0.05,
+    ...                               retry_after=2, registry=registry)
+    >>> def start_response(status, headers):
+    ...     print status, headers
+    >>> first = wrapped({}, start_response)
+    200 OK [('Content-Type', 'text/plain')]
+    >>> wrapped({}, start_response)
+    503 SERVICE UNAVAILABLE [('Content-Type', 'text/plain; charset=utf-8'), ('Content-Length', '9'), ('Retry-After', '2')]
+    ['Too busy\\n']
+
+A request is in flight until the server closes its response, so that the
+streaming is accounted for as well::
+
+    >>> import threading
+    >>> threading.Timer(0.01, first.close).start()
+    >>> list(wrapped({}, start_response))
+    200 OK [('Content-Type', 'text/plain')]
+    ['Hello']
+
+The requests in flight and waiting, and the rejected ones, are counted in the
+metrics registry::
+
+    >>> print registry.expose()
+    # HELP djc_requests_in_flight Requests being served.
+    # TYPE djc_requests_in_flight gauge
+    djc_requests_in_flight 1
+    # HELP djc_requests_queued Requests waiting to be served.
+    # TYPE djc_requests_queued gauge
+    djc_requests_queued 0
+    # HELP djc_requests_rejected_total Requests rejected for lack of capacity.
+    # TYPE djc_requests_rejected_total counter
+    djc_requests_rejected_total 1
+    <BLANKLINE>
+"""
+
+import time, threading
+from metrics import Counter, registry as default_registry
+from wsgiutils import ClosingIterator, simple_response
+
+
+class AdmissionMiddleware(object):
+    """Lets at most ``max_requests`` requests in at once, the others wait up
+    to ``max_wait`` seconds or get a ``503`` with ``Retry-After``.
+    """
+
+    def __init__(self, application, max_requests, max_wait=1.0,
+                 retry_after=1, registry=default_registry):
+        self.application = application
+        self.max_requests = max_requests
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.in_flight = registry.register(Counter(
+            'djc_requests_in_flight',
+            'Requests being served.',
+            kind='gauge'
+        ))
+        self.queued = registry.register(Counter(
+            'djc_requests_queued',
+            'Requests waiting to be served.',
+            kind='gauge'
+        ))
+        self.rejected = registry.register(Counter(
+            'djc_requests_rejected_total',
+            'Requests rejected for lack of capacity.'
+        ))
+        # Exposed from the start, rather than once they change
+        for counter in (self.in_flight, self.queued, self.rejected):
+            counter.inc(amount=0)
+        self._condition = threading.Condition()
+        self._active = 0
+
+    def admit(self):
+        """Returns whether a request can go in, waiting for its turn if
+        needed.
+        """
+        self._condition.acquire()
+        try:
+            if self._active >= self.max_requests:
+                if not self.max_wait:
+                    return False
+                deadline = time.time() + self.max_wait
+                self.queued.inc()
+                try:
+                    while self._active >= self.max_requests:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return False
+                        self._condition.wait(remaining)
+                finally:
+                    self.queued.dec()
+            self._active += 1
+            self.in_flight.inc()
+            return True
+        finally:
+            self._condition.release()
+
+    def leave(self):
+        self._condition.acquire()
+        try:
+            self._active -= 1
+            self.in_flight.dec()
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def __call__(self, environ, start_response):
+        if not self.admit():
+            self.rejected.inc()
+            return simple_response(
+                start_response, '503 SERVICE UNAVAILABLE', 'Too busy\n',
+                headers=[('Retry-After', str(self.retry_after))]
+            )
+        try:
+            result = self.application(environ, start_response)
+        except:
+            self.leave()
+            raise
+        return ClosingIterator(result, self.leave)
@@ -0,0 +1,310 @@
+"""Bundles the static files: concatenates (and minifies) JavaScript and CSS
+files in fewer, smaller ones.
+
+The minifiers only drop comments (but the ``/*! ... */`` ones) and the
+whitespace that is not needed, keeping line breaks where JavaScript might
+rely on them for semicolon insertion::
+
+    >>> from djc.recipe.assets import minify_js, minify_css, build_bundles
+    >>> print minify_js('''
+    ... // Greets
+    ... function greet(name) {
+    ...     var re = /\\/+ "/g, s = 'a  /* b */'; /* comment */
+    ...     return "Hello " + name + +1
+    ... }
+    ... greet(a) / 2
+    ... ''')
+    function greet(name){var re=/\\/+ "/g,s='a  /* b */';return"Hello "+name+ +1}
+    greet(a)/2
+    >>> print minify_css('''
+    ... /*! License */
+    ... a:hover , p > b {
+    ...     color : red !important;  /* comment */
+    ...     font-family: "A  B", sans-serif;
+    ... }
+    ... @media screen and (max-width: 10px) { a :hover { margin: 0 auto } }
+    ... ''')
+    /*! License */a:hover,p>b{color:red!important;font-family:"A  B",sans-serif}@media screen and (max-width:10px){a :hover{margin:0 auto}}
+
+A bundle is written from the files matching its globs (relative to the
+static directory), and written again only when any of them changes::
+
+    >>> write(directory, 'a.js', 'var a = 1;')
+    >>> write(directory, 'b.js', 'var b = 2')
+    >>> state = os.path.join(directory, 'bundles.json')
+    >>> build_bundles(directory, [('all.js', ['*.js'])], state)
+    (['all.js'], [])
+    >>> cat(directory, 'all.js')
+    var a=1;;
+    var b=2
+    >>> build_bundles(directory, [('all.js', ['*.js'])], state)
+    ([], ['all.js'])
+    >>> write(directory, 'b.js', 'var b = 3')
+    >>> build_bundles(directory, [('all.js', ['*.js'])], state)
+    (['all.js'], [])
+"""
+
+import os, re, glob, hashlib, logging, tempfile
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+logger = logging.getLogger('djc.recipe.assets')
+
+WHITESPACE = ' \t\r\n\f\v'
+# After these, a slash starts a regular expression rather than a division
+REGEX_AFTER = set('(,=:[!&|?{};~+-*%<>^')
+REGEX_KEYWORDS = set([
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'instanceof', 'new',
+    'delete', 'void', 'throw',
+])
+# Line breaks that cannot matter for semicolon insertion
+NO_BREAK_AFTER = set('{[(,;:=?&|!<>*%~^')
+NO_BREAK_BEFORE = set('}]),;:.?=&|*%<>')
+CSS_WORD = re.compile(r'''[^\s{};,>:()!"'/]+''')
+NO_SPACE_AFTER = set('{};,>:(')
+NO_SPACE_BEFORE = set('{};,>)!')
+
+
+def is_word(c):
+    return c.isalnum() or c in '_$\\' or ord(c) > 126
+
+
+def scan_string(source, i):
+    """Returns where the string starting at ``i`` ends.
+    """
+    quote, j = source[i], i + 1
+    while j < len(source) and source[j] != quote:
+        if source[j] == '\\':
+            j += 1
+        j += 1
+    if j >= len(source):
+        raise ValueError("Unterminated string")
+    return j + 1
+
+
+def minify_js(source):
+    """Returns the minified ``source``, raises ``ValueError`` if it cannot
+    parse it.
+    """
+    output = []
+    token = ''
+    space = None
+    i, length = 0, len(source)
+    while i < length:
+        c = source[i]
+        if c in WHITESPACE:
+            if c == '\n':
+                space = '\n'
+            elif space is None:
+                space = ' '
+            i += 1
+            continue
+        if source.startswith('//', i):
+            i = source.find('\n', i)
+            if i == -1:
+                i = length
+            continue
+        if source.startswith('/*', i) and not source.startswith('/*!', i):
+            end = source.find('*/', i + 2)
+            if end == -1:
+                raise ValueError("Unterminated comment")
+            if '\n' in source[i:end]:
+                space = '\n'
+            elif space is None:
+                space = ' '
+            i = end + 2
+            continue
+        previous = token
+        if source.startswith('/*!', i):
+            end = source.find('*/', i + 3)
+            if end == -1:
+                raise ValueError("Unterminated comment")
+            j = end + 2
+        elif c in '"\'`':
+            j = scan_string(source, i)
+        elif c == '/' and (not previous or previous in REGEX_KEYWORDS or
+                           previous[-1] in REGEX_AFTER):
+            j, in_class = i + 1, False
+            while j < length and (in_class or source[j] != '/'):
+                if source[j] == '\\':
+                    j += 1
+                elif source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                elif source[j] == '\n':
+                    raise ValueError("Unterminated regular expression")
+                j += 1
+            j += 1
+            while j < length and is_word(source[j]):
+                j += 1
+        elif is_word(c):
+            j = i + 1
+            while j < length and is_word(source[j]):
+                j += 1
+        else:
+            j = i + 1
+        token = source[i:j]
+        if output and space is not None:
+            before, after = previous[-1], token[0]
+            if is_word(before) and is_word(after) or \
+                    before in '+-' and after in '+-':
+                output.append(space)
+            elif space == '\n' and before not in NO_BREAK_AFTER and \
+                    after not in NO_BREAK_BEFORE:
+                output.append('\n')
+        output.append(token)
+        space = None
+        if token.startswith('/*!'):
+            space = '\n'
+        i = j
+    return ''.join(output)
+
+
+def minify_css(source):
+    """Returns the minified ``source``, raises ``ValueError`` if it cannot
+    parse it.
+    """
+    output = []
+    space = False
+    # Whether each open block holds declarations, rather than rules
+    blocks = []
+    prelude = 0
+    i, length = 0, len(source)
+    while i < length:
+        c = source[i]
+        if c.isspace():
+            space = True
+            i += 1
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            if end == -1:
+                raise ValueError("Unterminated comment")
+            if not source.startswith('/*!', i):
+                space = True
+                i = end + 2
+                continue
+            j = end + 2
+        elif c in '"\'':
+            j = scan_string(source, i)
+        else:
+            match = CSS_WORD.match(source, i)
+            j = match and match.end() or i + 1
+        token = source[i:j]
+        if space and output and output[-1][-1] not in NO_SPACE_AFTER and \
+                token[0] not in NO_SPACE_BEFORE and \
+                not output[-1].startswith('/*!') and \
+                not (token == ':' and blocks and blocks[-1]):
+            output.append(' ')
+        if token == '}' and output and output[-1] == ';':
+            output.pop()
+        if token == '{':
+            at_rule = ''.join(output[prelude:]).lstrip(';').split(' ')[0]
+            blocks.append(not at_rule.startswith('@') or
+                          at_rule in ('@font-face', '@page'))
+        elif token == '}' and blocks:
+            blocks.pop()
+        output.append(token)
+        if token in '{};':
+            prelude = len(output)
+        space = False
+        i = j
+    return ''.join(output)
+
+
+MINIFIERS = {
+    '.js': (minify_js, ';\n'),
+    '.css': (minify_css, '\n'),
+}
+
+
+def read(filename):
+    f = open(filename, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def concatenate(output, inputs, contents, minify=True):
+    """Returns the content of the bundle ``output``.
+    """
+    minifier, separator = MINIFIERS.get(
+        os.path.splitext(output)[1].lower(), (None, '\n')
+    )
+    if minify and minifier is not None:
+        minified = []
+        for filename, content in zip(inputs, contents):
+            try:
+                minified.append(minifier(content))
+            except ValueError, e:
+                logger.warning("Cannot minify '%s' (%s), keeping it as it "
+                               "is in '%s'" % (filename, e, output))
+                minified.append(content)
+        contents = minified
+    return separator.join(contents)
+
+
+def build_bundles(directory, bundles, state, minify=True):
+    """Writes the ``bundles``, a list of ``(output, globs)``, within
+    ``directory``, skipping the ones whose inputs did not change since the
+    last time (as recorded in the ``state`` file). Returns the bundles written
+    and skipped.
+    """
+    try:
+        digests = json.loads(read(state))
+    except (IOError, ValueError):
+        digests = {}
+    outputs = set([
+        os.path.normpath(os.path.join(directory, o)) for o, __ in bundles
+    ])
+    built, skipped = [], []
+    for output, patterns in bundles:
+        inputs = []
+        for pattern in patterns:
+            matches = sorted(glob.glob(os.path.join(directory, pattern)))
+            if not matches:
+                logger.warning("Nothing matches '%s' for '%s'" % (
+                    pattern, output
+                ))
+            for match in matches:
+                match = os.path.normpath(match)
+                if os.path.isfile(match) and match not in inputs and \
+                        match not in outputs:
+                    inputs.append(match)
+        contents = [read(filename) for filename in inputs]
+        digest = hashlib.sha1(repr((minify, inputs))).hexdigest()
+        for content in contents:
+            digest = hashlib.sha1(digest + content).hexdigest()
+        target = os.path.join(directory, output)
+        if not os.path.realpath(os.path.dirname(target)).startswith(
+                os.path.realpath(directory)):
+            # Likely, within a symlinked origin, that must not be written
+            raise ValueError("'%s' is not within '%s'" % (output, directory))
+        if digests.get(output) == digest and os.path.isfile(target):
+            skipped.append(output)
+            continue
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(target),
+                                    prefix='.tmp')
+        try:
+            os.write(fd, concatenate(output, inputs, contents, minify))
+            os.close(fd)
+            os.chmod(temp, 0644)
+            os.rename(temp, target)
+        except:
+            os.remove(temp)
+            raise
+        digests[output] = digest
+        built.append(output)
+    f = open(state, 'wb')
+    try:
+        json.dump(digests, f)
+    finally:
+        f.close()
+    return built, skipped
@@ -0,0 +1,194 @@
+"""Packs an installed part into a single relocatable archive.
+
+The archive holds the files created by the part (scripts, generated module,
+static directory) and the eggs of its working set, with paths relative to
+the buildout directory (the eggs that live outside of it go in ``eggs``).
+It also holds this very module, as ``activate.py``: once extracted, running
+it rewrites the absolute paths found in the bundled files to the new
+location::
+
+    >>> from djc.recipe.bundle import bundle
+    >>> archive = bundle(base, [egg], ['bin/django', 'parts/django'],
+    ...                  os.path.join(output, 'django.tar.gz'))
+    >>> import tarfile
+    >>> for name in sorted(tarfile.open(archive).getnames()):
+    ...     print name
+    activate.py
+    bin/django
+    bundle.json
+    eggs/spam.egg
+    eggs/spam.egg/spam.py
+    parts/django
+    parts/django/settings.py
+
+    >>> import subprocess, sys
+    >>> tarfile.open(archive).extractall(output)
+    >>> subprocess.call([sys.executable, os.path.join(output, 'activate.py')])
+    0
+    >>> print open(os.path.join(output, 'bin', 'django')).read().replace(
+    ...     output, '<NEW>')
+    import sys
+    sys.path[0:0] = ['<NEW>/eggs/spam.egg']
+    <BLANKLINE>
+    >>> print open(os.path.join(output, 'parts', 'django', 'settings.py')
+    ...     ).read().replace(output, '<NEW>')
+    STATIC_ROOT = '<NEW>/static'
+    <BLANKLINE>
+
+A location shared by many eggs is only bundled once, and eggs outside of the
+buildout directory with the same name do not overwrite each other::
+
+    >>> other = os.path.join(eggs, 'more', 'spam.egg')
+    >>> os.makedirs(other)
+    >>> open(os.path.join(other, 'other.py'), 'wb').close()
+    >>> archive = bundle(base, [egg, egg + os.sep, other], [],
+    ...                  os.path.join(output, 'shared.tar.gz'))
+    >>> for name in sorted(tarfile.open(archive).getnames()):
+    ...     print name
+    activate.py
+    bundle.json
+    eggs/spam.egg
+    eggs/spam.egg-2
+    eggs/spam.egg-2/other.py
+    eggs/spam.egg/spam.py
+"""
+
+import os, sys, tarfile
+from cStringIO import StringIO
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+MANIFEST = 'bundle.json'
+
+ACTIVATE = 'activate.py'
+
+
+def is_text(path, limit=1 << 20):
+    if os.path.getsize(path) > limit:
+        return False
+    f = open(path, 'rb')
+    try:
+        return '\0' not in f.read(8192)
+    finally:
+        f.close()
+
+
+def bundle(base, paths, files, output):
+    """Writes to ``output`` the archive of ``files`` (relative to ``base``)
+    and the eggs in ``paths``, returns ``output``.
+    """
+    base = os.path.abspath(base)
+    prefixes = {}
+    members = []
+    seen = set()
+    for path in paths:
+        path = os.path.abspath(path)
+        if path in seen:
+            continue
+        seen.add(path)
+        if path == base or path.startswith(base + os.sep):
+            relative = path[len(base):].lstrip(os.sep)
+        else:
+            name = os.path.basename(path)
+            relative = os.path.join('eggs', name)
+            count = 1
+            while relative in prefixes.values():
+                count += 1
+                relative = os.path.join('eggs', '%s-%d' % (name, count))
+            prefixes[path] = relative
+        members.append((path, relative))
+    bundled = [(os.path.join(base, path), path) for path in files]
+    members.extend(bundled)
+    prefixes[base] = ''
+
+    # The files referring to the old locations, to be fixed on activation
+    rewrite = []
+    for path, relative in bundled:
+        candidates = [(path, relative)]
+        if os.path.isdir(path):
+            candidates = []
+            for root, __, names in os.walk(path):
+                for name in names:
+                    full = os.path.join(root, name)
+                    candidates.append(
+                        (full, os.path.join(relative, full[len(path) + 1:]))
+                    )
+        for full, name in candidates:
+            if os.path.isfile(full) and is_text(full):
+                content = open(full, 'rb').read()
+                for prefix in prefixes:
+                    if prefix in content:
+                        rewrite.append(name)
+                        break
+
+    manifest = {
+        'base': base,
+        'prefixes': prefixes,
+        'rewrite': rewrite,
+    }
+    tar = tarfile.open(output, 'w:gz')
+    try:
+        for path, relative in members:
+            if os.path.exists(path):
+                tar.add(path, relative)
+        info = tarfile.TarInfo(MANIFEST)
+        data = json.dumps(manifest, indent=2, sort_keys=True)
+        info.size = len(data)
+        tar.addfile(info, StringIO(data))
+        tar.add(os.path.splitext(__file__)[0] + '.py', ACTIVATE)
+    finally:
+        tar.close()
+    return output
+
+
+def activate(root):
+    """Rewrites the paths in the files of the bundle extracted in ``root``.
+    """
+    root = os.path.abspath(root)
+    manifest_path = os.path.join(root, MANIFEST)
+    manifest = json.load(open(manifest_path, 'rb'))
+    # Longest first, as eggs may live below the buildout directory
+    replacements = []
+    for prefix, relative in manifest['prefixes'].items():
+        replacements.append((
+            str(prefix),
+            str(relative and os.path.join(root, relative) or root)
+        ))
+    replacements.sort(key=lambda r: -len(r[0]))
+    for name in manifest['rewrite']:
+        path = os.path.join(root, name)
+        content = open(path, 'rb').read()
+        # Placeholders first, so that a new path is never rewritten again
+        for i, (old, new) in enumerate(replacements):
+            content = content.replace(old, '\0%d\0' % i)
+        for i, (old, new) in enumerate(replacements):
+            content = content.replace('\0%d\0' % i, new)
+        mode = os.stat(path).st_mode
+        f = open(path, 'wb')
+        f.write(content)
+        f.close()
+        os.chmod(path, mode)
+    # The bundle can be moved and activated again
+    manifest['prefixes'] = dict([
+        (relative and os.path.join(root, relative) or root, relative)
+        for relative in manifest['prefixes'].values()
+    ])
+    manifest['base'] = root
+    f = open(manifest_path, 'wb')
+    json.dump(manifest, f, indent=2, sort_keys=True)
+    f.close()
+
+
+def main(settings, name, base, paths, files):
+    output = len(sys.argv) > 1 and sys.argv[1] or \
+            os.path.join(base, '%s-bundle.tar.gz' % name)
+    bundle(base, paths, files, output)
+    print "Bundle written to %s" % output
+    print "Extract it and run 'python activate.py' in the new location"
+
+
+if __name__ == '__main__':
+    activate(os.path.dirname(os.path.abspath(__file__)))
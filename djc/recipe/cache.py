@@ -0,0 +1,200 @@
+"""A two level cache backend: a small, short lived, per-process LRU cache in
+front of another (shared) cache.
+
+Reads that hit the first level never leave the process, at the price of the
+first level being up to ``L1_TIMEOUT`` seconds stale in respect to changes
+made by other processes (changes made by the process itself are seen
+immediately).
+
+It is configured with the second level cache, an alias in ``CACHES`` or a
+backend's dotted name, as ``LOCATION``::
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'djc.recipe.cache.TwoLevelCache',
+            'LOCATION': 'shared',
+            'OPTIONS': {'L1_SIZE': 1000, 'L1_TIMEOUT': 5},
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211',
+        },
+    }
+
+Let's try it with a local memory second level::
+
+    >>> from djc.recipe.cache import TwoLevelCache
+    >>> cache = TwoLevelCache(
+    ...     'django.core.cache.backends.locmem.LocMemCache',
+    ...     {'OPTIONS': {'L1_SIZE': 2}}
+    ... )
+    >>> cache.set('spam', [1, 2])
+    >>> cache.get('spam')
+    [1, 2]
+    >>> cache.l2.get('spam')
+    [1, 2]
+
+What we just read came from the first level, while values that are only in
+the second level are fetched (and then kept in the first)::
+
+    >>> cache.l2.set('eggs', 'bacon')
+    >>> cache.get('eggs')
+    'bacon'
+    >>> cache.get('eggs')
+    'bacon'
+    >>> cache.get('ham', 'missing')
+    'missing'
+    >>> sorted(cache.stats().items())
+    [('l1_hits', 2), ('l2_hits', 1), ('misses', 1)]
+
+Deleting goes through both levels::
+
+    >>> cache.delete('spam')
+    >>> cache.get('spam') is None
+    True
+    >>> cache.l2.get('spam') is None
+    True
+"""
+
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from django.core.cache import get_cache
+from django.core.cache.backends.base import BaseCache
+from lru import LRUCache
+from metrics import Counter, registry
+
+
+requests = registry.register(Counter(
+    'djc_cache_requests_total',
+    'Cache reads by two level cache and outcome.',
+    ('cache', 'result')
+))
+
+_missing = object()
+
+
+class TwoLevelCache(BaseCache):
+
+    def __init__(self, location, params):
+        BaseCache.__init__(self, params)
+        options = params.get('OPTIONS', {})
+        self.l1 = LRUCache(int(options.get('L1_SIZE', 1000)))
+        self.l1_timeout = float(options.get('L1_TIMEOUT', 5))
+        self._location = location
+        self._l2 = None
+
+    @property
+    def l2(self):
+        if self._l2 is None:
+            self._l2 = get_cache(self._location)
+        return self._l2
+
+    def _count(self, result, amount=1):
+        if amount:
+            requests.inc((self._location, result), amount)
+
+    def stats(self):
+        return dict([
+            (result, requests.value((self._location, result)))
+            for result in ('l1_hits', 'l2_hits', 'misses')
+        ])
+
+    def _get_l1(self, key):
+        entry = self.l1.get(key)
+        if entry is not None:
+            data, expires = entry
+            if expires > time.time():
+                return pickle.loads(data)
+            self.l1.delete(key)
+        return _missing
+
+    def _set_l1(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        timeout = min(timeout, self.l1_timeout)
+        if timeout <= 0:
+            self.l1.delete(key)
+        else:
+            self.l1.set(key, (
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                time.time() + timeout
+            ))
+
+    def add(self, key, value, timeout=None, version=None):
+        added = self.l2.add(key, value, timeout, version)
+        if added:
+            self._set_l1(self.make_key(key, version), value, timeout)
+        else:
+            self.l1.delete(self.make_key(key, version))
+        return added
+
+    def get(self, key, default=None, version=None):
+        l1_key = self.make_key(key, version)
+        value = self._get_l1(l1_key)
+        if value is not _missing:
+            self._count('l1_hits')
+            return value
+        value = self.l2.get(key, _missing, version)
+        if value is _missing:
+            self._count('misses')
+            return default
+        self._count('l2_hits')
+        self._set_l1(l1_key, value)
+        return value
+
+    def set(self, key, value, timeout=None, version=None):
+        self.l2.set(key, value, timeout, version)
+        self._set_l1(self.make_key(key, version), value, timeout)
+
+    def delete(self, key, version=None):
+        self.l1.delete(self.make_key(key, version))
+        self.l2.delete(key, version)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remaining = []
+        for key in keys:
+            value = self._get_l1(self.make_key(key, version))
+            if value is _missing:
+                remaining.append(key)
+            else:
+                found[key] = value
+        self._count('l1_hits', len(found))
+        if remaining:
+            fetched = self.l2.get_many(remaining, version)
+            self._count('l2_hits', len(fetched))
+            self._count('misses', len(remaining) - len(fetched))
+            for key, value in fetched.iteritems():
+                self._set_l1(self.make_key(key, version), value)
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        if self._get_l1(self.make_key(key, version)) is not _missing:
+            return True
+        return self.l2.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        self.l1.delete(self.make_key(key, version))
+        return self.l2.incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        self.l1.delete(self.make_key(key, version))
+        return self.l2.decr(key, delta, version)
+
+    def set_many(self, data, timeout=None, version=None):
+        self.l2.set_many(data, timeout, version)
+        for key, value in data.iteritems():
+            self._set_l1(self.make_key(key, version), value, timeout)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.l1.delete(self.make_key(key, version))
+        self.l2.delete_many(keys, version)
+
+    def clear(self):
+        self.l1.clear()
+        self.l2.clear()
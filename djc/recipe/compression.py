@@ -0,0 +1,273 @@
+"""Compresses the responses of the WSGI application, as they are streamed.
+
+Only the responses worth it (of the given content types, and at least
+``min_size`` bytes long) are compressed, for the clients that accept it::
+
+    >>> from djc.recipe.compression import GzipMiddleware
+    >>> def app(environ, start_response):
+    ...     start_response('200 OK', [('Content-Type', environ['TYPE']),
+    ...                               ('Vary', 'Cookie')])
+    ...     return ['<p>Hello</p>' * 100, '<p>World</p>']
+    >>> wrapped = GzipMiddleware(app, min_size=1024)
+    >>> def start_response(status, headers):
+    ...     print status
+    ...     for header in headers:
+    ...         print '%s: %s' % header
+    >>> def get(content_type='text/html; charset=utf-8', **environ):
+    ...     environ['TYPE'] = content_type
+    ...     response = wrapped(environ, start_response)
+    ...     try:
+    ...         return ''.join(response)
+    ...     finally:
+    ...         response.close()
+    >>> body = get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+    200 OK
+    Content-Type: text/html; charset=utf-8
+    Vary: Cookie, Accept-Encoding
+    Content-Encoding: gzip
+    >>> import gzip, StringIO
+    >>> gzip.GzipFile(fileobj=StringIO.StringIO(body)).read()[-24:]
+    '<p>Hello</p><p>World</p>'
+    >>> len(body) < 100
+    True
+
+The others are left alone, though caches are still told that the response
+depends on ``Accept-Encoding``::
+
+    >>> len(get(HTTP_ACCEPT_ENCODING='gzip;q=0, identity'))
+    200 OK
+    Content-Type: text/html; charset=utf-8
+    Vary: Cookie, Accept-Encoding
+    1212
+    >>> len(get('image/png', HTTP_ACCEPT_ENCODING='gzip'))
+    200 OK
+    Content-Type: image/png
+    Vary: Cookie
+    1212
+
+Only up to ``min_size`` bytes are read ahead, when the length of the response
+is not known, to decide whether it is worth it::
+
+    >>> wrapped = GzipMiddleware(app, min_size=2048)
+    >>> len(get(HTTP_ACCEPT_ENCODING='gzip'))
+    200 OK
+    Content-Type: text/html; charset=utf-8
+    Vary: Cookie, Accept-Encoding
+    1212
+"""
+
+import zlib
+from wsgiutils import OFFLOAD_HEADER
+
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_CONTENT_TYPES = (
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/csv',
+    'text/xml',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'image/svg+xml',
+)
+LEVEL = 6
+
+
+def accepts_gzip(accept_encoding):
+    """Returns whether the ``Accept-Encoding`` header allows ``gzip``.
+
+        >>> from djc.recipe.compression import accepts_gzip
+        >>> accepts_gzip('deflate, gzip;q=0.5')
+        True
+        >>> accepts_gzip('*')
+        True
+        >>> accepts_gzip('gzip;q=0, *')
+        False
+        >>> accepts_gzip('identity')
+        False
+    """
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        coding, __, parameters = coding.partition(';')
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            name, __, value = parameter.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def get_header(headers, name):
+    for header, value in headers:
+        if header.lower() == name:
+            return value
+    return None
+
+
+class GzipResponse(object):
+    """The response of the application, compressed (or not) as it is
+    iterated.
+    """
+
+    def __init__(self, middleware, environ, start_response):
+        self.middleware = middleware
+        self.accepted = accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        self.start_response = start_response
+        self.status = None
+        self.headers = None
+        self.server_write = None
+        self.started = False
+        self.result = middleware.application(environ, self.capture)
+
+    def capture(self, status, headers, exc_info=None):
+        if exc_info is not None and self.started:
+            # It is up to the server, whether it is too late
+            return self.start_response(status, headers, exc_info)
+        self.status = status
+        self.headers = list(headers)
+        if not (self.accepted and
+                self.middleware.eligible(self.status, self.headers)):
+            # Nothing to decide: the layers outside see the response as soon
+            # as it starts
+            self.start(False)
+        return self.write
+
+    def write(self, data):
+        # What goes through the legacy write callable is not compressed
+        if not self.started:
+            self.start(False)
+        self.server_write(data)
+
+    def start(self, compress):
+        headers = self.headers
+        if self.middleware.eligible(self.status, headers):
+            vary = get_header(headers, 'vary')
+            if vary is None:
+                headers.append(('Vary', 'Accept-Encoding'))
+            elif vary.strip() != '*' and 'accept-encoding' not in [
+                    v.strip().lower() for v in vary.split(',')]:
+                headers = [
+                    (h, h.lower() == 'vary' and v + ', Accept-Encoding' or v)
+                    for h, v in headers
+                ]
+        if compress:
+            headers = [
+                (h, v) for h, v in headers if h.lower() != 'content-length'
+            ]
+            headers = [
+                # The compressed representation is not the same bytes
+                (h, h.lower() == 'etag' and not v.startswith('W/') and
+                    'W/' + v or v)
+                for h, v in headers
+            ]
+            headers.append(('Content-Encoding', 'gzip'))
+        self.server_write = self.start_response(self.status, headers)
+        self.started = True
+
+    def __iter__(self):
+        chunks = iter(self.result)
+        buffered = []
+        if self.status is None:
+            # An application that calls start_response lazily, with its
+            # first chunk
+            for chunk in chunks:
+                buffered.append(chunk)
+                if self.status is not None:
+                    break
+            else:
+                for chunk in buffered:
+                    yield chunk
+                return
+        # Unless started already, with nothing to compress or by the legacy
+        # write callable
+        compress = not self.started
+        if compress:
+            min_size = self.middleware.min_size
+            length = get_header(self.headers, 'content-length')
+            if length is not None and length.isdigit():
+                compress = int(length) >= min_size
+            else:
+                size = sum([len(chunk) for chunk in buffered])
+                for chunk in chunks:
+                    buffered.append(chunk)
+                    size += len(chunk)
+                    if size >= min_size:
+                        break
+                compress = size >= min_size
+        if not self.started:
+            self.start(compress)
+        if not compress:
+            for chunk in buffered:
+                yield chunk
+            for chunk in chunks:
+                yield chunk
+            return
+        compressor = zlib.compressobj(
+            self.middleware.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+        for source in (buffered, chunks):
+            for chunk in source:
+                if chunk:
+                    # Flushed, so that the client gets what the application
+                    # has streamed so far
+                    yield compressor.compress(chunk) + \
+                        compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+    def close(self):
+        if hasattr(self.result, 'close'):
+            self.result.close()
+
+
+class GzipMiddleware(object):
+    """Compresses with ``gzip`` the responses of ``content_types`` (``text/*``
+    matches all the text types) that are at least ``min_size`` bytes long.
+    """
+
+    def __init__(self, application, min_size=DEFAULT_MIN_SIZE,
+                 content_types=DEFAULT_CONTENT_TYPES, level=LEVEL):
+        self.application = application
+        self.min_size = min_size
+        self.content_types = set()
+        self.prefixes = []
+        for content_type in content_types:
+            content_type = content_type.lower()
+            if content_type.endswith('/*'):
+                self.prefixes.append(content_type[:-1])
+            else:
+                self.content_types.add(content_type)
+        self.level = level
+
+    def eligible(self, status, headers):
+        """Returns whether the response could be compressed, depending on
+        the client.
+        """
+        if status[:3] in ('204', '206', '304') or status[:1] in '13':
+            return False
+        content_type = get_header(headers, 'content-type')
+        if content_type is None:
+            return False
+        content_type = content_type.split(';')[0].strip().lower()
+        if content_type not in self.content_types and not [
+                p for p in self.prefixes if content_type.startswith(p)]:
+            return False
+        if get_header(headers, 'content-encoding') is not None or \
+                get_header(headers, OFFLOAD_HEADER.lower()) is not None:
+            return False
+        return 'no-transform' not in \
+            (get_header(headers, 'cache-control') or '').lower()
+
+    def __call__(self, environ, start_response):
+        return GzipResponse(self, environ, start_response)
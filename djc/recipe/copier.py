@@ -1,4 +1,4 @@
-import os, shutil
+import os, stat, errno, shutil, fnmatch, hashlib, tempfile
 
 
 class tree(dict):
@@ -144,6 +144,178 @@ class tree(dict):
                     yield (joiner.join([key, subkey]), subhash)
 
 
+def excluded(relative, include=(), exclude=(), directory=False):
+    """Returns whether the file (or the ``directory``) at ``relative``, a
+    ``/`` separated path within its origin, is filtered out: the glob
+    patterns are matched against both the path and the name, the
+    ``exclude`` ones first. Directories are only excluded explicitly, as the
+    files they contain might be included::
+
+        >>> from djc.recipe.copier import excluded
+        >>> excluded('css/site.less', exclude=['*.less'])
+        True
+        >>> excluded('css/site.css', include=['css/*.css'])
+        False
+        >>> excluded('js/site.js', include=['css/*.css'])
+        True
+        >>> excluded('js', include=['css/*.css'], directory=True)
+        False
+    """
+    name = relative.rsplit('/', 1)[-1]
+    for pattern in exclude:
+        if fnmatch.fnmatch(relative, pattern) or \
+                fnmatch.fnmatch(name, pattern):
+            return True
+    if include and not directory:
+        for pattern in include:
+            if fnmatch.fnmatch(relative, pattern) or \
+                    fnmatch.fnmatch(name, pattern):
+                return False
+        return True
+    return False
+
+
+class Store(object):
+    """A content-addressed store of files, shared by many targets.
+
+    Each file is hashed, placed once in the store (read-only, named after the
+    hash of its content) and hardlinked into the targets, so that the disk
+    space used depends on the distinct contents rather than on how many times
+    they are copied::
+
+        >>> store = Store(os.path.join(target, 'store'))
+        >>> store.link(os.path.join(source, 'one', 'b.txt'),
+        ...            os.path.join(target, 'b.txt'))
+        >>> store.link(os.path.join(source, 'zzz', 'zzz', 'zzz.txt'),
+        ...            os.path.join(target, 'zzz.txt'))
+        >>> store.link(os.path.join(source, 'one', 'b.txt'),
+        ...            os.path.join(target, 'a', 'b.txt'))
+        >>> cat(target, 'a', 'b.txt')
+        b
+        >>> len(store.objects())
+        2
+
+    The references to the objects are the hardlinks themselves: objects that
+    are linked nowhere anymore are removed by ``prune``, which returns how
+    many objects and bytes it freed::
+
+        >>> os.remove(os.path.join(target, 'zzz.txt'))
+        >>> store.prune()
+        (1, 4)
+        >>> os.remove(os.path.join(target, 'b.txt'))
+        >>> store.prune()
+        (0, 0)
+        >>> len(store.objects())
+        1
+    """
+
+    # The hashes are computed once per file (as long as it does not change)
+    # for all stores, as many targets share the same origins
+    digests = {}
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def digest(self, path):
+        """Returns the hash of the content of ``path``.
+        """
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime)
+        if key not in self.digests:
+            hash_ = hashlib.sha1()
+            f = open(path, 'rb')
+            try:
+                for chunk in iter(lambda: f.read(65536), ''):
+                    hash_.update(chunk)
+            finally:
+                f.close()
+            self.digests[key] = hash_.hexdigest()
+        return self.digests[key]
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def add(self, source):
+        """Places ``source`` in the store, if missing, returns its path there.
+        """
+        path = self.path(self.digest(source))
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+            # Copy then rename, so that a partial object is never visible
+            fd, temp = tempfile.mkstemp(dir=directory, prefix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copyfile(source, temp)
+                # Objects are read-only, as changing one would change all the
+                # files linked to it
+                os.chmod(temp, stat.S_IMODE(os.stat(source).st_mode) &
+                         ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+                os.rename(temp, path)
+            except:
+                os.remove(temp)
+                raise
+        return path
+
+    def link(self, source, target):
+        """Hardlinks the stored copy of ``source`` into ``target``, copies it
+        where hardlinks are not possible (e.g. across filesystems).
+        """
+        directory = os.path.dirname(target)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        try:
+            os.link(self.add(source), target)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                # Pruned in the meanwhile by someone else
+                os.link(self.add(source), target)
+            elif e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                shutil.copy(source, target)
+            else:
+                raise
+        except AttributeError:
+            shutil.copy(source, target)
+
+    def link_tree(self, source, target):
+        """Links all the files in the ``source`` tree into ``target``.
+        """
+        for root, __, files in os.walk(source):
+            for file_ in files:
+                path = os.path.join(root, file_)
+                self.link(path, os.path.join(
+                    target, path[len(source):].lstrip(os.sep)
+                ))
+
+    def objects(self):
+        """Returns the paths of the objects in the store.
+        """
+        objects = []
+        for root, __, files in os.walk(self.directory):
+            for file_ in files:
+                if not file_.startswith('.tmp'):
+                    objects.append(os.path.join(root, file_))
+        return objects
+
+    def prune(self):
+        """Removes the objects that are not linked anywhere, returns the
+        number of removed objects and their size.
+        """
+        count = size = 0
+        for path in self.objects():
+            st = os.lstat(path)
+            if st.st_nlink <= 1:
+                os.remove(path)
+                count += 1
+                size += st.st_size
+        return count, size
+
+
 class Copier(object):
     """An object that allows to copy multiple sources into one target, merging
     the results where possible.
@@ -296,20 +468,58 @@ class Copier(object):
 
     Had we passed ``link`` as true, it would have linked entire subdirectories
     where possible.
+
+    If a ``store`` (a ``Store``) is given, and ``link`` is false, the files
+    are hardlinked from the store instead of being copied.
     """
 
-    def __init__(self, link=False):
+    def __init__(self, link=False, store=None):
         self.link = link
+        self.store = store
         self.origins = tree()
         self.targets = tree()
         self.target_bases = []
         self.operations = []
+        self.filtered = set()
         self.merged = False
 
-    def copy(self, origin, target):
-        """Schedules a copy from ``origin`` to ``target``.
+    def copy(self, origin, target, include=(), exclude=()):
+        """Schedules a copy from ``origin`` to ``target``, of the files that
+        are not filtered out by the ``include`` and ``exclude`` glob patterns
+        (see ``excluded``). Excluded directories are not walked into, and the
+        directories missing some of their files are never copied as a whole::
+
+            >>> copier = Copier()
+            >>> copier.copy(os.path.join(source, 'zzb'), target,
+            ...             exclude=['zzc'])
+            >>> copier.copy(os.path.join(source, 'one'), target,
+            ...             include=['c/*.txt'], exclude=['e.*'])
+            >>> copier.execute()
+            >>> ls(target)
+            d  c
+            d  zzb
+            >>> ls(target, 'c')
+            -  d.txt
+            >>> ls(target, 'zzb')
+            -  zzb.txt
+            d  zzd
         """
-        for root, __, files in os.walk(origin):
+        for root, directories, files in os.walk(origin):
+            if include or exclude:
+                relative = root[len(origin):].strip(os.sep).split(os.sep)
+                for directory in list(directories):
+                    if excluded('/'.join(relative + [directory]).lstrip('/'),
+                                include, exclude, True):
+                        directories.remove(directory)
+                        self.filtered.add(root)
+                kept = [
+                    f for f in files if not excluded(
+                        '/'.join(relative + [f]).lstrip('/'), include, exclude
+                    )
+                ]
+                if len(kept) < len(files):
+                    self.filtered.add(root)
+                files = kept
             for file_ in files:
                 file_origin = os.path.join(root, file_)
                 file_target = os.path.join(
@@ -333,6 +543,15 @@ class Copier(object):
                 return False
         return True
 
+    def is_complete(self, origin):
+        """Returns whether nothing has been filtered out of ``origin``, which
+        can then be copied as a whole.
+        """
+        for directory in self.filtered:
+            if directory == origin or directory.startswith(origin + os.sep):
+                return False
+        return True
+
     def _merge(self): # pylint: disable=R0912
         """Merges the operations that can be done "in bulk", because the
         subtrees are invariant.
@@ -343,7 +562,8 @@ class Copier(object):
         for path, hash_ in self.targets.subtrees(os.sep):
             target_trees[hash_] = path
         for path, hash_ in origin_trees:
-            if hash_ in target_trees and self.is_valid(target_trees[hash_]):
+            if hash_ in target_trees and self.is_valid(target_trees[hash_]) \
+                    and self.is_complete(path):
                 tree_operations.append(('tree', path, target_trees[hash_]))
         if len(tree_operations) > 0:
             tree_operations.sort(key=lambda x: x[1])
@@ -395,6 +615,11 @@ class Copier(object):
                     os.remove(target)
             if self.link and hasattr(os, 'symlink'):
                 os.symlink(source, target)
+            elif self.store is not None:
+                if type_ == 'tree':
+                    self.store.link_tree(source, target)
+                else:
+                    self.store.link(source, target)
             else:
                 if type_ == 'tree':
                     shutil.copytree(source, target)
@@ -0,0 +1,580 @@
+"""Serves the WSGI applications of many parts from a single one, routing the
+requests by their ``Host`` header.
+
+Django's settings are global to the process, so each site is served by a
+process of its own. Those are forked, on the first request for their site,
+from a process that has already imported the bulk of Django (and shares that
+memory with all of them), and stopped once their site has been idle for
+``idle_timeout`` seconds. That process is started by the first request, so
+that each worker of a server forking them has its own, and its own processes
+for the sites::
+
+    >>> from djc.recipe.dispatch import Dispatcher
+    >>> write(directory, 'blog.py', '''
+    ... import os
+    ... def application(environ, start_response):
+    ...     start_response('200 OK', [('Content-Type', 'text/plain')])
+    ...     return ['blog: ', environ['PATH_INFO'], ' ',
+    ...             environ['wsgi.input'].read()]
+    ... ''')
+    >>> dispatcher = Dispatcher([
+    ...     ('blog', ['blog.example.com', 'www.blog.example.com'],
+    ...      os.path.join(directory, 'blog.py')),
+    ...     ('shop', ['*.shop.example.com'],
+    ...      os.path.join(directory, 'shop.py')),
+    ... ], idle_timeout=60)
+    >>> dispatcher.route('WWW.Blog.example.com:8000').name
+    'blog'
+    >>> dispatcher.route('eu.shop.example.com').name
+    'shop'
+    >>> print dispatcher.route('example.com')
+    None
+    >>> def start_response(status, headers):
+    ...     print status
+    >>> environ = {
+    ...     'HTTP_HOST': 'blog.example.com', 'PATH_INFO': '/posts/',
+    ...     'CONTENT_LENGTH': '5', 'wsgi.input': StringIO('hello'),
+    ... }
+    >>> body = dispatcher(environ, start_response)
+    200 OK
+    >>> print ''.join(body)
+    blog: /posts/ hello
+    >>> body.close()
+    >>> dispatcher.loaded()
+    ['blog']
+    >>> dispatcher.unload_idle(time.time() + 61)
+    ['blog']
+    >>> dispatcher.loaded()
+    []
+    >>> dispatcher({'HTTP_HOST': 'example.com'}, start_response)
+    404 NOT FOUND
+    ['Unknown site: example.com\\n']
+    >>> dispatcher.close()
+"""
+
+import os, sys, time, errno, random, shutil, socket, struct, signal, \
+    logging, tempfile, threading, cPickle as pickle
+from wsgiutils import ClosingIterator, simple_response
+
+
+# Imported once, before forking the processes of the sites, that share them
+PRELOAD = (
+    'django.core.handlers.wsgi',
+    'django.core.urlresolvers',
+    'django.http',
+    'django.forms',
+    'django.template',
+    'django.template.defaulttags',
+    'django.template.defaultfilters',
+    # Which imports the loader tags, that fail to be imported first
+    'django.template.loader',
+    'django.utils.translation',
+)
+CHUNK_SIZE = 65536
+# Bigger request bodies are spooled to a temporary file by the site
+SPOOL_SIZE = 1024 * 1024
+
+logger = logging.getLogger('djc.recipe.dispatch')
+
+
+def send_frame(connection, data):
+    connection.sendall(struct.pack('!I', len(data)) + data)
+
+
+def read_frame(stream):
+    """Returns the next frame from ``stream``, raises ``EOFError`` if the
+    connection is closed before.
+    """
+    header = stream.read(4)
+    if len(header) < 4:
+        raise EOFError("Connection closed")
+    length, = struct.unpack('!I', header)
+    data = stream.read(length)
+    if len(data) < length:
+        raise EOFError("Connection closed")
+    return data
+
+
+def portable_environ(environ):
+    """Returns the part of ``environ`` that can be sent to another process.
+    """
+    return dict([
+        (key, value) for key, value in environ.items()
+        if isinstance(value, (basestring, int, long, bool, tuple))
+    ])
+
+
+def load_application(script):
+    """Executes the WSGI ``script`` (such as the ``app.py`` of a part),
+    returns its ``application``.
+    """
+    namespace = {'__name__': 'djc_recipe_site', '__file__': script}
+    execfile(script, namespace)
+    return namespace['application']
+
+
+def handle(application, connection):
+    """Serves, in the process of a site, a request sent by the dispatcher.
+    """
+    stream = connection.makefile('rb')
+    body = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    response = []
+    sent = []
+
+    def send_headers():
+        if not sent:
+            send_frame(connection, pickle.dumps(tuple(response), 2))
+            sent.append(True)
+
+    def write(data):
+        send_headers()
+        if data:
+            send_frame(connection, data)
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info is not None:
+            try:
+                if sent:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+            finally:
+                exc_info = None
+        response[:] = [status, headers]
+        return write
+
+    try:
+        try:
+            environ = pickle.loads(read_frame(stream))
+            while True:
+                chunk = read_frame(stream)
+                if not chunk:
+                    break
+                body.write(chunk)
+        except (EOFError, socket.error):
+            # The dispatcher gave up on the request
+            return
+        body.seek(0)
+        environ.update({
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        })
+        try:
+            result = application(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        write(chunk)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            send_headers()
+            send_frame(connection, '')
+        except Exception:
+            logger.exception("Failed to serve %s" % environ.get('PATH_INFO'))
+            if not sent:
+                # Otherwise, the dispatcher sees the response truncated
+                try:
+                    for chunk in simple_response(
+                            start_response, '500 INTERNAL SERVER ERROR',
+                            'Internal server error\n'):
+                        write(chunk)
+                    send_frame(connection, '')
+                except socket.error:
+                    pass
+    finally:
+        body.close()
+        stream.close()
+        connection.close()
+
+
+def serve_site(listener, script):
+    """Runs in the process of a site: loads its application and serves the
+    requests coming through ``listener``, each one in a thread.
+    """
+    parent = os.getppid()
+
+    def watch():
+        # Not to outlive the dispatcher, whatever the way it ends
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+
+    watcher = threading.Thread(target=watch, name='djc.recipe.dispatch')
+    watcher.daemon = True
+    watcher.start()
+    try:
+        application = load_application(script)
+    except Exception:
+        logger.exception("Cannot load '%s'" % script)
+
+        # Kept running, answering errors, rather than being forked again
+        # and again
+        def application(environ, start_response):
+            return simple_response(start_response,
+                                   '500 INTERNAL SERVER ERROR',
+                                   'The site cannot be loaded\n')
+    while True:
+        try:
+            connection, __ = listener.accept()
+        except socket.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        thread = threading.Thread(target=handle,
+                                  args=(application, connection))
+        thread.daemon = True
+        thread.start()
+
+
+def reap(children):
+    while children:
+        try:
+            pid, __ = os.waitpid(-1, os.WNOHANG)
+        except OSError:
+            break
+        if not pid:
+            break
+        children.pop(pid, None)
+
+
+def zygote(channel, directory):
+    """Runs in the process that forks the ones of the sites, as ordered
+    through ``channel``.
+    """
+    # Nothing of the dispatcher (such as the listening socket of the server)
+    # is kept open by the sites
+    try:
+        max_fd = os.sysconf('SC_OPEN_MAX')
+    except (AttributeError, ValueError):
+        max_fd = 1024
+    os.closerange(3, channel.fileno())
+    os.closerange(channel.fileno() + 1, max_fd)
+    for module in PRELOAD:
+        try:
+            __import__(module)
+        except Exception:
+            logger.debug("Cannot preload %s" % module, exc_info=True)
+    children = {}
+    stream = channel.makefile('rb')
+    try:
+        while True:
+            try:
+                message = pickle.loads(read_frame(stream))
+            except (EOFError, socket.error):
+                break
+            reap(children)
+            if message[0] == 'start':
+                __, name, script = message
+                address = os.path.join(directory, '%s.sock' % name)
+                if os.path.exists(address):
+                    os.remove(address)
+                listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                listener.bind(address)
+                listener.listen(128)
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        stream.close()
+                        channel.close()
+                        random.seed()
+                        serve_site(listener, script)
+                    finally:
+                        os._exit(1)
+                listener.close()
+                children[pid] = name
+                send_frame(channel, pickle.dumps((pid, address), 2))
+            elif message[0] == 'stop':
+                __, pid = message
+                if pid in children:
+                    try:
+                        os.kill(pid, signal.SIGTERM)
+                    except OSError:
+                        pass
+                send_frame(channel, pickle.dumps(None, 2))
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class Site(object):
+
+    def __init__(self, name, hosts, script):
+        self.name = name
+        self.hosts = [host.lower() for host in hosts]
+        self.script = script
+        self.pid = None
+        self.address = None
+        self.active = 0
+        self.last_used = 0
+
+
+class Dispatcher(object):
+    """Routes the requests to the ``sites``, a list of ``(name, hosts,
+    script)``. The hosts may start with ``*.``, to match all the subdomains.
+    """
+
+    def __init__(self, sites, idle_timeout=600):
+        self.sites = [Site(*site) for site in sites]
+        self.idle_timeout = idle_timeout
+        self._hosts = {}
+        self._wildcards = []
+        for site in self.sites:
+            for host in site.hosts:
+                if host.startswith('*.'):
+                    self._wildcards.append((host[1:], site))
+                else:
+                    self._hosts[host] = site
+        # The most specific first
+        self._wildcards.sort(key=lambda wildcard: -len(wildcard[0]))
+        self._lock = threading.Lock()
+        # Both started by the first request of the process: a server
+        # preloading the application forks its workers afterwards
+        self._zygote = None
+        self._reaper = None
+        self._closed = threading.Event()
+
+    def route(self, host):
+        """Returns the site serving ``host``, or ``None``.
+        """
+        host = host.lower()
+        if ':' in host and not host.endswith(']'):
+            host = host.rsplit(':', 1)[0]
+        host = host.rstrip('.')
+        if host in self._hosts:
+            return self._hosts[host]
+        for suffix, site in self._wildcards:
+            if host.endswith(suffix):
+                return site
+        return None
+
+    def loaded(self):
+        """Returns the names of the sites with a running process.
+        """
+        return [site.name for site in self.sites if site.pid is not None]
+
+    def _start_zygote(self):
+        directory = tempfile.mkdtemp(prefix='djc.recipe-dispatch-')
+        channel, remote = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                channel.close()
+                zygote(remote, directory)
+            finally:
+                os._exit(0)
+        remote.close()
+        self._zygote = (os.getpid(), pid, channel, channel.makefile('rb'))
+        for site in self.sites:
+            site.pid = site.address = None
+
+    def _start_reaper(self):
+        """Starts the thread unloading the idle sites, unless it runs in this
+        process (the threads do not survive a fork).
+        """
+        if self.idle_timeout and (self._reaper is None or
+                                  self._reaper[0] != os.getpid()):
+            reaper = threading.Thread(target=self._reap,
+                                      name='djc.recipe.dispatch')
+            reaper.daemon = True
+            reaper.start()
+            self._reaper = (os.getpid(), reaper)
+
+    def _order(self, *message):
+        """Sends ``message`` to the process forking the sites, returns its
+        answer. Must be called holding the lock.
+        """
+        for attempt in (0, 1):
+            if self._zygote is None or self._zygote[0] != os.getpid():
+                # The first order, or one of a worker forked by the server
+                self._start_zygote()
+                self._start_reaper()
+            __, pid, channel, stream = self._zygote
+            try:
+                send_frame(channel, pickle.dumps(message, 2))
+                return pickle.loads(read_frame(stream))
+            except (EOFError, socket.error):
+                if attempt:
+                    raise
+                logger.warning("The process forking the sites is gone, "
+                               "starting it again")
+                stream.close()
+                channel.close()
+                try:
+                    os.waitpid(pid, os.WNOHANG)
+                except OSError:
+                    pass
+                self._zygote = None
+
+    def load(self, site):
+        """Starts the process of ``site``, unless it is running, returns its
+        pid and address.
+        """
+        self._lock.acquire()
+        try:
+            if site.pid is None:
+                site.pid, site.address = self._order(
+                    'start', site.name, site.script
+                )
+                logger.info("Loaded %s (pid %d)" % (site.name, site.pid))
+            return site.pid, site.address
+        finally:
+            self._lock.release()
+
+    def _unload(self, site):
+        self._order('stop', site.pid)
+        logger.info("Unloaded %s (pid %d)" % (site.name, site.pid))
+        site.pid = site.address = None
+
+    def unload(self, site, pid):
+        """Stops the process ``pid`` of ``site``, if it is still the one
+        serving it.
+        """
+        self._lock.acquire()
+        try:
+            if site.pid == pid:
+                self._unload(site)
+        finally:
+            self._lock.release()
+
+    def unload_idle(self, now=None):
+        """Stops the processes of the sites that have been idle for more than
+        ``idle_timeout`` seconds, returns their names.
+        """
+        now = now or time.time()
+        unloaded = []
+        self._lock.acquire()
+        try:
+            for site in self.sites:
+                if site.pid is not None and not site.active and \
+                        now - site.last_used > self.idle_timeout:
+                    self._unload(site)
+                    unloaded.append(site.name)
+        finally:
+            self._lock.release()
+        return unloaded
+
+    def _reap(self):
+        interval = max(min(self.idle_timeout / 4.0, 60), 1)
+        while not self._closed.wait(interval):
+            try:
+                self.unload_idle()
+            except Exception:
+                logger.exception("Failed to unload the idle sites")
+
+    def connect(self, site):
+        """Returns a connection to the process of ``site``, starting it if
+        needed. Each connection must be given back through ``release``.
+        """
+        self._lock.acquire()
+        try:
+            site.active += 1
+            site.last_used = time.time()
+        finally:
+            self._lock.release()
+        try:
+            for attempt in (0, 1):
+                pid, address = self.load(site)
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    connection.connect(address)
+                    return connection
+                except socket.error, e:
+                    connection.close()
+                    if attempt or e.args[0] not in (errno.ECONNREFUSED,
+                                                    errno.ENOENT):
+                        raise
+                    logger.warning("The process of %s (pid %d) is gone" % (
+                        site.name, pid
+                    ))
+                    self.unload(site, pid)
+        except:
+            self.release(site)
+            raise
+
+    def release(self, site, *closing):
+        for item in closing:
+            item.close()
+        self._lock.acquire()
+        try:
+            site.active -= 1
+            site.last_used = time.time()
+        finally:
+            self._lock.release()
+
+    def forward(self, connection, environ):
+        """Sends the request to the process of the site.
+        """
+        send_frame(connection, pickle.dumps(portable_environ(environ), 2))
+        try:
+            remaining = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            remaining = 0
+        while remaining > 0:
+            chunk = environ['wsgi.input'].read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                break
+            send_frame(connection, chunk)
+            remaining -= len(chunk)
+        send_frame(connection, '')
+
+    def iter_response(self, stream):
+        while True:
+            chunk = read_frame(stream)
+            if not chunk:
+                return
+            yield chunk
+
+    def __call__(self, environ, start_response):
+        host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME', '')
+        site = self.route(host)
+        if site is None:
+            return simple_response(start_response, '404 NOT FOUND',
+                                   'Unknown site: %s\n' % host)
+        connection = self.connect(site)
+        stream = connection.makefile('rb')
+        try:
+            self.forward(connection, environ)
+            status, headers = pickle.loads(read_frame(stream))
+        except:
+            self.release(site, stream, connection)
+            raise
+        start_response(status, headers)
+        return ClosingIterator(
+            self.iter_response(stream),
+            lambda: self.release(site, stream, connection)
+        )
+
+    def close(self):
+        """Stops the processes of all the sites.
+        """
+        self._closed.set()
+        self._lock.acquire()
+        try:
+            if self._zygote is not None and self._zygote[0] == os.getpid():
+                __, pid, channel, stream = self._zygote
+                stream.close()
+                channel.close()
+                try:
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+            self._zygote = None
+            for site in self.sites:
+                site.pid = site.address = None
+        finally:
+            self._lock.release()
+        if self._reaper is not None and self._reaper[0] == os.getpid():
+            self._reaper[1].join()
+
+
+def main(settings, sites, idle_timeout=600):
+    """Returns the dispatcher of ``sites``: ``settings`` are not used, as
+    each site loads its own.
+    """
+    return Dispatcher(sites, idle_timeout)
@@ -0,0 +1,168 @@
+"""Worker readiness: connection warm-up and a cheap health check.
+
+``warm_up`` checks the connection to every configured database and cache,
+and loads the url configuration, so that the first requests served by a new
+worker do not pay for it. ``HealthMiddleware`` answers the health checks of
+load balancers without entering Django, reporting the worker as ready only
+once the warm-up has succeeded.
+
+    >>> from djc.recipe.health import HealthMiddleware, WarmUp
+    >>> attempts = []
+    >>> def failing(close=True):
+    ...     attempts.append(close)
+    ...     if len(attempts) == 1:
+    ...         return ["database 'default': connection refused"]
+    ...     return []
+    >>> warmup = WarmUp(failing, retry_interval=0)
+    >>> warmup()
+    False
+    >>> def start_response(status, headers):
+    ...     print status
+    >>> app = HealthMiddleware(None, '/_health', warmup)
+
+A failed warm-up is retried when the health is checked::
+
+    >>> warmup.ready
+    False
+    >>> app({'PATH_INFO': '/_health'}, start_response)
+    200 OK
+    ['OK\\n']
+
+The warm-up run when the application is loaded closes the connections, as the
+server may fork its workers afterwards, the one run in the process serving
+the requests keeps them::
+
+    >>> attempts
+    [True, False]
+
+While the warm-up is failing the worker is reported as unavailable, the
+details of the errors being only logged::
+
+    >>> app = HealthMiddleware(None, '/_health',
+    ...                        WarmUp(lambda close: ['spam']))
+    >>> app({'PATH_INFO': '/_health'}, start_response)
+    503 SERVICE UNAVAILABLE
+    ['NOT READY\\n']
+"""
+
+import os, time, logging, threading
+from wsgiutils import simple_response
+
+logger = logging.getLogger('djc.recipe.health')
+
+
+def warm_up(close=True):
+    """Opens (and validates) the connections to the databases and caches,
+    returns a list of error messages.
+
+    The pooled connections are then in their pool, for any thread to use.
+    With ``close``, the pools are closed as well, as the workers may be
+    forked after loading the application and would share them otherwise.
+    """
+    from django.conf import settings
+    from django.db import connections
+    from django.core.cache import cache, get_cache, DEFAULT_CACHE_ALIAS
+    from django.core.urlresolvers import get_resolver
+    from djc.recipe.pooled.base import close_pools
+    errors = []
+    for alias in settings.DATABASES:
+        connection = connections[alias]
+        try:
+            connection.cursor().close()
+        except Exception, e:
+            errors.append("database '%s': %s" % (alias, e))
+        # Back to the pool, if pooled, not kept by this thread
+        connection.close()
+    if close:
+        close_pools()
+    for alias in getattr(settings, 'CACHES', {}):
+        try:
+            # The instance most code uses, rather than a new one
+            if alias == DEFAULT_CACHE_ALIAS:
+                instance = cache
+            else:
+                instance = get_cache(alias)
+            instance.get('djc.recipe.warmup')
+        except Exception, e:
+            errors.append("cache '%s': %s" % (alias, e))
+    try:
+        get_resolver(None).url_patterns
+    except Exception, e:
+        errors.append("urlconf: %s" % e)
+    for error in errors:
+        logger.error("Warm-up failed for %s" % error)
+    return errors
+
+
+class WarmUp(object):
+    """Runs ``function`` (``warm_up`` by default) keeping track of whether it
+    succeeded: if it did not, ``check`` will try again, at most once every
+    ``retry_interval`` seconds.
+
+    Called directly, the connections are closed afterwards. ``warm`` and
+    ``check`` warm up again, keeping them, in the process serving the
+    requests.
+    """
+
+    def __init__(self, function=warm_up, retry_interval=5):
+        self.function = function
+        self.retry_interval = retry_interval
+        self.ready = False
+        self.errors = []
+        self._next_try = 0
+        # The process warmed up without closing the connections
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __call__(self, close=True):
+        self._lock.acquire()
+        try:
+            self._next_try = time.time() + self.retry_interval
+            self.errors = self.function(close)
+            self.ready = len(self.errors) == 0
+            if not close:
+                self._pid = os.getpid()
+        finally:
+            self._lock.release()
+        return self.ready
+
+    def warm(self):
+        """Warms up the process, unless done already.
+        """
+        if self._pid != os.getpid():
+            self(close=False)
+
+    def check(self):
+        if self._pid != os.getpid() or \
+                not self.ready and time.time() >= self._next_try:
+            self(close=False)
+        return self.ready
+
+
+class HealthMiddleware(object):
+    """Answers requests for ``path`` (if any) with ``200 OK`` if ``warmup`` (a
+    ``WarmUp``, if given) succeeded, ``503 SERVICE UNAVAILABLE`` otherwise.
+    The first request served by a process warms it up.
+    """
+
+    def __init__(self, application, path, warmup=None):
+        self.application = application
+        self.path = path
+        self.warmup = warmup
+
+    def __call__(self, environ, start_response):
+        if self.path is None or environ.get('PATH_INFO') != self.path:
+            if self.warmup is not None:
+                self.warmup.warm()
+            return self.application(environ, start_response)
+        headers = [('Cache-Control', 'no-cache')]
+        if self.warmup is None or self.warmup.check():
+            return simple_response(start_response, '200 OK', 'OK\n',
+                                   headers=headers)
+        # The errors, logged by the warm-up, are not for any caller to see
+        return simple_response(
+            start_response, '503 SERVICE UNAVAILABLE', 'NOT READY\n',
+            headers=headers + [
+                ('Retry-After', str(self.warmup.retry_interval))
+            ]
+        )
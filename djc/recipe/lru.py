@@ -0,0 +1,93 @@
+"""A thread safe, size bounded, least recently used mapping.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Keeps at most ``maxsize`` worth of values, evicting the least recently
+    used ones first. The "worth" of each value is given by ``sizeof`` and
+    defaults to ``1``, making ``maxsize`` the maximum number of entries.
+
+        >>> from djc.recipe.lru import LRUCache
+        >>> cache = LRUCache(10, sizeof=len)
+        >>> cache.set('a', 'aaaa')
+        >>> cache.set('b', 'bbbb')
+        >>> cache.get('a')
+        'aaaa'
+        >>> cache.set('c', 'cccc')
+        >>> cache.get('b') is None
+        True
+        >>> sorted(cache.keys())
+        ['a', 'c']
+        >>> cache.size
+        8
+
+    Values larger than the whole cache are not stored at all::
+
+        >>> cache.set('d', 'd' * 11)
+        >>> 'd' in cache
+        False
+    """
+
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return self._data.keys()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            try:
+                value, size = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = (value, size)
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        self._lock.acquire()
+        try:
+            self._discard(key)
+            if size > self.maxsize:
+                return
+            while self._data and self.size + size > self.maxsize:
+                self.size -= self._data.popitem(last=False)[1][1]
+            self._data[key] = (value, size)
+            self.size += size
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._discard(key)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+            self.size = 0
+        finally:
+            self._lock.release()
+
+    def _discard(self, key):
+        if key in self._data:
+            self.size -= self._data.pop(key)[1]
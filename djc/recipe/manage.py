@@ -3,7 +3,16 @@ from django.core.management import ManagementUtility
 from utils import setup_django
 
 
-def main(settings):
+def main(settings, memory_directory=None, profile_directory=None,
+         sampling_interval=None):
     setup_django(settings)
+    if memory_directory:
+        import atexit
+        from memory import install
+        reporter = install(memory_directory)
+        atexit.register(reporter.report, 'exit')
+    if profile_directory:
+        import profiling
+        profiling.install(profile_directory, sampling_interval)
     utility = ManagementUtility(sys.argv)
     utility.execute()
@@ -0,0 +1,318 @@
+"""Loads big JSON fixtures, without keeping them in memory.
+
+Unlike ``loaddata``, the fixtures are parsed incrementally, one object at a
+time::
+
+    >>> from StringIO import StringIO
+    >>> from djc.recipe.management.commands.load_fixtures import iter_objects
+    >>> stream = StringIO('[{"pk": 1}, {"pk": 2},\\n {"pk": "\\u00e8"}]')
+    >>> for obj in iter_objects(stream, chunk_size=4):
+    ...     print obj
+    {u'pk': 1}
+    {u'pk': 2}
+    {u'pk': u'\\xe8'}
+
+and the objects are inserted with ``bulk_create``, in batches, each model in
+its own transaction. Models that are not related to each other can be loaded
+by many threads at once: related models are always loaded by the same one, in
+the order they come in the fixtures::
+
+    >>> from django.contrib.auth.models import User, Group, Permission
+    >>> from django.contrib.sites.models import Site
+    >>> from djc.recipe.management.commands.load_fixtures import model_groups
+    >>> groups = model_groups([User, Group, Permission, Site])
+    >>> groups[User] is groups[Group] is groups[Permission]
+    True
+    >>> groups[Site] is groups[User]
+    False
+"""
+
+import os, re, gzip, time, codecs, threading, traceback, Queue
+from optparse import make_option
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+SEPARATORS = re.compile(r'[\s,]*')
+EXTENSIONS = ('.json', '.json.gz')
+
+
+def iter_objects(stream, chunk_size=65536):
+    """Yields the objects of the JSON array in ``stream``, reading
+    ``chunk_size`` bytes at a time.
+    """
+    reader = codecs.getreader('utf-8')(stream)
+    decoder = json.JSONDecoder()
+    buffer = reader.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("The fixture is not a JSON array")
+    position = 1
+    eof = False
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if buffer[position:position + 1] == ']':
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            # Most likely, the object goes on in the next chunk
+            if eof:
+                raise ValueError("The fixture is truncated or invalid")
+            chunk = reader.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield obj
+        position = end
+
+
+def model_groups(models):
+    """Returns a mapping of each of ``models`` to the representative of the
+    group of the ones it is related with.
+    """
+    parents = dict([(model, model) for model in models])
+
+    def find(model):
+        while parents[model] is not model:
+            model = parents[model]
+        return model
+
+    for model in models:
+        for field in model._meta.fields + model._meta.many_to_many:
+            if field.rel is not None and field.rel.to in parents:
+                parents[find(model)] = find(field.rel.to)
+            through = getattr(field.rel, 'through', None)
+            if through in parents:
+                parents[find(through)] = find(model)
+    return dict([(model, find(model)) for model in models])
+
+
+def open_fixture(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+class Worker(threading.Thread):
+    """Saves the batches of objects put in its ``queue``, committing each
+    time the model changes. The constraints of all the tables it loaded are
+    checked once, before the last commit, as the objects may refer to the
+    ones that come later.
+    """
+
+    def __init__(self, using):
+        threading.Thread.__init__(self, name='djc.recipe.load_fixtures')
+        self.daemon = True
+        self.using = using
+        self.queue = Queue.Queue(maxsize=4)
+        self.counts = {}
+        self.tables = set()
+        self.error = None
+
+    def save(self, model, objects):
+        self.tables.add(model._meta.db_table)
+        if model._meta.parents:
+            # Multi-table inheritance rules bulk_create out
+            for obj in objects:
+                obj.save(using=self.using)
+            self.tables.update([
+                parent._meta.db_table
+                for parent in model._meta.get_parent_list()
+            ])
+        else:
+            model._base_manager.db_manager(self.using).bulk_create(
+                [obj.object for obj in objects]
+            )
+            for field in model._meta.many_to_many:
+                self.save_relations(field, objects)
+        self.counts[model] = self.counts.get(model, 0) + len(objects)
+
+    def save_relations(self, field, objects):
+        """Inserts the rows of the intermediary table of ``field`` for
+        ``objects``, in bulk as well.
+        """
+        through = field.rel.through
+        source = through._meta.get_field(field.m2m_field_name()).attname
+        target = through._meta.get_field(
+            field.m2m_reverse_field_name()
+        ).attname
+        rows = []
+        for obj in objects:
+            for value in (obj.m2m_data or {}).get(field.name, ()):
+                rows.append(through(**{
+                    source: obj.object.pk, target: value
+                }))
+        if rows:
+            through._base_manager.db_manager(self.using).bulk_create(rows)
+            self.tables.add(through._meta.db_table)
+
+    def commit(self, last=False):
+        from django.db import connections, transaction
+        if last and self.tables:
+            connections[self.using].check_constraints(
+                table_names=sorted(self.tables)
+            )
+        transaction.commit(using=self.using)
+
+    def run(self):
+        from django.db import connections, transaction
+        using = self.using
+        transaction.enter_transaction_management(using=using)
+        transaction.managed(True, using=using)
+        try:
+            current = None
+            with connections[using].constraint_checks_disabled():
+                while True:
+                    item = self.queue.get()
+                    if item is None:
+                        break
+                    if self.error is not None:
+                        # Keeps taking them, not to block the parsing
+                        continue
+                    model, objects = item
+                    try:
+                        if model is not current:
+                            if current is not None:
+                                self.commit()
+                            current = model
+                        self.save(model, objects)
+                    except Exception:
+                        self.error = traceback.format_exc()
+                        transaction.rollback(using=using)
+            if self.error is None:
+                try:
+                    self.commit(last=True)
+                except Exception:
+                    self.error = traceback.format_exc()
+                    transaction.rollback(using=using)
+        finally:
+            transaction.leave_transaction_management(using=using)
+            connections[using].close()
+
+
+class Command(BaseCommand):
+    args = '[fixture ...]'
+    help = ("Loads the given JSON fixtures (all the ones in FIXTURE_DIRS by "
+            "default) streaming them, with bulk inserts.")
+    option_list = BaseCommand.option_list + (
+        make_option('--database', default=DEFAULT_DB_ALIAS,
+                    help="The database to load the fixtures into."),
+        make_option('--batch-size', type='int', default=1000,
+                    help="How many objects are inserted at once."),
+        make_option('--workers', type='int', default=1,
+                    help="How many threads load unrelated models at the "
+                         "same time."),
+    )
+
+    def find_fixtures(self, names):
+        directories = list(getattr(settings, 'FIXTURE_DIRS', ()))
+        if not names:
+            found = []
+            for directory in directories:
+                found.extend(sorted([
+                    os.path.join(directory, f) for f in os.listdir(directory)
+                    if f.endswith(EXTENSIONS)
+                ]))
+            return found
+        found = []
+        for name in names:
+            candidates = [name] + [name + e for e in EXTENSIONS]
+            paths = [c for c in candidates if os.path.isfile(c)] + [
+                os.path.join(d, c) for d in directories for c in candidates
+                if os.path.isfile(os.path.join(d, c))
+            ]
+            if not paths:
+                raise CommandError("No fixture named '%s'" % name)
+            found.append(paths[0])
+        return found
+
+    def handle(self, *names, **options):
+        from django.core.management.color import no_style
+        from django.core.serializers import python
+        from django.db import connections, transaction
+        from django.db.models import get_models
+        using = options['database']
+        batch_size = options['batch_size']
+        verbosity = int(options.get('verbosity', 1))
+        filenames = self.find_fixtures(names)
+        groups = model_groups(get_models(include_auto_created=True))
+        workers = [Worker(using) for __ in range(max(options['workers'], 1))]
+        for worker in workers:
+            worker.start()
+        assigned = {}
+
+        def failed():
+            return [w for w in workers if w.error is not None]
+
+        def dispatch(model, objects):
+            group = groups.get(model, model)
+            if group not in assigned:
+                assigned[group] = workers[len(assigned) % len(workers)]
+            assigned[group].queue.put((model, objects))
+
+        start = time.time()
+        try:
+            for filename in filenames:
+                if failed():
+                    break
+                if verbosity > 0:
+                    self.stdout.write("Loading %s\n" % filename)
+                stream = open_fixture(filename)
+                try:
+                    model, objects = None, []
+                    for obj in python.Deserializer(iter_objects(stream),
+                                                   using=using):
+                        if obj.object.__class__ is not model or \
+                                len(objects) >= batch_size:
+                            if objects:
+                                dispatch(model, objects)
+                            if failed():
+                                break
+                            model, objects = obj.object.__class__, []
+                        objects.append(obj)
+                    if objects:
+                        dispatch(model, objects)
+                finally:
+                    stream.close()
+        finally:
+            for worker in workers:
+                worker.queue.put(None)
+            for worker in workers:
+                worker.join()
+        if failed():
+            raise CommandError("Failed to load the fixtures:\n%s" % (
+                '\n'.join([w.error for w in failed()]),
+            ))
+        elapsed = max(time.time() - start, 0.001)
+        counts = {}
+        for worker in workers:
+            counts.update(worker.counts)
+        if counts:
+            connection = connections[using]
+            sequence_sql = connection.ops.sequence_reset_sql(
+                no_style(), counts.keys()
+            )
+            if sequence_sql:
+                cursor = connection.cursor()
+                for line in sequence_sql:
+                    cursor.execute(line)
+                transaction.commit_unless_managed(using=using)
+        if verbosity > 1:
+            for model, count in sorted(counts.items(),
+                                       key=lambda i: i[0]._meta.db_table):
+                self.stdout.write("%s.%s: %d rows\n" % (
+                    model._meta.app_label, model._meta.object_name, count
+                ))
+        total = sum(counts.values())
+        self.stdout.write(
+            "Loaded %d rows from %d fixtures in %.1f seconds "
+            "(%d rows/s)\n" % (
+                total, len(filenames), elapsed, total / elapsed
+            )
+        )
@@ -0,0 +1,121 @@
+"""Migrates (or, without South, syncs) all the configured databases at once.
+
+The applications are loaded once, then a process is forked for each database
+(at most ``--processes`` at a time), so that none of them pays the start up
+of Django again. The output of each one is prefixed with its alias, line by
+line::
+
+    >>> import sys
+    >>> from djc.recipe.management.commands.migrate_all import PrefixedStream
+    >>> stream = PrefixedStream(sys.stdout, 'replica')
+    >>> stream.write('Syncing...\\nCreating tables')
+    [replica] Syncing...
+    >>> stream.write(' ...\\n')
+    [replica] Creating tables ...
+"""
+
+import sys, traceback, multiprocessing
+from optparse import make_option
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from djc.recipe.pooled.base import close_pools
+
+
+class PrefixedStream(object):
+    """Writes to ``stream`` the complete lines it is given, prefixed with
+    ``[alias]``.
+    """
+
+    def __init__(self, stream, alias):
+        self.stream = stream
+        self.prefix = '[%s] ' % alias
+        self.pending = ''
+
+    def write(self, data):
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        if lines:
+            # All at once, so that lines from other processes do not get mixed
+            self.stream.write(''.join([
+                '%s%s\n' % (self.prefix, line) for line in lines
+            ]))
+            self.stream.flush()
+
+    def flush(self):
+        if self.pending:
+            self.write('\n')
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+def migrate(alias, command, options):
+    """Runs ``command`` on ``alias``, returns whether it succeeded.
+    """
+    stdout = sys.stdout = PrefixedStream(sys.__stdout__, alias)
+    stderr = sys.stderr = PrefixedStream(sys.__stderr__, alias)
+    try:
+        try:
+            call_command(command, database=alias, interactive=False,
+                         stdout=stdout, stderr=stderr, **options)
+            return True
+        except (Exception, SystemExit):
+            traceback.print_exc(file=stderr)
+            return False
+    finally:
+        stdout.flush()
+        stderr.flush()
+
+
+def migrate_star(arguments):
+    return migrate(*arguments)
+
+
+class Command(BaseCommand):
+    args = '[alias ...]'
+    help = ("Migrates (or syncs, without South) the given databases, all the "
+            "configured ones by default, in parallel.")
+    option_list = BaseCommand.option_list + (
+        make_option('-p', '--processes', type='int', default=None,
+                    help="How many databases are migrated at the same time "
+                         "(all of them by default)."),
+    )
+
+    def handle(self, *aliases, **options):
+        from django.db import connections
+        from django.db.models import get_apps
+        aliases = aliases or list(settings.DATABASES)
+        unknown = [a for a in aliases if a not in settings.DATABASES]
+        if unknown:
+            raise CommandError("Unknown databases: %s" % ', '.join(unknown))
+        if 'south' in settings.INSTALLED_APPS:
+            command = 'migrate'
+        else:
+            command = 'syncdb'
+        command_options = {'verbosity': int(options.get('verbosity', 1))}
+        # Loaded once, before forking, rather than in each process
+        get_apps()
+        for connection in connections.all():
+            connection.close()
+        # The pooled connections are only given back to their pool by
+        # close(), the processes must not share them
+        close_pools()
+        processes = min(options['processes'] or len(aliases), len(aliases))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(migrate_star, [
+                (alias, command, command_options) for alias in aliases
+            ], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        failed = [a for a, ok in zip(aliases, results) if not ok]
+        if failed:
+            raise CommandError("Failed to %s: %s" % (
+                command, ', '.join(failed)
+            ))
+        self.stdout.write("%s done on %s\n" % (
+            command.capitalize(), ', '.join(aliases)
+        ))
@@ -0,0 +1,23 @@
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from djc.recipe.storage import ShardedFileSystemStorage
+
+
+class Command(NoArgsCommand):
+    help = ("Moves the files in MEDIA_ROOT from the flat layout to the one "
+            "used by djc.recipe.storage.ShardedFileSystemStorage.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--workers', type='int', default=8,
+                    help="How many files are moved at the same time."),
+        make_option('--dry-run', action='store_true', default=False,
+                    help="Only count the files that would be moved."),
+    )
+
+    def handle_noargs(self, **options):
+        storage = ShardedFileSystemStorage()
+        if options['dry_run']:
+            count = len(list(storage.flat_files()))
+            self.stdout.write("%d files to move\n" % count)
+        else:
+            count = storage.shard_all(options['workers'])
+            self.stdout.write("%d files moved\n" % count)
@@ -0,0 +1,179 @@
+"""Memory diagnostics for long running processes.
+
+A ``MemoryReporter`` takes a snapshot of the memory allocations each time it
+is asked for a report, compares it with the previous one, and appends the
+top growing allocators, together with the resident set size of the process,
+to a per process report file. Allocations are traced by file and line with
+``tracemalloc`` where the interpreter has it; otherwise, live objects are
+counted by type::
+
+    >>> from djc.recipe.memory import MemoryReporter
+    >>> reporter = MemoryReporter(directory, top=5)
+    >>> reporter.report('start')
+    True
+    >>> leak = [dict() for i in range(10000)]
+    >>> reporter.report('after the leak')
+    True
+    >>> print open(reporter.filename).read() #doctest: +ELLIPSIS
+    === ... start: RSS ... kB
+    ...
+    === ... after the leak: RSS ... kB (+... kB)
+    ...dict...
+    <BLANKLINE>
+
+``install`` makes a process write a report whenever it receives ``SIGUSR2``,
+and ``MemoryMiddleware`` makes a WSGI application write one every given
+number of requests.
+"""
+
+import os, gc, sys, time, signal, logging, threading
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+logger = logging.getLogger('djc.recipe.memory')
+
+
+def rss():
+    """Returns the resident set size of the process, in bytes.
+    """
+    try:
+        f = open('/proc/self/statm', 'rb')
+        try:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError, IndexError):
+        import resource
+        # The peak, not the current size, but the best we have here
+        multiplier = sys.platform == 'darwin' and 1 or 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * multiplier
+
+
+def count_types():
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+class MemoryReporter(object):
+    """Writes reports on the memory use to ``memory-<pid>.log`` in
+    ``directory``, listing the ``top`` growing allocators.
+    """
+
+    def __init__(self, directory, top=20):
+        self.directory = directory
+        self.top = top
+        self.previous = None
+        self.previous_rss = None
+        self._lock = threading.Lock()
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @property
+    def filename(self):
+        # Computed each time, as workers may be forked after the setup
+        return os.path.join(self.directory, 'memory-%d.log' % os.getpid())
+
+    def snapshot(self):
+        if tracemalloc is not None:
+            return tracemalloc.take_snapshot()
+        return count_types()
+
+    def differences(self, current):
+        if tracemalloc is not None:
+            if self.previous is None:
+                stats = current.statistics('lineno')
+            else:
+                stats = current.compare_to(self.previous, 'lineno')
+            return [str(stat) for stat in stats[:self.top]]
+        previous = self.previous or {}
+        growth = [
+            (count - previous.get(name, 0), name, count)
+            for name, count in current.items()
+        ]
+        growth.sort(reverse=True)
+        return [
+            '%+d %s (%d objects)' % (difference, name, count)
+            for difference, name, count in growth[:self.top]
+        ]
+
+    def report(self, reason='', blocking=True):
+        """Writes a report, unless another one is being written and not
+        ``blocking``. Returns whether it did.
+
+            >>> reporter = MemoryReporter(directory)
+            >>> reporter._lock.acquire()
+            True
+            >>> reporter.report('signal', blocking=False)
+            False
+        """
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            current = self.snapshot()
+            size = rss()
+            header = '=== %s %s: RSS %d kB' % (
+                time.strftime('%Y-%m-%d %H:%M:%S'), reason, size / 1024
+            )
+            if self.previous_rss is not None:
+                header += ' (%+d kB)' % ((size - self.previous_rss) / 1024)
+            lines = [header] + self.differences(current)
+            self.previous = current
+            self.previous_rss = size
+            f = open(self.filename, 'ab')
+            try:
+                f.write('\n'.join(lines) + '\n')
+            finally:
+                f.close()
+        finally:
+            self._lock.release()
+        return True
+
+
+def install(directory, top=20, signum=signal.SIGUSR2):
+    """Sets up a ``MemoryReporter`` writing a report on ``signum``, returns
+    it.
+    """
+    reporter = MemoryReporter(directory, top)
+
+    def handler(signum, frame):
+        # The signal may interrupt a report of this very thread, waiting for
+        # it would never end
+        if not reporter.report('signal', blocking=False):
+            logger.warning("Skipping the memory report, one is in progress")
+
+    try:
+        signal.signal(signum, handler)
+    except ValueError:
+        # Not in the main thread, as within some WSGI servers
+        logger.warning("Cannot handle signal %d for memory reports" % signum)
+    reporter.report('start')
+    return reporter
+
+
+class MemoryMiddleware(object):
+    """Makes ``reporter`` write a report every ``every`` requests.
+    """
+
+    def __init__(self, application, reporter, every):
+        self.application = application
+        self.reporter = reporter
+        self.every = every
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            due = self.requests % self.every == 0
+        finally:
+            self._lock.release()
+        if due:
+            self.reporter.report('%d requests' % self.requests)
+        return self.application(environ, start_response)
@@ -0,0 +1,260 @@
+"""Compiles the translation catalogs (``.po`` files) to ``.mo`` files.
+
+The catalogs are the ``locale/<locale>/LC_MESSAGES/*.po`` files found within
+the given directories, for the given languages (all of them if none is
+given)::
+
+    >>> from djc.recipe.messages import find_catalogs, compile_catalogs
+    >>> write(directory, 'app', 'locale', 'it', 'LC_MESSAGES', 'django.po', '''
+    ... msgid ""
+    ... msgstr ""
+    ... "Content-Type: text/plain; charset=UTF-8\\\\n"
+    ... "Plural-Forms: nplurals=2; plural=(n != 1);\\\\n"
+    ...
+    ... msgid "Hello"
+    ... msgstr "Ciao"
+    ...
+    ... msgctxt "month"
+    ... msgid "May"
+    ... msgstr "Maggio"
+    ...
+    ... #, fuzzy
+    ... msgid "Bye"
+    ... msgstr "Arrivederci"
+    ...
+    ... msgid "one apple"
+    ... msgid_plural "%d apples"
+    ... msgstr[0] "una mela"
+    ... msgstr[1] "%d "
+    ... "mele"
+    ... ''')
+    >>> write(directory, 'app', 'locale', 'de', 'LC_MESSAGES', 'django.po', '')
+    >>> catalogs = list(find_catalogs([directory], ['it', 'pt-br']))
+    >>> [c[len(directory):] for c in catalogs]
+    ['/app/locale/it/LC_MESSAGES/django.po']
+
+They are compiled by many processes, without the ``msgfmt`` program; the
+ones that did not change since the last time (as recorded in ``state``) are
+skipped::
+
+    >>> state = os.path.join(directory, 'messages.json')
+    >>> compile_catalogs(catalogs, state, processes=2)
+    (1, 0, [])
+    >>> compile_catalogs(catalogs, state, processes=2)
+    (0, 1, [])
+
+So are the ones whose ``.mo`` file is newer, as those shipped with the eggs,
+unless it is missing::
+
+    >>> os.remove(state)
+    >>> compile_catalogs(catalogs, state, processes=2)
+    (0, 1, [])
+    >>> os.remove(os.path.join(
+    ...     directory, 'app', 'locale', 'it', 'LC_MESSAGES', 'django.mo'))
+    >>> compile_catalogs(catalogs, state, processes=2)
+    (1, 0, [])
+    >>> import gettext
+    >>> translations = gettext.GNUTranslations(open(os.path.join(
+    ...     directory, 'app', 'locale', 'it', 'LC_MESSAGES', 'django.mo')))
+    >>> print translations.gettext('Hello'), translations.gettext('Bye')
+    Ciao Bye
+    >>> print translations.gettext('month\\x04May')
+    Maggio
+    >>> print translations.ngettext('one apple', '%d apples', 2) % 2
+    2 mele
+"""
+
+import os, ast, array, struct, hashlib, tempfile, multiprocessing
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+def to_locale(language):
+    """Turns a language code (``pt-br``) in a locale name (``pt_BR``).
+    """
+    language, __, country = language.lower().partition('-')
+    if not country:
+        return language
+    if len(country) > 2:
+        return '%s_%s' % (language, country.capitalize())
+    return '%s_%s' % (language, country.upper())
+
+
+def find_catalogs(directories, languages=()):
+    """Yields the ``.po`` files of ``languages`` within ``directories``.
+    """
+    locales = set()
+    for language in languages:
+        locale = to_locale(language)
+        locales.update([locale, locale.split('_')[0]])
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            parent, locale = os.path.split(os.path.dirname(root))
+            if os.path.basename(root) != 'LC_MESSAGES' or \
+                    os.path.basename(parent) != 'locale' or \
+                    (locales and locale not in locales):
+                continue
+            for file_ in sorted(files):
+                if file_.endswith('.po'):
+                    yield os.path.join(root, file_)
+
+
+def read_po(filename):
+    """Returns the translated (and not fuzzy) messages of ``filename``, as a
+    mapping of the ids to the strings, both encoded as in the file.
+    """
+    messages = {}
+    entry, field, fuzzy = None, None, False
+
+    def add(entry, fuzzy):
+        strings = [entry['msgstr'][i] for i in sorted(entry['msgstr'])]
+        # As msgfmt, untranslated if the first string is empty
+        if fuzzy or 'msgid' not in entry or not strings[0]:
+            return
+        key = entry['msgid']
+        if 'msgid_plural' in entry:
+            key += '\0' + entry['msgid_plural']
+        if 'msgctxt' in entry:
+            key = entry['msgctxt'] + '\x04' + key
+        messages[key] = '\0'.join(strings)
+
+    f = open(filename, 'rb')
+    try:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#'):
+                if entry is not None and entry['msgstr']:
+                    add(entry, fuzzy)
+                    entry, fuzzy = None, False
+                if line.startswith('#,') and 'fuzzy' in line:
+                    fuzzy = True
+                continue
+            if not line.startswith('"'):
+                keyword, line = line.split(None, 1)
+                if keyword in ('msgctxt', 'msgid') and entry is not None \
+                        and entry['msgstr']:
+                    add(entry, fuzzy)
+                    entry, fuzzy = None, False
+                if entry is None:
+                    entry = {'msgstr': {}}
+                if keyword.startswith('msgstr'):
+                    index = keyword[7:-1] and int(keyword[7:-1]) or 0
+                    field = entry['msgstr'], index
+                else:
+                    field = entry, keyword
+                field[0][field[1]] = ''
+            if field is None:
+                raise ValueError("Syntax error in %s: %s" % (filename, line))
+            field[0][field[1]] += ast.literal_eval(line)
+        if entry is not None and entry['msgstr']:
+            add(entry, fuzzy)
+    finally:
+        f.close()
+    return messages
+
+
+def write_mo(messages, filename):
+    """Writes ``messages`` to ``filename`` in the GNU ``.mo`` format.
+    """
+    keys = sorted(messages)
+    ids, strings, offsets = [], [], []
+    ids_size = strings_size = 0
+    for key in keys:
+        value = messages[key]
+        offsets.append((ids_size, len(key), strings_size, len(value)))
+        ids.append(key + '\0')
+        strings.append(value + '\0')
+        ids_size += len(key) + 1
+        strings_size += len(value) + 1
+    # The header, the tables of the ids and of the strings, then the data
+    ids_start = 7 * 4 + 16 * len(keys)
+    strings_start = ids_start + ids_size
+    ids_table, strings_table = [], []
+    for id_offset, id_length, string_offset, string_length in offsets:
+        ids_table.extend([id_length, ids_start + id_offset])
+        strings_table.extend([string_length, strings_start + string_offset])
+    data = [
+        struct.pack('Iiiiiii', 0x950412de, 0, len(keys), 7 * 4,
+                    7 * 4 + 8 * len(keys), 0, 0),
+        array.array('i', ids_table + strings_table).tostring(),
+    ] + ids + strings
+    directory = os.path.dirname(filename)
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    try:
+        os.write(fd, ''.join(data))
+        os.close(fd)
+        os.chmod(temp, 0644)
+        os.rename(temp, filename)
+    except:
+        os.remove(temp)
+        raise
+
+
+def digest(filename):
+    f = open(filename, 'rb')
+    try:
+        return hashlib.sha1(f.read()).hexdigest()
+    finally:
+        f.close()
+
+
+def compile_catalog(filename):
+    """Compiles ``filename``, returns the error if it fails.
+    """
+    try:
+        write_mo(read_po(filename), os.path.splitext(filename)[0] + '.mo')
+    except Exception, e:
+        return '%s: %s' % (filename, e)
+    return None
+
+
+def is_stale(catalog):
+    """Returns whether the ``.mo`` file of ``catalog`` is older than it.
+    """
+    compiled = os.path.splitext(catalog)[0] + '.mo'
+    return os.path.getmtime(compiled) < os.path.getmtime(catalog)
+
+
+def compile_catalogs(catalogs, state, processes=None):
+    """Compiles, with ``processes`` processes, the ``catalogs`` that changed
+    since the last time, as recorded in the ``state`` file, and whose ``.mo``
+    file is missing or older. Returns how many have been compiled and
+    skipped, and the errors.
+    """
+    try:
+        f = open(state, 'rb')
+        try:
+            digests = json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        digests = {}
+    current = dict([(catalog, digest(catalog)) for catalog in catalogs])
+    changed = [
+        catalog for catalog in catalogs
+        if not os.path.isfile(os.path.splitext(catalog)[0] + '.mo') or
+            is_stale(catalog) and digests.get(catalog) != current[catalog]
+    ]
+    errors = []
+    if changed:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(compile_catalog, changed)
+        finally:
+            pool.close()
+            pool.join()
+        for catalog, error in zip(changed, results):
+            if error is not None:
+                errors.append(error)
+                current.pop(catalog)
+    f = open(state, 'wb')
+    try:
+        json.dump(current, f)
+    finally:
+        f.close()
+    return len(changed) - len(errors), len(catalogs) - len(changed), errors
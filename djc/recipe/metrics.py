@@ -0,0 +1,400 @@
+"""In-process request instrumentation for the generated WSGI application.
+
+Latencies are kept in memory, per URL pattern and HTTP method, as histograms
+that can be exposed in the Prometheus_ text format, either on an internal path
+answered by the wrapper itself or by periodically writing a text file (for
+``node_exporter``'s textfile collector).
+
+Let's wrap a dummy application, labelling requests by their path (by default
+the name of the matching Django url pattern is used)::
+
+    >>> from djc.recipe.metrics import MetricsMiddleware, Registry
+    >>> def app(environ, start_response):
+    ...     start_response('200 OK', [('Content-Type', 'text/plain')])
+    ...     return ['Hello']
+    >>> registry = Registry()
+    >>> wrapped = MetricsMiddleware(
+    ...     app, registry=registry, path='/_metrics',
+    ...     label=lambda environ: environ['PATH_INFO']
+    ... )
+    >>> def start_response(status, headers):
+    ...     print status
+    >>> body = wrapped({'PATH_INFO': '/hello', 'REQUEST_METHOD': 'GET'},
+    ...                start_response)
+    200 OK
+    >>> list(body)
+    ['Hello']
+
+The request is accounted for only when the server closes the response, so
+that streaming is timed as well::
+
+    >>> registry.expose()
+    ''
+    >>> body.close()
+    >>> print registry.expose() #doctest: +ELLIPSIS
+    # HELP djc_request_duration_seconds Time spent serving requests.
+    # TYPE djc_request_duration_seconds histogram
+    djc_request_duration_seconds_bucket{pattern="/hello",method="GET",le="0.005"} 1
+    ...
+    djc_request_duration_seconds_bucket{pattern="/hello",method="GET",le="+Inf"} 1
+    djc_request_duration_seconds_sum{pattern="/hello",method="GET"} ...
+    djc_request_duration_seconds_count{pattern="/hello",method="GET"} 1
+    <BLANKLINE>
+
+A request whose label cannot be computed is still accounted for, under a
+fixed label, rather than failing when the server closes the response::
+
+    >>> def broken(environ):
+    ...     raise ValueError(environ['PATH_INFO'])
+    >>> failing = MetricsMiddleware(app, registry=Registry(), label=broken)
+    >>> body = failing({'PATH_INFO': '/spam', 'REQUEST_METHOD': 'GET'},
+    ...                start_response)
+    200 OK
+    >>> body.close()
+    >>> print failing.registry.expose() #doctest: +ELLIPSIS
+    # HELP ...
+    djc_request_duration_seconds_count{pattern="<unknown>",method="GET"} 1
+    <BLANKLINE>
+
+The same text is what the internal path answers::
+
+    >>> body = wrapped({'PATH_INFO': '/_metrics', 'REQUEST_METHOD': 'GET'},
+    ...                start_response)
+    200 OK
+    >>> body[0] == registry.expose()
+    True
+
+.. _Prometheus: http://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import os, re, time, random, bisect, logging, tempfile, threading
+try:
+    import cProfile as profile
+except ImportError:
+    import profile
+from lru import LRUCache
+from wsgiutils import ClosingIterator, simple_response
+
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNMATCHED = '<unmatched>'
+# The label of the requests the label function failed for
+UNKNOWN = '<unknown>'
+
+logger = logging.getLogger('djc.recipe.metrics')
+
+
+def format_labels(labels):
+    """Formats a sequence of ``(name, value)`` pairs as a label set.
+
+        >>> from djc.recipe.metrics import format_labels
+        >>> print format_labels([('path', '/a"b'), ('le', '+Inf')])
+        {path="/a\\"b",le="+Inf"}
+    """
+    if not labels:
+        return ''
+    return '{%s}' % ','.join([
+        '%s="%s"' % (
+            name,
+            str(value).replace('\\', r'\\').replace('\n', r'\n').replace(
+                '"', r'\"'
+            )
+        )
+        for name, value in labels
+    ])
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Registry(object):
+    """A collection of metrics exposed together.
+
+    Anything having an ``expose`` method returning a list of lines can be
+    registered. A metric is registered once by name: registering another one
+    with the same name (as does the application, built again in the same
+    process) returns the first one::
+
+        >>> from djc.recipe.metrics import Registry, Counter
+        >>> registry = Registry()
+        >>> first = registry.register(Counter('djc_things_total', 'Things.'))
+        >>> registry.register(Counter('djc_things_total', 'Things.')) is first
+        True
+        >>> len(registry.collectors)
+        1
+    """
+
+    def __init__(self):
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, collector):
+        name = getattr(collector, 'name', None)
+        self._lock.acquire()
+        try:
+            for registered in self.collectors:
+                if name is not None and \
+                        getattr(registered, 'name', None) == name:
+                    return registered
+            self.collectors.append(collector)
+            return collector
+        finally:
+            self._lock.release()
+
+    def expose(self):
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.expose())
+        if not lines:
+            return ''
+        return '\n'.join(lines) + '\n'
+
+
+# The registry used by the WSGI layers unless told otherwise
+registry = Registry()
+
+
+class Histogram(object):
+    """A thread safe, labelled histogram.
+    """
+
+    def __init__(self, name, documentation, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, values, amount):
+        index = bisect.bisect_left(self.buckets, amount)
+        self._lock.acquire()
+        try:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * len(self.buckets), 0.0]
+            series[0][index] += 1
+            series[1] += amount
+        finally:
+            self._lock.release()
+
+    def expose(self):
+        self._lock.acquire()
+        try:
+            series = sorted([
+                (values, list(counts), total)
+                for values, (counts, total) in self._series.iteritems()
+            ])
+        finally:
+            self._lock.release()
+        if not series:
+            return []
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s histogram' % self.name
+        ]
+        for values, counts, total in series:
+            labels = zip(self.labels, values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    format_labels(labels + [('le', format_value(bound))]),
+                    cumulative
+                ))
+            lines.append('%s_sum%s %s' % (
+                self.name, format_labels(labels), repr(total)
+            ))
+            lines.append('%s_count%s %d' % (
+                self.name, format_labels(labels), cumulative
+            ))
+        return lines
+
+
+class Counter(object):
+    """A thread safe, labelled counter (or, with ``kind`` set to ``gauge``, a
+    value that can go down aswell).
+
+        >>> from djc.recipe.metrics import Counter
+        >>> counter = Counter('djc_things_total', 'Things.', ('kind',))
+        >>> counter.inc(('spam',))
+        >>> counter.inc(('spam',), 2)
+        >>> counter.value(('spam',))
+        3
+        >>> print '\\n'.join(counter.expose())
+        # HELP djc_things_total Things.
+        # TYPE djc_things_total counter
+        djc_things_total{kind="spam"} 3
+    """
+
+    def __init__(self, name, documentation, labels=(), kind='counter'):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.kind = kind
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, values=(), amount=1):
+        self._lock.acquire()
+        try:
+            self._values[values] = self._values.get(values, 0) + amount
+        finally:
+            self._lock.release()
+
+    def dec(self, values=(), amount=1):
+        self.inc(values, -amount)
+
+    def value(self, values=()):
+        return self._values.get(values, 0)
+
+    def expose(self):
+        self._lock.acquire()
+        try:
+            values = sorted(self._values.items())
+        finally:
+            self._lock.release()
+        if not values:
+            return []
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.kind)
+        ]
+        for label_values, value in values:
+            lines.append('%s%s %s' % (
+                self.name,
+                format_labels(zip(self.labels, label_values)),
+                value
+            ))
+        return lines
+
+
+def resolve_pattern(environ):
+    """Labels a request with the Django url pattern matching its path: the
+    pattern's name if it has one, the view's dotted name otherwise.
+    """
+    from django.core.urlresolvers import resolve, Resolver404
+    try:
+        match = resolve(environ.get('PATH_INFO') or '/')
+    except Resolver404:
+        return UNMATCHED
+    if match.url_name:
+        return match.url_name
+    func = match.func
+    return '%s.%s' % (
+        func.__module__,
+        getattr(func, '__name__', func.__class__.__name__)
+    )
+
+
+class MetricsMiddleware(object):
+    """Times each request and, optionally, profiles a sample of them.
+
+    ``path`` is the internal path on which the metrics are answered,
+    ``textfile`` a file (``%(pid)s`` is interpolated) that is rewritten at
+    most every ``interval`` seconds. A fraction ``profile_rate`` of the
+    requests is run under ``cProfile`` and its stats dumped into
+    ``profile_directory``.
+    """
+
+    # The number of paths whose label is remembered, the most recently used
+    label_cache_size = 1024
+
+    def __init__(self, application, registry=registry, path=None,
+                 textfile=None, interval=15, profile_rate=0.0,
+                 profile_directory=None, label=resolve_pattern):
+        self.application = application
+        self.registry = registry
+        self.path = path
+        self.textfile = textfile
+        self.interval = interval
+        self.profile_rate = profile_rate
+        self.profile_directory = profile_directory or tempfile.gettempdir()
+        self.label = label
+        self.histogram = registry.register(Histogram(
+            'djc_request_duration_seconds',
+            'Time spent serving requests.',
+            ('pattern', 'method')
+        ))
+        self._labels = LRUCache(self.label_cache_size)
+        self._next_write = 0
+        self._write_lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self.path is not None and environ.get('PATH_INFO') == self.path:
+            return simple_response(
+                start_response, '200 OK', self.registry.expose(),
+                content_type=CONTENT_TYPE
+            )
+        start = time.time()
+        observe = lambda: self.observe(environ, time.time() - start)
+        try:
+            if self.profile_rate and random.random() < self.profile_rate:
+                result = self.profile(environ, start_response)
+            else:
+                result = self.application(environ, start_response)
+        except:
+            observe()
+            raise
+        return ClosingIterator(result, observe)
+
+    def observe(self, environ, duration):
+        path = environ.get('PATH_INFO', '')
+        label = self._labels.get(path)
+        if label is None:
+            try:
+                label = self.label(environ)
+            except Exception:
+                # This runs when the server closes the response
+                logger.exception("Failed to label the request for %s" % path)
+                label = UNKNOWN
+            else:
+                self._labels.set(path, label)
+        self.histogram.observe(
+            (label, environ.get('REQUEST_METHOD', '')),
+            duration
+        )
+        if self.textfile is not None and time.time() >= self._next_write:
+            self.write_textfile()
+
+    def write_textfile(self):
+        # Only one thread writes, the others do not wait for it
+        if not self._write_lock.acquire(False):
+            return
+        try:
+            self._next_write = time.time() + self.interval
+            target = self.textfile % {'pid': os.getpid()}
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(target))
+            try:
+                os.write(fd, self.registry.expose())
+            finally:
+                os.close(fd)
+            # Readable by node_exporter, whoever it runs as
+            os.chmod(temp, 0644)
+            os.rename(temp, target)
+        finally:
+            self._write_lock.release()
+
+    def profile(self, environ, start_response):
+        profiler = profile.Profile()
+        try:
+            return profiler.runcall(
+                self.application, environ, start_response
+            )
+        finally:
+            if not os.path.isdir(self.profile_directory):
+                os.makedirs(self.profile_directory)
+            slug = re.sub(
+                r'[^a-zA-Z0-9]+', '_', environ.get('PATH_INFO', '')
+            ).strip('_')[:64] or 'root'
+            profiler.dump_stats(os.path.join(
+                self.profile_directory,
+                '%.6f-%d-%s.prof' % (time.time(), os.getpid(), slug)
+            ))
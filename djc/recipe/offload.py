@@ -0,0 +1,215 @@
+"""Hands the files sent by the views off to the web server in front of the
+WSGI application (through nginx's ``X-Accel-Redirect`` or Apache's
+``X-Sendfile``), so that no worker is tied up for the whole transfer.
+
+Views return an ``OffloadResponse`` (or, for the files of the default
+storage, the one ``media_response`` builds), which only names the file::
+
+    >>> from djc.recipe.offload import OffloadResponse, OffloadMiddleware
+    >>> write(root, 'reports', 'q1.csv', 'a,b\\n1,2\\n')
+    >>> path = os.path.join(root, 'reports', 'q1.csv')
+    >>> response = OffloadResponse(path, attachment=True, offload=True)
+    >>> response['Content-Type'], response['Content-Disposition']
+    ('text/csv', 'attachment; filename="q1.csv"')
+
+and the WSGI layer turns it in the header of the server, mapping the path
+under ``MEDIA_ROOT`` to the internal location nginx serves it from::
+
+    >>> def app(environ, start_response):
+    ...     start_response('200 OK', response.items())
+    ...     return response
+    >>> def start_response(status, headers):
+    ...     print status
+    ...     for header in sorted(headers):
+    ...         print '%s: %s' % header
+    >>> OffloadMiddleware(app, 'nginx', root, '/_media/')({}, start_response)
+    200 OK
+    Content-Disposition: attachment; filename="q1.csv"
+    Content-Length: 0
+    Content-Type: text/csv
+    X-Accel-Redirect: /_media/reports/q1.csv
+    ['']
+    >>> OffloadMiddleware(app, 'apache', root)({}, start_response)
+    ... #doctest: +ELLIPSIS
+    200 OK
+    Content-Disposition: attachment; filename="q1.csv"
+    Content-Length: 0
+    Content-Type: text/csv
+    X-Sendfile: .../reports/q1.csv
+    ['']
+
+Paths are sent as bytes, in the encoding of the file system, whatever their
+characters::
+
+    >>> write(root, 'reports', 'caf\xc3\xa9.pdf', '%PDF')
+    >>> pdf = os.path.join(root, u'reports', u'caf\\u00e9.pdf')
+    >>> response = OffloadResponse(pdf, offload=True)
+    >>> OffloadMiddleware(app, 'nginx', root, '/_media/')({}, start_response)
+    200 OK
+    Content-Length: 0
+    Content-Type: application/pdf
+    X-Accel-Redirect: /_media/reports/caf%C3%A9.pdf
+    ['']
+    >>> OffloadMiddleware(app, 'apache', root)({}, start_response)
+    ... #doctest: +ELLIPSIS
+    200 OK
+    Content-Length: 0
+    Content-Type: application/pdf
+    X-Sendfile: .../reports/caf\xc3\xa9.pdf
+    ['']
+
+Without offloading, the file is streamed by Django itself::
+
+    >>> response = OffloadResponse(path, offload=False)
+    >>> response['Content-Length'], ''.join(response)
+    ('8', 'a,b\\n1,2\\n')
+"""
+
+import os, sys, codecs, urllib, logging, mimetypes
+from django.conf import settings
+from django.http import HttpResponse
+from wsgiutils import OFFLOAD_HEADER, simple_response
+
+
+CHUNK_SIZE = 65536
+
+logger = logging.getLogger('djc.recipe.offload')
+
+
+def fs_encode(path):
+    """Returns ``path`` as bytes, encoded as the file system expects.
+    """
+    if not isinstance(path, unicode):
+        return path
+    encoding = sys.getfilesystemencoding() or 'ascii'
+    if codecs.lookup(encoding).name == 'ascii':
+        # What Python assumes under the C locale, rather than what the names
+        # are actually encoded with
+        encoding = 'utf-8'
+    return path.encode(encoding)
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE):
+    """Yields the content of ``path``, opening it only once iterated.
+    """
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            yield data
+    finally:
+        f.close()
+
+
+class OffloadResponse(HttpResponse):
+    """Sends the file at ``path``: it is handed off to the web server if
+    ``offload`` (by default, if ``MEDIA_OFFLOAD`` is set), else streamed.
+    """
+
+    def __init__(self, path, content_type=None, filename=None,
+                 attachment=False, offload=None):
+        if content_type is None:
+            content_type = mimetypes.guess_type(path)[0] or \
+                'application/octet-stream'
+        if offload is None:
+            offload = bool(getattr(settings, 'MEDIA_OFFLOAD', None))
+        if filename is None and attachment:
+            filename = os.path.basename(path)
+        path = fs_encode(path)
+        HttpResponse.__init__(self, iter_file(path),
+                              content_type=content_type)
+        self['Content-Length'] = str(os.path.getsize(path))
+        if offload:
+            self[OFFLOAD_HEADER] = urllib.quote(path)
+        if filename is not None:
+            if not isinstance(filename, unicode):
+                filename = filename.decode('utf-8')
+            disposition = attachment and 'attachment' or 'inline'
+            try:
+                filename.encode('us-ascii')
+            except UnicodeError:
+                disposition += "; filename*=UTF-8''%s" % urllib.quote(
+                    filename.encode('utf-8')
+                )
+            else:
+                disposition += '; filename="%s"' % (
+                    filename.replace('\\', '\\\\').replace('"', '\\"')
+                )
+            self['Content-Disposition'] = disposition
+
+
+def media_response(name, storage=None, **kwargs):
+    """Returns an ``OffloadResponse`` for the file ``name`` of ``storage``
+    (the default storage, if not given).
+    """
+    if storage is None:
+        from django.core.files.storage import default_storage as storage
+    return OffloadResponse(storage.path(name), **kwargs)
+
+
+class OffloadMiddleware(object):
+    """Hands the files named by the responses off to ``server`` (``nginx``
+    or ``apache``): nginx gets them below ``location``, mapped from ``root``.
+    """
+
+    def __init__(self, application, server, root, location='/'):
+        self.application = application
+        self.server = server
+        self.root = os.path.realpath(fs_encode(root))
+        self.location = '/' + location.strip('/') + '/'
+        if self.location == '//':
+            self.location = '/'
+
+    def __call__(self, environ, start_response):
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            for header, value in headers:
+                if header.lower() == OFFLOAD_HEADER.lower():
+                    captured[:] = [status, headers, urllib.unquote(value)]
+                    # The body is not sent anyway
+                    return lambda data: None
+            return start_response(status, headers, exc_info)
+
+        result = self.application(environ, capture)
+        if not captured:
+            return result
+        if hasattr(result, 'close'):
+            result.close()
+        status, headers, path = captured
+        headers = [
+            (h, v) for h, v in headers
+            if h.lower() not in (OFFLOAD_HEADER.lower(), 'content-length')
+        ]
+        real_path = os.path.realpath(path)
+        if self.server == 'apache':
+            header = ('X-Sendfile', real_path)
+        elif real_path.startswith(self.root + os.sep):
+            header = ('X-Accel-Redirect', urllib.quote(
+                self.location + real_path[len(self.root) + 1:]
+            ))
+        else:
+            logger.warning("Cannot hand '%s' off, as it is not within '%s'" % (
+                path, self.root
+            ))
+            return self.send(path, status, headers, environ, start_response)
+        start_response(status, headers + [header, ('Content-Length', '0')])
+        return ['']
+
+    def send(self, path, status, headers, environ, start_response):
+        """Sends the file at ``path`` from the application itself.
+        """
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return simple_response(start_response, '404 NOT FOUND',
+                                   'Not found\n')
+        start_response(status, headers + [
+            ('Content-Length', str(os.fstat(f.fileno()).st_size))
+        ])
+        if 'wsgi.file_wrapper' in environ:
+            return environ['wsgi.file_wrapper'](f, CHUNK_SIZE)
+        f.close()
+        return iter_file(path)
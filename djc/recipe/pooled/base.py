@@ -0,0 +1,279 @@
+"""A database backend that wraps another one, keeping its connections open in
+a per-process pool instead of closing them at the end of every request.
+
+It is what the recipe configures when a database url has a ``pool`` part::
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'djc.recipe.pooled',
+            'NAME': 'mydb',
+            'POOL': {
+                'ENGINE': 'django.db.backends.postgresql_psycopg2',
+                'MIN_SIZE': 2,
+                'MAX_SIZE': 10,
+                'IDLE_TIMEOUT': 300,
+            },
+            ...
+        }
+    }
+
+``POOL['ENGINE']`` is the backend that actually talks to the database, the
+other keys configure the ``Pool``. If ``CONN_MAX_AGE`` is set, connections
+older than that are closed rather than given back to the pool.
+
+Connections are rolled back before going back to the pool, and the
+``connection_created`` signal is sent only when a new connection is opened.
+There is a pool per set of connection parameters, so that a connection is
+never handed out for another database than the one it was opened to (as when
+the test runner changes ``NAME``).
+"""
+
+import time, threading
+# IntegrityError is here for the code that looks for it on the backend module
+from django.db.utils import load_backend, DatabaseError, IntegrityError
+
+
+class Pool(object):
+    """A thread safe pool of connections.
+
+    At most ``max_size`` connections (in use or idle) are open at any time:
+    when all of them are in use, ``acquire`` waits up to ``timeout`` seconds
+    for one to be released. Idle connections are closed after
+    ``idle_timeout`` seconds, but ``min_size`` of them are always kept.
+
+        >>> from djc.recipe.pooled.base import Pool
+        >>> class Connection(object):
+        ...     def close(self):
+        ...         print 'closed'
+        >>> pool = Pool(max_size=1, timeout=0)
+
+    ``acquire`` returns an idle connection and its creation time or, if there
+    is none, ``None`` and reserves a slot for a new connection::
+
+        >>> connection, created = pool.acquire()
+        >>> print connection
+        None
+        >>> pool.acquire() #doctest: +ELLIPSIS
+        Traceback (most recent call last):
+          ...
+        DatabaseError: No connection available in the pool after 0 seconds
+        >>> first = Connection()
+        >>> pool.release(first, created)
+        >>> pool.acquire()[0] is first
+        True
+
+    Releasing ``None`` gives the slot back without pooling anything::
+
+        >>> pool.release(None, created)
+        >>> pool.size
+        0
+
+    Connections too old to be reused are closed::
+
+        >>> pool = Pool(max_age=60)
+        >>> pool.release(Connection(), time.time() - 120)
+        closed
+        >>> pool.release(Connection(), time.time())
+        >>> len(pool.idle)
+        1
+
+    Once closed, the idle connections are closed and the ones in use are
+    when released::
+
+        >>> pool = Pool()
+        >>> in_use, idle = pool.acquire(), pool.acquire()
+        >>> pool.release(Connection(), idle[1])
+        >>> pool.close()
+        closed
+        >>> pool.release(Connection(), in_use[1])
+        closed
+        >>> pool.size, pool.idle
+        (0, [])
+    """
+
+    def __init__(self, max_size=None, min_size=0, idle_timeout=None,
+                 max_age=None, timeout=30):
+        self.max_size = max_size
+        self.min_size = min_size
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.timeout = timeout
+        # (connection, created, released) triples, most recently used last
+        self.idle = []
+        self.size = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        self._condition.acquire()
+        try:
+            self._prune()
+            while True:
+                if self.idle:
+                    connection, created, __ = self.idle.pop()
+                    return connection, created
+                if self.max_size is None or self.size < self.max_size:
+                    self.size += 1
+                    return None, time.time()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise DatabaseError(
+                        "No connection available in the pool after %s "
+                        "seconds" % self.timeout
+                    )
+                self._condition.wait(remaining)
+        finally:
+            self._condition.release()
+
+    def release(self, connection, created):
+        self._condition.acquire()
+        try:
+            if connection is not None and (self.closed or
+                    self.max_age is not None and
+                    time.time() - created >= self.max_age):
+                self._close(connection)
+                connection = None
+            if connection is None:
+                self.size -= 1
+            else:
+                self.idle.append((connection, created, time.time()))
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+    def close(self):
+        """Closes the idle connections, and those in use once released.
+        """
+        self._condition.acquire()
+        try:
+            self.closed = True
+            while self.idle:
+                self._close(self.idle.pop()[0])
+                self.size -= 1
+        finally:
+            self._condition.release()
+
+    def _prune(self):
+        if self.idle_timeout is None:
+            return
+        limit = time.time() - self.idle_timeout
+        # The least recently used connections come first
+        while len(self.idle) > self.min_size and self.idle[0][2] < limit:
+            self._close(self.idle.pop(0)[0])
+            self.size -= 1
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_key(alias, settings_dict):
+    """Returns what identifies the pool of the connections opened with
+    ``settings_dict``.
+
+        >>> from djc.recipe.pooled.base import pool_key
+        >>> settings_dict = {'NAME': 'mydb', 'OPTIONS': {'b': 2, 'a': 1},
+        ...                  'POOL': {'ENGINE': 'sqlite3', 'MAX_SIZE': 2}}
+        >>> key = pool_key('default', settings_dict)
+        >>> key == pool_key('default', dict(settings_dict, CONN_MAX_AGE=60))
+        True
+        >>> key == pool_key('default', dict(settings_dict, NAME='test_mydb'))
+        False
+    """
+    return (
+        alias,
+        settings_dict['POOL']['ENGINE'],
+        repr(sorted((settings_dict.get('OPTIONS') or {}).items())),
+    ) + tuple([
+        settings_dict.get(name)
+        for name in ('NAME', 'USER', 'PASSWORD', 'HOST', 'PORT')
+    ])
+
+
+def get_pool(alias, settings_dict):
+    key = pool_key(alias, settings_dict)
+    _pools_lock.acquire()
+    try:
+        if key not in _pools:
+            pool_settings = settings_dict['POOL']
+            kwargs = {
+                'max_size': pool_settings.get('MAX_SIZE'),
+                'min_size': pool_settings.get('MIN_SIZE', 0),
+                'idle_timeout': pool_settings.get('IDLE_TIMEOUT'),
+                'max_age': settings_dict.get('CONN_MAX_AGE'),
+            }
+            if 'TIMEOUT' in pool_settings:
+                kwargs['timeout'] = pool_settings['TIMEOUT']
+            _pools[key] = Pool(**kwargs)
+        return _pools[key]
+    finally:
+        _pools_lock.release()
+
+
+def close_pools():
+    """Closes all the pools of the process, as is needed before forking: the
+    children would otherwise share the idle connections.
+    """
+    _pools_lock.acquire()
+    try:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+    finally:
+        _pools_lock.release()
+
+
+def pooled(base):
+    """Makes a pooled version of the ``base`` database wrapper class.
+    """
+
+    class PooledDatabaseWrapper(base):
+
+        _pool = None
+        _created = None
+
+        def _cursor(self):
+            if self.connection is None:
+                self._pool = get_pool(self.alias, self.settings_dict)
+                self.connection, self._created = self._pool.acquire()
+                if self.connection is None:
+                    try:
+                        return super(PooledDatabaseWrapper, self)._cursor()
+                    except:
+                        if self.connection is None:
+                            self._pool.release(None, self._created)
+                        raise
+            return super(PooledDatabaseWrapper, self)._cursor()
+
+        def close(self):
+            if self.connection is None:
+                return
+            connection, self.connection = self.connection, None
+            try:
+                connection.rollback()
+            except Exception:
+                self._pool._close(connection)
+                connection = None
+            self._pool.release(connection, self._created)
+
+    PooledDatabaseWrapper.__name__ = 'Pooled%s' % base.__name__
+    return PooledDatabaseWrapper
+
+
+_wrappers = {}
+
+
+def DatabaseWrapper(settings_dict, *args, **kwargs):
+    """Instantiates the pooled version of the wrapper of the actual backend.
+    """
+    engine = settings_dict['POOL']['ENGINE']
+    if engine not in _wrappers:
+        _wrappers[engine] = pooled(load_backend(engine).DatabaseWrapper)
+    return _wrappers[engine](settings_dict, *args, **kwargs)
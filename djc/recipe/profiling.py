@@ -0,0 +1,153 @@
+"""Profiling of long running processes, without restarting them.
+
+``SignalProfiler`` starts a ``cProfile`` session of the main thread when the
+process receives ``SIGUSR1``, and stops it (dumping the statistics in
+``profile-<pid>-<time>.prof``) on the next one. The toggling can be done by
+hand as well::
+
+    >>> import pstats
+    >>> from djc.recipe.profiling import SignalProfiler, StackSampler
+    >>> def busy(seconds):
+    ...     end = time.time() + seconds
+    ...     while time.time() < end:
+    ...         pass
+    >>> profiler = SignalProfiler(directory)
+    >>> profiler.toggle()
+    >>> busy(0.05)
+    >>> filename = profiler.toggle()
+    >>> stats = pstats.Stats(filename)
+    >>> [f[2] for f in stats.stats if f[2] == 'busy']
+    ['busy']
+
+``StackSampler`` takes periodic snapshots of the stacks of all the threads,
+with a low overhead, and aggregates them in a file of collapsed stacks (one
+stack per line, from the outermost frame, followed by how many times it has
+been seen), as used to draw flame graphs::
+
+    >>> sampler = StackSampler(os.path.join(directory, 'stacks.txt'), 0.001)
+    >>> sampler.start()
+    >>> busy(0.2)
+    >>> sampler.stop()
+    >>> samples = 0
+    >>> for line in open(sampler.filename):
+    ...     stack, count = line.rsplit(' ', 1)
+    ...     if stack.split(';')[-1].startswith('busy '):
+    ...         samples += int(count)
+    >>> samples > 10
+    True
+"""
+
+import os, sys, time, signal, logging, threading, cProfile
+
+
+logger = logging.getLogger('djc.recipe.profiling')
+
+
+class SignalProfiler(object):
+    """Toggles a ``cProfile`` session on ``signum``, writing the statistics
+    in ``directory``.
+    """
+
+    def __init__(self, directory, signum=signal.SIGUSR1):
+        self.directory = directory
+        self.profile = None
+        self.signum = signum
+
+    def install(self):
+        signal.signal(self.signum, lambda signum, frame: self.toggle())
+
+    def toggle(self):
+        """Starts or stops profiling, returns the statistics file when
+        stopping.
+        """
+        if self.profile is None:
+            logger.info("Profiling started")
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            return None
+        self.profile.disable()
+        filename = os.path.join(self.directory, 'profile-%d-%d.prof' % (
+            os.getpid(), time.time()
+        ))
+        self.profile.dump_stats(filename)
+        self.profile = None
+        logger.info("Profiling stopped, statistics in %s" % filename)
+        return filename
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, code.co_filename,
+                           code.co_firstlineno)
+
+
+class StackSampler(object):
+    """Samples the stacks of all the threads every ``interval`` seconds,
+    writing them to ``filename`` on ``stop`` and every ``flush`` seconds.
+    """
+
+    def __init__(self, filename, interval=0.01, flush=60):
+        self.filename = filename
+        self.interval = interval
+        self.flush = flush
+        self.stacks = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        own = threading.current_thread().ident
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            names.reverse()
+            stack = ';'.join(names)
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def write(self):
+        temp = '%s.tmp' % self.filename
+        f = open(temp, 'wb')
+        try:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (stack, count))
+        finally:
+            f.close()
+        os.rename(temp, self.filename)
+
+    def run(self):
+        next_flush = time.time() + self.flush
+        while not self._stopping.is_set():
+            self.sample()
+            if time.time() >= next_flush:
+                self.write()
+                next_flush = time.time() + self.flush
+            self._stopping.wait(self.interval)
+        self.write()
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run,
+                                        name='djc.recipe.profiling')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+
+def install(directory, sampling_interval=None):
+    """Installs the ``SignalProfiler`` and, if ``sampling_interval`` is given,
+    starts a ``StackSampler`` until the process exits.
+    """
+    SignalProfiler(directory).install()
+    if sampling_interval:
+        import atexit
+        sampler = StackSampler(os.path.join(
+            directory, 'stacks-%d.txt' % os.getpid()
+        ), sampling_interval)
+        sampler.start()
+        atexit.register(sampler.stop)
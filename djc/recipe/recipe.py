@@ -10,14 +10,26 @@ mere templating matter.
 The settings file is saved in ``parts/name/settings.py``.
 """
 
-import os, re, logging, random, sys, pprint, urllib
+import os, re, logging, random, sys, pprint, urllib, urlparse
 import zc.recipe.egg
+import pkg_resources
 from tempita import Template, bunch
-from copier import Copier
+from copier import Copier, Store
+from messages import find_catalogs, compile_catalogs
+from assets import build_bundles
 
 
 EGG_NAME = 'djc.recipe'
+# The dependencies of djc.recipe needed by the scripts it generates
+RUNTIME_REQUIREMENTS = ('Django',)
 SETTINGS_NAME = 'settings.py'
+CACHED_TEMPLATE_LOADER = 'django.template.loaders.cached.Loader'
+MEDIA_OFFLOAD_SERVERS = ('nginx', 'apache', 'none')
+# Django's own default TEMPLATE_LOADERS
+DEFAULT_TEMPLATE_LOADERS = (
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+)
 WSGI_SCRIPT_TEMPLATE = '''
 
 %(relative_paths_setup)s
@@ -109,7 +121,7 @@ dburl_regexes = [
         r"(?P<ENGINE>[a-zA-Z0-9_.]+)://(?:"
         r"(?P<USER>[a-zA-Z0-9_./+\-]+):"
         r"(?P<PASSWORD>[a-zA-Z0-9_./+\-]+)@)?"
-        r"(?P<HOST>[a-zA-Z0-9.]+)?"
+        r"(?P<HOST>[a-zA-Z0-9_.%\-]+)?"
         r"(?::(?P<PORT>[0-9]+))?/"
         r"(?P<NAME>[a-zA-Z0-9_./+\-]+)"
         r"(?:\((?P<OPTIONS>[a-zA-Z0-9_./=,+\-]+)\))?"
@@ -121,10 +133,45 @@ dburl_regexes = [
         r"(?:host=(?P<HOST>\S+)\s+)?"
         r"(?:port=(?P<PORT>[0-9]+)\s+)?"
         r"name=(?P<NAME>[a-zA-Z0-9_./+\-]+)"
+        r"(?:\s+conn_max_age=(?P<CONN_MAX_AGE>[0-9]+|None))?"
+        r"(?:\s+pool=\((?P<POOL>[^)\s]+)\))?"
         r"(?:\s+options=\((?P<OPTIONS>\S+)\))?"
      ), lambda x: x)
 ]
 
+# The keys accepted within a database url's ``pool=(...)``
+pool_keys = {
+    'min': 'MIN_SIZE',
+    'max': 'MAX_SIZE',
+    'idle': 'IDLE_TIMEOUT',
+    'timeout': 'TIMEOUT',
+}
+POOLED_ENGINE = 'djc.recipe.pooled'
+
+cache_regex = re.compile(
+    r"backend=(?P<BACKEND>\S+)"
+    r"(?:\s+location=(?P<LOCATION>\S+))?"
+    r"(?:\s+timeout=(?P<TIMEOUT>[0-9]+))?"
+    r"(?:\s+key_prefix=(?P<KEY_PREFIX>\S+))?"
+    r"(?:\s+options=\((?P<OPTIONS>\S+)\))?\s*$"
+)
+
+
+def split_options(url, data, unquote):
+    options = {}
+    for option in [ o.strip() for o in data.split(',') ]:
+        try:
+            name, value = option.split('=')
+        except ValueError:
+            raise ValueError(
+                ("The database url '%s' is incorrect, "
+                 "we cannot split the option '%s'") % (
+                    url, option
+                )
+            )
+        options[unquote(name)] = unquote(value)
+    return options
+
 
 def split_dburl(url):
     global dburl_regexes
@@ -136,23 +183,31 @@ def split_dburl(url):
             for key in result.keys():
                 if result[key] is None:
                     del result[key]
-            for key in ['USER', 'PASSWORD', 'NAME']:
+            for key in ['USER', 'PASSWORD', 'HOST', 'NAME']:
                 if key in result:
                     result[key] = unquote(result[key])
             if 'OPTIONS' in result:
-                options = [ o.strip() for o in result['OPTIONS'].split(',') ]
-                result['OPTIONS'] = {}
-                for option in options:
-                    try:
-                        name, value = option.split('=')
-                    except ValueError:
+                result['OPTIONS'] = split_options(
+                    url, result['OPTIONS'], unquote
+                )
+            if 'CONN_MAX_AGE' in result:
+                if result['CONN_MAX_AGE'] == 'None':
+                    result['CONN_MAX_AGE'] = None
+                else:
+                    result['CONN_MAX_AGE'] = int(result['CONN_MAX_AGE'])
+            if 'POOL' in result:
+                pool = {}
+                for name, value in split_options(
+                        url, result['POOL'], unquote).items():
+                    if name not in pool_keys or not value.isdigit():
                         raise ValueError(
                             ("The database url '%s' is incorrect, "
-                             "we cannot split the option '%s'") % (
-                                url, option
+                             "'%s=%s' is not a valid pool option") % (
+                                url, name, value
                             )
                         )
-                    result['OPTIONS'][unquote(name)] = unquote(value)
+                    pool[pool_keys[name]] = int(value)
+                result['POOL'] = pool
             return result
     # If we couldn't match any regex, this is invalid
     raise ValueError(
@@ -160,6 +215,34 @@ def split_dburl(url):
     )
 
 
+def split_cacheurl(url):
+    m = cache_regex.match(url)
+    if m is None:
+        raise ValueError(
+            "The cache url '%s' is incorrect" % url
+        )
+    result = m.groupdict()
+    for key in result.keys():
+        if result[key] is None:
+            del result[key]
+    if 'TIMEOUT' in result:
+        result['TIMEOUT'] = int(result['TIMEOUT'])
+    if 'OPTIONS' in result:
+        result['OPTIONS'] = split_options(
+            url, result['OPTIONS'], lambda x: x
+        )
+    return result
+
+
+def pool_database(database):
+    """Has a database with a ``POOL`` go through the pooled backend wrapper.
+    """
+    if 'POOL' in database and database['ENGINE'] != POOLED_ENGINE:
+        database['POOL']['ENGINE'] = database['ENGINE']
+        database['ENGINE'] = POOLED_ENGINE
+    return database
+
+
 class Recipe(object):
     """A Django buildout recipe
     """
@@ -182,6 +265,9 @@ class Recipe(object):
         self.options.setdefault('static-url', 'static')
         self.options.setdefault('media-directory', 'media')
         self.options.setdefault('media-url', 'media')
+        self.options.setdefault('media-sharding', 'false')
+        self.options.setdefault('media-offload', 'none')
+        self.options.setdefault('media-offload-location', '_media')
         self.options.setdefault('admin-media', 'admin_media')
         for option in ('static-url', 'media-url', 'admin-media'):
             self.options[option] = self.options[option].strip('/')
@@ -201,6 +287,7 @@ class Recipe(object):
             )
         )
         self.options.setdefault('additional-databases', '')
+        self.options.setdefault('database-replicas', '')
 
         self.options.setdefault(
             'mail-backend',
@@ -216,6 +303,7 @@ class Recipe(object):
         self.options.setdefault('cache-backend', 'locmem:///')
         self.options.setdefault('cache-timeout', '60*5')
         self.options.setdefault('cache-prefix', 'Z')
+        self.options.setdefault('caches', '')
 
         self.options.setdefault('timezone', 'America/Chicago')
         self.options.setdefault('language-code', 'en-us')
@@ -231,12 +319,17 @@ class Recipe(object):
 
         self.options.setdefault('middleware', '')
         self.options.setdefault('apps', '')
+        self.options.setdefault('recipe-commands', 'false')
         self.options.setdefault('template-loaders', '')
         self.options.setdefault('template-context-processors', '')
         self.options.setdefault('authentication-backends', '')
 
         self.options.setdefault('debug', 'false')
         self.options.setdefault('internal-ips', '127.0.0.1')
+        self.options.setdefault(
+            'template-cache',
+            self.t_boolify(self.options['debug']) and 'false' or 'true'
+        )
 
         self.options.setdefault('fixture-dirs', '')
 
@@ -309,6 +402,17 @@ class Recipe(object):
     def t_join(data, infix, prefix="", suffix=""):
         return prefix+infix.join(data)+suffix
 
+    def number_option(self, option, default, cast=float):
+        value = self.options.get(option, default)
+        try:
+            return cast(value)
+        except ValueError:
+            raise zc.buildout.UserError(
+                "Error in '%s': %s must be a number, not '%s'" % (
+                    self.name, option, value
+                )
+            )
+
     @memoized_property
     def rws(self):
         egg = zc.recipe.egg.Egg(
@@ -316,6 +420,90 @@ class Recipe(object):
         )
         return egg.working_set(self.eggs)
 
+    @memoized_property
+    def runtime_ws(self):
+        """The part of the working set needed at runtime: the eggs listed
+        in ``runtime-eggs`` (with their dependencies), ``djc.recipe`` itself
+        with Django and the project, plus the eggs found by tracing the
+        imports of the project if ``auto`` is listed. Without
+        ``runtime-eggs``, the whole working set.
+        """
+        __, ws = self.rws
+        eggs = self.options.get('runtime-eggs', '').split()
+        if not eggs:
+            return ws
+        requirements = [egg for egg in eggs if egg != 'auto']
+        if 'project' in self.options:
+            requirements.append(self.options['project'])
+        recipe = ws.find(pkg_resources.Requirement.parse(EGG_NAME))
+        # Its dependencies the scripts import, not the ones only the build
+        # needs
+        requirements.extend([
+            str(requirement) for requirement in recipe.requires()
+            if requirement.project_name in RUNTIME_REQUIREMENTS
+        ])
+        try:
+            dists = ws.resolve([
+                pkg_resources.Requirement.parse(requirement)
+                for requirement in requirements
+            ])
+        except (pkg_resources.DistributionNotFound, ValueError), e:
+            raise zc.buildout.UserError(
+                "Error in '%s': runtime-eggs must be part of the eggs: %s" % (
+                    self.name, e
+                )
+            )
+        dists.append(recipe)
+        locations = set([dist.location for dist in dists])
+        if 'auto' in eggs:
+            locations.update(self.trace_imports(ws))
+        runtime = pkg_resources.WorkingSet([])
+        for dist in ws:
+            if dist.location in locations:
+                runtime.add(dist)
+        self._logger.info(
+            "Runtime working set: %d of %d eggs" % (
+                len(list(runtime)), len(list(ws))
+            )
+        )
+        return runtime
+
+    def trace_imports(self, ws):
+        """Returns the locations of the eggs in ``ws`` the project imports
+        at runtime, all of them if the trace fails.
+        """
+        import subprocess
+        locations = [dist.location for dist in ws]
+        code = (
+            "import sys; sys.path[0:0] = %r; "
+            "from djc.recipe.trace import main; main(%r)"
+        ) % (locations + self.extra_paths, self.settings_module)
+        process = subprocess.Popen(
+            [self.options['executable'], '-c', code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        output, errors = process.communicate()
+        if process.returncode != 0:
+            self._logger.warning(
+                "Cannot trace the imports, keeping all the eggs:\n%s" % (
+                    errors.strip(),
+                )
+            )
+            return locations
+        try:
+            import json
+        except ImportError:
+            import simplejson as json
+        used = set()
+        # The longest first, for the eggs nested in another location
+        ordered = sorted(locations, key=len, reverse=True)
+        for filename in json.loads(output):
+            for location in ordered:
+                if filename.startswith(location.rstrip(os.sep) + os.sep):
+                    used.add(location)
+                    break
+        return used
+
     @memoized_property
     def extra_paths(self):
         extra_paths = [
@@ -377,6 +565,8 @@ class Recipe(object):
             value = variables.pop(key).strip()
             if value != '':
                 databases['default'][key[len('database_'):].upper()] = value
+        if 'default' in databases:
+            pool_database(databases['default'])
         additional_databases = self.t_listify(
             variables.pop('additional_databases')
         )
@@ -390,8 +580,160 @@ class Recipe(object):
                         "it should be in the form 'name=url'"
                     ) % additional_database
                 )
-            databases[name] = split_dburl(url)
+            databases[name] = pool_database(split_dburl(url))
         variables['databases'] = databases
+        replicas = {}
+        for replica in variables.pop('database_replicas').split():
+            name, __, weight = replica.partition(':')
+            if name not in databases or name == 'default' or \
+                    not (weight or '1').isdigit():
+                raise ValueError(
+                    (
+                        "The replicas entry '%s' is incorrect, it should be "
+                        "in the form 'name[:weight]', name being one of the "
+                        "additional databases"
+                    ) % replica
+                )
+            replicas[name] = int(weight or '1')
+        variables['database_replicas'] = replicas
+
+    def fix_caches(self, variables):
+        caches = {}
+        for cache in self.t_listify(variables.pop('caches')):
+            try:
+                name, url = cache.split('=', 1)
+            except ValueError:
+                raise ValueError(
+                    (
+                        "The caches entry '%s' is incorrect, "
+                        "it should be in the form 'name=url'"
+                    ) % cache
+                )
+            caches[name.strip()] = split_cacheurl(url.strip())
+        variables['caches'] = caches
+
+    def fix_template_loaders(self, variables):
+        """Computes the loaders to wrap in Django's cached loader, if any.
+        """
+        loaders = self.t_listify(variables['template_loaders'])
+        cached_loaders = []
+        if self.t_boolify(variables.pop('template_cache')) and \
+                CACHED_TEMPLATE_LOADER not in loaders:
+            if len(loaders) > 0:
+                cached_loaders = loaders
+            elif not variables['base_settings']:
+                cached_loaders = list(DEFAULT_TEMPLATE_LOADERS)
+        variables['cached_template_loaders'] = cached_loaders
+
+    def fix_media_sharding(self, variables):
+        """Computes the configuration of the sharded media storage, if any.
+        """
+        sharding = {}
+        if self.t_boolify(variables.pop('media_sharding')):
+            sharding['DEPTH'] = self.number_option(
+                'media-sharding-depth', '2', int
+            )
+            sharding['WIDTH'] = self.number_option(
+                'media-sharding-width', '2', int
+            )
+        variables['media_sharding'] = sharding
+
+    def fix_media_offload(self, variables):
+        """Computes the configuration of the offloading of the media files
+        to the web server, if any.
+        """
+        server = variables.pop('media_offload').strip().lower()
+        location = variables.pop('media_offload_location').strip('/')
+        if server not in MEDIA_OFFLOAD_SERVERS:
+            raise zc.buildout.UserError(
+                "Error in '%s': media-offload must be one of %s, not '%s'" % (
+                    self.name, ', '.join(MEDIA_OFFLOAD_SERVERS), server
+                )
+            )
+        offload = {}
+        if server != 'none':
+            offload['SERVER'] = server
+            if server == 'nginx':
+                offload['LOCATION'] = '/%s/' % location
+        variables['media_offload'] = offload
+
+    def fix_recipe_commands(self, variables):
+        """Adds ``djc.recipe`` to the applications (if they are not left to
+        ``base-settings``) if ``recipe-commands`` is set, for its management
+        commands.
+        """
+        apps = self.t_listify(variables['apps'])
+        if self.t_boolify(variables.pop('recipe_commands')) and apps and \
+                EGG_NAME not in apps:
+            self._logger.info(
+                "Adding %s to the apps, for its commands" % EGG_NAME
+            )
+            variables['apps'] = '\n'.join(apps + [EGG_NAME])
+
+    def report_templates(self):
+        """Logs how many templates the cached loader will (at most) keep in
+        memory, and how big they are.
+        """
+        count, size = 0, 0
+        for directory in self.t_listify(self.options.get('templates', '')):
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [ d for d in dirs if not d.startswith('.') ]
+                for file_ in files:
+                    if not file_.startswith('.'):
+                        count += 1
+                        size += os.path.getsize(os.path.join(root, file_))
+        self._logger.info(
+            "Template cache: %d templates (%d bytes) found in "
+            "TEMPLATE_DIRS" % (count, size)
+        )
+        return count, size
+
+    def compile_messages(self):
+        """Compiles the translation catalogs of the project and of the develop
+        eggs (of all the eggs with ``compile-messages-eggs``) for
+        ``languages``, skipping the ones that did not change.
+        """
+        __, ws = self.rws
+        all_eggs = self.t_boolify(
+            self.options.get('compile-messages-eggs', 'false')
+        )
+        project = self.options.get('project')
+        paths = []
+        for dist in ws:
+            if all_eggs or dist.precedence == pkg_resources.DEVELOP_DIST:
+                paths.append(dist.location)
+            elif project:
+                # Only the project itself, out of an installed egg
+                paths.append(
+                    os.path.join(dist.location, *project.split('.'))
+                )
+        directories = []
+        for path in paths + self.extra_paths:
+            if path not in directories and os.path.isdir(path):
+                directories.append(path)
+        languages = [
+            language.split()[0]
+            for language in self.t_listify(self.options['languages'])
+        ]
+        catalogs = list(find_catalogs(directories, languages))
+        processes = None
+        if 'compile-messages-processes' in self.options:
+            processes = self.number_option(
+                'compile-messages-processes', None, int
+            )
+        compiled, skipped, errors = compile_catalogs(
+            catalogs,
+            os.path.join(self.options['location'], 'messages.json'),
+            processes
+        )
+        for error in errors:
+            self._logger.warning("Cannot compile %s" % error)
+        self._logger.info(
+            "Translation catalogs: %d compiled, %d unchanged" % (
+                compiled, skipped
+            )
+        )
+        return compiled, skipped
 
     @memoized_property
     def settings_py(self):
@@ -431,6 +773,11 @@ class Recipe(object):
             )
         variables.update(dict(normalize_keys(self.options)))
         self.fix_databases(variables)
+        self.fix_caches(variables)
+        self.fix_template_loaders(variables)
+        self.fix_media_sharding(variables)
+        self.fix_media_offload(variables)
+        self.fix_recipe_commands(variables)
         variables.update({ 'name': self.name, 'secret': self.secret })
         self._logger.debug(
             "Variable computation terminated:\n%s" % pprint.pformat(variables)
@@ -446,12 +793,23 @@ class Recipe(object):
         )
         return template.substitute(variables)
 
-    def _create_script(self, name, path, module, attr, extra_attr = []):
+    @property
+    def settings_module(self):
+        return "%s.%s" % (
+            os.path.basename(self.module_path.rstrip(os.sep)),
+            os.path.splitext(
+                self.options['settings-name']
+            )[0].split('$py')[0]
+        )
+
+    def _create_script(self, name, path, module, attr, extra_attr = [],
+                       runtime = False):
         """Create arbitrary boot script.
 
         This script will also include the eventual code found in
         ``initialization`` and will also set (via ``os.environ``) the
-        environment variables found in ``environment-vars``
+        environment variables found in ``environment-vars``. Scripts
+        run by the deployed project (``runtime``) get the runtime working set.
         """
 
         # The initialization code is expressed as a list of lines
@@ -499,7 +857,10 @@ class Recipe(object):
             initialization.append("import os")
             initialization.extend(environment_vars)
 
-        __, ws = self.rws
+        if runtime:
+            ws = self.runtime_ws
+        else:
+            __, ws = self.rws
         self._logger.info(
             "Creating script at %s" % (os.path.join(path, name),)
         )
@@ -519,25 +880,35 @@ class Recipe(object):
             path,
             extra_paths = self.extra_paths,
             initialization=initialization,
-            arguments = "'%s'%s" % (
-                "%s.%s" % (
-                    os.path.basename(self.module_path.rstrip(os.sep)),
-                    os.path.splitext(
-                        self.options['settings-name']
-                    )[0].split('$py')[0]
-                ),
-                extras
-            )
+            arguments = "'%s'%s" % (self.settings_module, extras)
         )
 
+    def memory_extras(self):
+        """Returns the script arguments for ``memory-diagnostics``
+        """
+        if self.t_boolify(self.options.get('memory-diagnostics', 'false')):
+            return ["memory_directory = '%s'" % self.options['location']]
+        return []
+
     def create_manage_script(self):
         """Creates the ``bin/${:__name__}`` script
         """
+        extras = self.memory_extras()
+        if self.t_boolify(self.options.get('manage-profile', 'false')):
+            extras.append(
+                "profile_directory = '%s'" % self.options['location']
+            )
+            if 'manage-profile-sampling' in self.options:
+                extras.append("sampling_interval = %r" % self.number_option(
+                    'manage-profile-sampling', None
+                ))
         return self._create_script(
             self.options.get('control-script', self.name),
             self.buildout['buildout']['bin-directory'],
             'djc.recipe.manage',
-            'main'
+            'main',
+            extras,
+            runtime = True
         )
 
     def create_wsgi_script(self):
@@ -557,16 +928,215 @@ class Recipe(object):
                 extras.append(
                     "loglevel = '%s'" % self.options['wsgi-loglevel'].upper()
                 )
+        if self.t_boolify(self.options.get('wsgi-metrics', 'false')):
+            extras.append("metrics = True")
+            if 'wsgi-metrics-path' in self.options:
+                extras.append(
+                    "metrics_path = '/%s'" % (
+                        self.options['wsgi-metrics-path'].strip('/'),
+                    )
+                )
+            if 'wsgi-metrics-textfile' in self.options:
+                extras.append(
+                    "metrics_textfile = '%s'" % os.path.join(
+                        self.buildout['buildout']['directory'],
+                        self.options['wsgi-metrics-textfile']
+                    )
+                )
+                extras.append(
+                    "metrics_interval = %r" % self.number_option(
+                        'wsgi-metrics-interval', '15'
+                    )
+                )
+            profile_rate = self.number_option('wsgi-profile-rate', '0')
+            if profile_rate > 0:
+                extras.append("profile_rate = %r" % profile_rate)
+                extras.append(
+                    "profile_directory = '%s'" % os.path.normpath(
+                        os.path.join(
+                            self.options['location'],
+                            self.options.get('wsgi-profile-directory', '.')
+                        )
+                    )
+                )
+        if self.t_boolify(self.options.get('wsgi-serve-static', 'false')):
+            extras.append("serve_static = True")
+            for option, argument in (('wsgi-static-cache-size', 'cache_size'),
+                                     ('wsgi-static-max-size', 'max_size'),
+                                     ('wsgi-static-max-age', 'max_age')):
+                if option in self.options:
+                    extras.append("static_%s = %d" % (
+                        argument, self.number_option(option, None, int)
+                    ))
+        if self.t_boolify(self.options.get('wsgi-gzip', 'false')):
+            extras.append("gzip = True")
+            if 'wsgi-gzip-min-size' in self.options:
+                extras.append("gzip_min_size = %d" % self.number_option(
+                    'wsgi-gzip-min-size', None, int
+                ))
+            if 'wsgi-gzip-types' in self.options:
+                extras.append("gzip_types = %r" % self.t_listify(
+                    self.options['wsgi-gzip-types']
+                ))
+        if 'wsgi-max-requests' in self.options:
+            extras.append("max_requests = %d" % self.number_option(
+                'wsgi-max-requests', None, int
+            ))
+            if 'wsgi-max-wait' in self.options:
+                extras.append("max_wait = %r" % self.number_option(
+                    'wsgi-max-wait', None
+                ))
+            if 'wsgi-retry-after' in self.options:
+                extras.append("retry_after = %d" % self.number_option(
+                    'wsgi-retry-after', None, int
+                ))
+        if self.options['media-offload'].strip().lower() != 'none':
+            extras.append("media_offload = True")
+        if self.t_boolify(self.options.get('wsgi-warmup', 'false')):
+            extras.append("warmup = True")
+        if 'wsgi-health-path' in self.options:
+            extras.append(
+                "health_path = '/%s'" % (
+                    self.options['wsgi-health-path'].strip('/'),
+                )
+            )
+        memory_extras = self.memory_extras()
+        if memory_extras:
+            extras.extend(memory_extras)
+            if 'memory-every' in self.options:
+                extras.append("memory_every = %d" % self.number_option(
+                    'memory-every', None, int
+                ))
         script = self._create_script(
             'app.py',
             self.module_path,
             'djc.recipe.wsgi',
             'main',
-            extras
+            extras,
+            runtime = True
         )
         zc.buildout.easy_install.script_template = _script_template
         return script
 
+    def create_dispatch_script(self):
+        """Creates the ``dispatch.py`` WSGI script, serving the parts listed
+        in ``wsgi-sites``
+        """
+        sites = []
+        for line in self.t_listify(self.options['wsgi-sites']):
+            line = line.split()
+            if len(line) < 2:
+                raise zc.buildout.UserError(
+                    "Each line of wsgi-sites must be a part followed by its "
+                    "hosts, not '%s'" % ' '.join(line)
+                )
+            part, hosts = line[0], line[1:]
+            options = self.buildout[part]
+            if not self.t_boolify(options.get('wsgi', 'false')):
+                raise zc.buildout.UserError(
+                    "The part '%s' in wsgi-sites has no wsgi script" % part
+                )
+            sites.append((part, hosts, os.path.join(
+                options['location'], 'djc_recipe_%s' % part, 'app.py'
+            )))
+        _script_template = zc.buildout.easy_install.script_template
+        zc.buildout.easy_install.script_template = \
+                zc.buildout.easy_install.script_header + \
+                    WSGI_SCRIPT_TEMPLATE
+        try:
+            return self._create_script(
+                'dispatch.py',
+                self.module_path,
+                'djc.recipe.dispatch',
+                'main',
+                [
+                    "sites = %r" % sites,
+                    "idle_timeout = %d" % self.number_option(
+                        'wsgi-sites-idle-timeout', '600', int
+                    )
+                ],
+                runtime = True
+            )
+        finally:
+            zc.buildout.easy_install.script_template = _script_template
+
+    def create_watch_script(self):
+        """Creates the ``bin/${:__name__}-static-watch`` script
+        """
+        directory = os.path.join(
+            self.buildout['buildout']['directory'],
+            self.options['static-directory']
+        )
+        origins = self.resolve_origins(
+            self.options['static-origin'].split(),
+            directory,
+            self.options.get('static-origin-include', '').split(),
+            self.options.get('static-origin-exclude', '').split()
+        )
+        # Linked and bundled as create_static does
+        extras = ["origins = %r" % origins]
+        if self.options.get('link-static-origin', 'false').lower() == 'true':
+            extras.append("link = True")
+        if self.options.get('static-store'):
+            extras.append("store = %r" % os.path.join(
+                self.buildout['buildout']['directory'],
+                self.options['static-store']
+            ))
+        if 'static-bundles' in self.options:
+            extras.append("bundles = %r" % (self.static_bundles(directory),))
+        return self._create_script(
+            '%s-static-watch' % self.options.get('control-script', self.name),
+            self.buildout['buildout']['bin-directory'],
+            'djc.recipe.watch',
+            'main',
+            extras
+        )
+
+    def create_test_script(self):
+        """Creates the ``bin/${:__name__}-test`` script
+        """
+        return self._create_script(
+            '%s-test' % self.options.get('control-script', self.name),
+            self.buildout['buildout']['bin-directory'],
+            'djc.recipe.testrunner',
+            'main',
+            [
+                "apps = %r" % self.t_listify(self.options['apps']),
+                "timings = '%s'" % os.path.join(
+                    self.options['location'], 'test-timings.json'
+                )
+            ]
+        )
+
+    def create_bundle_script(self, files):
+        """Creates the ``bin/${:__name__}-bundle`` script, packing ``files``
+        """
+        base = self.buildout['buildout']['directory']
+        __, ws = self.rws
+        paths = []
+        # Many eggs may share a location, as site-packages
+        for path in [d.location for d in ws] + self.extra_paths:
+            path = os.path.normpath(os.path.abspath(path))
+            if path not in paths:
+                paths.append(path)
+        relative = []
+        for path in files:
+            if path.startswith(base + os.sep):
+                relative.append(path[len(base):].lstrip(os.sep))
+        name = self.options.get('control-script', self.name)
+        return self._create_script(
+            '%s-bundle' % name,
+            self.buildout['buildout']['bin-directory'],
+            'djc.recipe.bundle',
+            'main',
+            [
+                "name = %r" % name,
+                "base = %r" % base,
+                "paths = %r" % paths,
+                "files = %r" % relative,
+            ]
+        )
+
     def install_project(self):
         if 'project' in self.options:
             __, ws = self.rws
@@ -583,12 +1153,16 @@ class Recipe(object):
                 os.path.join(os.path.dirname(project.__file__), 'templates')
             )
 
-    def copy_origin(self, origins, destination, link = False):
-        copier = Copier(link=link)
+    def resolve_origins(self, origins, destination, include=(), exclude=()):
+        """Returns the ``(directory, target, include, exclude)`` tuples for
+        the ``origins`` (``package:directory[:destination][?filters]``) to
+        copy into ``destination``. The glob patterns of the filters
+        (``include=pattern,...&exclude=pattern,...``) are added to the
+        ``include`` and ``exclude`` ones.
+        """
+        resolved = []
         for origin in origins:
-            self._logger.info(
-                "Copying media from '%s' to '%s'" % (origin, destination)
-            )
+            origin, __, filters = origin.partition('?')
             try:
                 components = origin.split(':')
                 mod, directory = components[:2]
@@ -620,7 +1194,32 @@ class Recipe(object):
                 target = os.path.join(destination, components[2])
             else:
                 target = destination
-            copier.copy(orig_directory, target)
+            patterns = {'include': list(include), 'exclude': list(exclude)}
+            for key, values in urlparse.parse_qs(filters).items():
+                if key not in patterns:
+                    raise zc.buildout.UserError(
+                        "Error in '%s': unknown filter '%s' in '%s'" % (
+                            self.name, key, origin
+                        )
+                    )
+                for value in values:
+                    patterns[key].extend([v for v in value.split(',') if v])
+            resolved.append((
+                orig_directory, target,
+                patterns['include'], patterns['exclude']
+            ))
+        return resolved
+
+    def copy_origin(self, origins, destination, link = False, store = None,
+                    include = (), exclude = ()):
+        copier = Copier(link=link, store=store)
+        for origin, (orig_directory, target, origin_include,
+                     origin_exclude) in zip(origins, self.resolve_origins(
+                        origins, destination, include, exclude)):
+            self._logger.info(
+                "Copying media from '%s' to '%s'" % (origin, destination)
+            )
+            copier.copy(orig_directory, target, origin_include, origin_exclude)
         try:
             copier.execute()
         except OSError, e:
@@ -632,6 +1231,46 @@ class Recipe(object):
                 )
             )
 
+    def static_bundles(self, directory):
+        """Returns the arguments of ``build_bundles`` writing the
+        ``static-bundles`` (``output = glob ...``) in ``directory``.
+        """
+        bundles = []
+        for line in self.t_listify(self.options['static-bundles']):
+            output, __, patterns = line.partition('=')
+            if not output.strip() or not patterns.split():
+                raise zc.buildout.UserError(
+                    "Error in '%s': the static-bundles entry '%s' should "
+                    "be in the form 'output = glob ...'" % (self.name, line)
+                )
+            bundles.append((output.strip(), patterns.split()))
+        return (
+            directory, bundles,
+            os.path.join(self.options['location'], 'static-bundles.json'),
+            self.t_boolify(self.options.get('static-bundles-minify', 'true'))
+        )
+
+    def build_bundles(self, directory):
+        """Writes the ``static-bundles`` in ``directory``, unless their inputs
+        did not change.
+        """
+        arguments = self.static_bundles(directory)
+        if not os.path.isdir(self.options['location']):
+            os.makedirs(self.options['location'])
+        try:
+            built, skipped = build_bundles(*arguments)
+        except ValueError, e:
+            raise zc.buildout.UserError(
+                "Error in '%s': cannot write the static-bundles: %s" % (
+                    self.name, e
+                )
+            )
+        self._logger.info(
+            "Static bundles: %d written, %d unchanged" % (
+                len(built), len(skipped)
+            )
+        )
+
     def create_static(self, prefix):
         media_directory = os.path.join(
             self.buildout['buildout']['directory'],
@@ -639,6 +1278,7 @@ class Recipe(object):
         )
         origin_option = '%s-origin' % prefix
         link_option = 'link-%s-origin' % prefix
+        store_option = '%s-store' % prefix
         if origin_option in self.options:
             if not os.path.isdir(media_directory):
                 self._logger.info(
@@ -646,11 +1286,30 @@ class Recipe(object):
                 )
                 os.makedirs(media_directory)
             link = (self.options.get(link_option, 'false').lower() == 'true')
+            store = None
+            if self.options.get(store_option):
+                store = Store(os.path.join(
+                    self.buildout['buildout']['directory'],
+                    self.options[store_option]
+                ))
             self.copy_origin(
                 self.options[origin_option].split(),
                 media_directory,
-                link
+                link,
+                store,
+                self.options.get('%s-include' % origin_option, '').split(),
+                self.options.get('%s-exclude' % origin_option, '').split()
             )
+            if store is not None and self.t_boolify(
+                    self.options.get('%s-prune' % store_option, 'false')):
+                count, size = store.prune()
+                self._logger.info(
+                    "Pruned %d unused files (%d bytes) from '%s'" % (
+                        count, size, store.directory
+                    )
+                )
+            if prefix == 'static' and 'static-bundles' in self.options:
+                self.build_bundles(media_directory)
         else:
             if not os.path.isdir(media_directory):
                 self._logger.info(
@@ -689,13 +1348,27 @@ class Recipe(object):
         self.create_static('media') # we don't tell buildout we have created
                                     # this directory so it's not deleted before
                                     # update/reinstallation
+        if self.t_boolify(self.options['template-cache']):
+            self.report_templates()
         files = (
             self.create_project() +
             self.create_static('static') +
             self.create_manage_script()
         )
+        # After the project, that makes the part directory for the state
+        if self.t_boolify(self.options.get('compile-messages', 'false')):
+            self.compile_messages()
         if self.t_boolify(self.options.get('wsgi', 'false')):
             files += self.create_wsgi_script()
+        if 'wsgi-sites' in self.options:
+            files += self.create_dispatch_script()
+        if self.t_boolify(self.options.get('static-watch', 'false')) and \
+                'static-origin' in self.options:
+            files += self.create_watch_script()
+        if self.t_boolify(self.options.get('test-script', 'false')):
+            files += self.create_test_script()
+        if self.t_boolify(self.options.get('bundle', 'false')):
+            files += self.create_bundle_script(files)
         return tuple(files)
 
     update = install
@@ -0,0 +1,157 @@
+"""A database router spreading the reads across read replicas.
+
+The replicas, and their weights, are taken from the ``DATABASE_REPLICAS``
+setting (generated by the recipe from the ``database-replicas`` option). The
+reads go to the replicas in weighted round-robin::
+
+    >>> from djc.recipe.router import ReplicaRouter
+    >>> router = ReplicaRouter({'replica1': 1, 'replica2': 2},
+    ...                        check=lambda alias: True)
+    >>> [router.db_for_read(None) for i in range(6)]
+    ['replica2', 'replica1', 'replica2', 'replica2', 'replica1', 'replica2']
+
+Once something has been written, the reads go to the primary database as
+well, so that they see what has been written, until the end of the request::
+
+    >>> router.db_for_write(None)
+    'default'
+    >>> router.db_for_read(None)
+    'default'
+    >>> router.unpin()
+    >>> router.db_for_read(None)
+    'replica2'
+
+Whether a replica can be connected to is checked at most once every
+``retry`` seconds, not on every read. Those that cannot are left out until
+the next check, if none is left the primary is used::
+
+    >>> broken = set(['replica2'])
+    >>> checks = []
+    >>> def check(alias):
+    ...     checks.append(alias)
+    ...     return alias not in broken
+    >>> router = ReplicaRouter({'replica1': 1, 'replica2': 1}, check=check)
+    >>> [router.db_for_read(None) for i in range(3)]
+    ['replica1', 'replica1', 'replica1']
+    >>> checks
+    ['replica1', 'replica2']
+
+The failures met by the application can be reported, leaving the replica out
+straight away::
+
+    >>> router.mark_down('replica1')
+    >>> router.db_for_read(None)
+    'default'
+"""
+
+import time, logging, threading
+from django.db.utils import DEFAULT_DB_ALIAS
+from django.core.signals import request_started, request_finished
+
+
+logger = logging.getLogger('djc.recipe.router')
+
+
+def weighted_cycle(weights):
+    """Returns the aliases in ``weights`` spread according to their weight
+    (smooth weighted round-robin).
+    """
+    current = dict([(alias, 0) for alias in weights])
+    total = sum(weights.values())
+    order = []
+    for __ in range(total):
+        for alias in sorted(weights):
+            current[alias] += weights[alias]
+        chosen = max(sorted(current), key=lambda a: current[a])
+        current[chosen] -= total
+        order.append(chosen)
+    return order
+
+
+def check_connection(alias):
+    """Returns whether the database ``alias`` can be connected to.
+    """
+    from django.db import connections
+    try:
+        connections[alias].cursor().close()
+    except Exception, e:
+        logger.warning("Read replica '%s' is failing: %s" % (alias, e))
+        return False
+    return True
+
+
+class ReplicaRouter(object):
+    """Routes the reads to ``replicas`` (a mapping of aliases to weights,
+    ``DATABASE_REPLICAS`` by default) and everything else to the primary.
+    """
+
+    def __init__(self, replicas=None, retry=None, check=check_connection):
+        if replicas is None or retry is None:
+            from django.conf import settings
+            if replicas is None:
+                replicas = getattr(settings, 'DATABASE_REPLICAS', {})
+            if retry is None:
+                retry = getattr(settings, 'DATABASE_REPLICA_RETRY', 30)
+        self.replicas = replicas
+        self.retry = retry
+        self.check = check
+        self.order = weighted_cycle(replicas)
+        self.position = 0
+        self.down = set()
+        # When each replica is to be checked next
+        self.next_check = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        request_started.connect(self.unpin, weak=False)
+        request_finished.connect(self.unpin, weak=False)
+
+    def unpin(self, **kwargs):
+        self._local.pinned = False
+
+    def mark_down(self, alias):
+        """Leaves ``alias`` out until it is checked again, in ``retry``
+        seconds.
+        """
+        self.down.add(alias)
+        self.next_check[alias] = time.time() + self.retry
+
+    def available(self, alias):
+        now = time.time()
+        if now < self.next_check.get(alias, 0):
+            return alias not in self.down
+        # Set first, so that the other threads do not check it as well
+        self.next_check[alias] = now + self.retry
+        if not self.check(alias):
+            self.down.add(alias)
+            return False
+        self.down.discard(alias)
+        return True
+
+    def db_for_read(self, model, **hints):
+        if getattr(self._local, 'pinned', False):
+            return DEFAULT_DB_ALIAS
+        for __ in range(len(self.order)):
+            self._lock.acquire()
+            try:
+                alias = self.order[self.position]
+                self.position = (self.position + 1) % len(self.order)
+            finally:
+                self._lock.release()
+            if self.available(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        self._local.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = [DEFAULT_DB_ALIAS] + list(self.replicas)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if db in self.replicas:
+            return False
+        return None
@@ -0,0 +1,282 @@
+"""Serves the static directory straight from the WSGI application, before
+Django is even reached.
+
+The files are indexed once, when the application starts: files added later
+are not served (and the requests fall through to Django). Small files are
+kept in memory in a size bounded LRU cache, large ones are handed to the
+server's ``wsgi.file_wrapper`` (hence ``sendfile`` where available).
+
+Let's index a directory with a stylesheet and its precompressed sibling::
+
+    >>> import os, gzip
+    >>> from djc.recipe.static import StaticMiddleware
+    >>> css = open(os.path.join(root, 'main.css'), 'wb')
+    >>> css.write('body { color: red; }\\n')
+    >>> css.close()
+    >>> compressed = gzip.open(os.path.join(root, 'main.css.gz'), 'wb')
+    >>> __ = compressed.write('body { color: red; }\\n')
+    >>> compressed.close()
+    >>> def django(environ, start_response):
+    ...     start_response('404 NOT FOUND', [])
+    ...     return ['Django']
+    >>> app = StaticMiddleware(django, root, '/static/')
+    >>> def start_response(status, headers):
+    ...     print status
+    ...     for header in sorted(headers):
+    ...         if header[0] not in ('Last-Modified', 'ETag'):
+    ...             print '%s: %s' % header
+    >>> def get(path, **headers):
+    ...     environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+    ...     environ.update(headers)
+    ...     return ''.join(app(environ, start_response))
+
+Requests under the static url are answered directly, everything else goes to
+Django::
+
+    >>> get('/static/main.css')
+    200 OK
+    Accept-Ranges: bytes
+    Content-Length: 21
+    Content-Type: text/css
+    Vary: Accept-Encoding
+    'body { color: red; }\\n'
+    >>> get('/static/missing.css')
+    404 NOT FOUND
+    'Django'
+    >>> get('/other/main.css')
+    404 NOT FOUND
+    'Django'
+
+Clients accepting ``gzip`` get the precompressed file::
+
+    >>> body = get('/static/main.css', HTTP_ACCEPT_ENCODING='gzip, deflate')
+    200 OK
+    Accept-Ranges: bytes
+    Content-Encoding: gzip
+    Content-Length: ...
+    Content-Type: text/css
+    Vary: Accept-Encoding
+    >>> body[:2] == '\\x1f\\x8b'
+    True
+    >>> body = get('/static/main.css', HTTP_ACCEPT_ENCODING='gzip;q=0')
+    200 OK
+    Accept-Ranges: bytes
+    Content-Length: 21
+    Content-Type: text/css
+    Vary: Accept-Encoding
+
+Conditional and partial requests are supported::
+
+    >>> etag = app.index['main.css'].etag
+    >>> get('/static/main.css', HTTP_IF_NONE_MATCH=etag)
+    304 NOT MODIFIED
+    Vary: Accept-Encoding
+    ''
+    >>> get('/static/main.css', HTTP_RANGE='bytes=0-3')
+    206 PARTIAL CONTENT
+    Accept-Ranges: bytes
+    Content-Length: 4
+    Content-Range: bytes 0-3/21
+    Content-Type: text/css
+    Vary: Accept-Encoding
+    'body'
+    >>> get('/static/main.css', HTTP_RANGE='bytes=-2')
+    206 PARTIAL CONTENT
+    ...
+    Content-Range: bytes 19-20/21
+    ...
+    '}\\n'
+    >>> get('/static/main.css', HTTP_RANGE='bytes=30-')
+    416 REQUESTED RANGE NOT SATISFIABLE
+    Content-Length: 0
+    Content-Range: bytes */21
+    Content-Type: text/plain; charset=utf-8
+    ''
+"""
+
+import os, re, mimetypes, email.utils
+from lru import LRUCache
+from wsgiutils import simple_response
+from compression import accepts_gzip
+
+
+# Files bigger than this are never kept in memory
+DEFAULT_MAX_SIZE = 256 * 1024
+# The total size of the files kept in memory
+DEFAULT_CACHE_SIZE = 16 * 1024 * 1024
+BLOCK_SIZE = 64 * 1024
+
+range_regex = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class StaticFile(object):
+    """A file in the index.
+    """
+
+    def __init__(self, path, gzipped=None):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.content_type = mimetypes.guess_type(path)[0] or \
+                'application/octet-stream'
+        self.gzipped = gzipped
+
+
+def build_index(root):
+    """Maps the (``/`` separated) relative path of each file within ``root``
+    to its ``StaticFile``.
+    """
+    paths = {}
+    for dirpath, __, files in os.walk(root, followlinks=True):
+        for file_ in files:
+            path = os.path.join(dirpath, file_)
+            relative = path[len(root):].lstrip(os.sep).replace(os.sep, '/')
+            paths[relative] = path
+    index = {}
+    for relative, path in paths.iteritems():
+        gzipped = None
+        if relative + '.gz' in paths:
+            gzipped = StaticFile(paths[relative + '.gz'])
+            gzipped.etag = gzipped.etag[:-1] + '-gz"'
+        static_file = StaticFile(path, gzipped)
+        if gzipped is not None:
+            gzipped.content_type = static_file.content_type
+        index[relative] = static_file
+    return index
+
+
+def parse_range(header, size):
+    """Returns the ``(start, end)`` (inclusive) byte range asked for by a
+    ``Range`` header, ``None`` if the header is to be ignored, and raises
+    ``ValueError`` if the range cannot be satisfied.
+    """
+    m = range_regex.match(header.strip())
+    if m is None:
+        # Malformed or multiple ranges: the whole file is sent
+        return None
+    first, last = m.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return (max(size - length, 0), size - 1)
+    first = int(first)
+    if first >= size:
+        raise ValueError(header)
+    if last == '' or int(last) >= size:
+        return (first, size - 1)
+    if int(last) < first:
+        return None
+    return (first, int(last))
+
+
+def read_range(path, start, length):
+    stream = open(path, 'rb')
+    try:
+        stream.seek(start)
+        while length > 0:
+            data = stream.read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        stream.close()
+
+
+class StaticMiddleware(object):
+    """Answers ``GET`` and ``HEAD`` requests for the files found in ``root``,
+    mounted at ``url``.
+    """
+
+    def __init__(self, application, root, url, cache_size=DEFAULT_CACHE_SIZE,
+                 max_size=DEFAULT_MAX_SIZE, max_age=None):
+        self.application = application
+        self.root = root
+        self.url = '/' + url.strip('/') + '/'
+        self.max_size = max_size
+        self.max_age = max_age
+        self.cache = LRUCache(cache_size, sizeof=len)
+        self.index = build_index(root)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.url) or \
+                environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+        static_file = self.index.get(path[len(self.url):])
+        if static_file is None:
+            return self.application(environ, start_response)
+        return self.serve(static_file, environ, start_response)
+
+    def serve(self, static_file, environ, start_response):
+        headers = [('Vary', 'Accept-Encoding')]
+        if static_file.gzipped is not None and \
+                accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING', '')):
+            static_file = static_file.gzipped
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.extend([
+            ('ETag', static_file.etag),
+            ('Last-Modified', static_file.last_modified),
+        ])
+        if self.max_age is not None:
+            headers.append(('Cache-Control', 'max-age=%d' % self.max_age))
+
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None and (
+                if_none_match.strip() == '*' or static_file.etag in [
+                    tag.strip() for tag in if_none_match.split(',')
+                ]):
+            start_response('304 NOT MODIFIED', headers)
+            return []
+
+        headers.extend([
+            ('Content-Type', static_file.content_type),
+            ('Accept-Ranges', 'bytes'),
+        ])
+        byte_range = None
+        if 'HTTP_RANGE' in environ and \
+                environ.get('HTTP_IF_RANGE', static_file.etag) == \
+                    static_file.etag:
+            try:
+                byte_range = parse_range(
+                    environ['HTTP_RANGE'], static_file.size
+                )
+            except ValueError:
+                return simple_response(
+                    start_response, '416 REQUESTED RANGE NOT SATISFIABLE', '',
+                    headers=[
+                        ('Content-Range', 'bytes */%d' % static_file.size)
+                    ]
+                )
+        if byte_range is None:
+            status = '200 OK'
+            start, length = 0, static_file.size
+        else:
+            status = '206 PARTIAL CONTENT'
+            start, length = byte_range[0], byte_range[1] - byte_range[0] + 1
+            headers.append(('Content-Range', 'bytes %d-%d/%d' % (
+                byte_range[0], byte_range[1], static_file.size
+            )))
+        headers.append(('Content-Length', str(length)))
+        start_response(status, headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+
+        if static_file.size <= self.max_size:
+            data = self.cache.get(static_file.path)
+            if data is None:
+                stream = open(static_file.path, 'rb')
+                data = stream.read()
+                stream.close()
+                self.cache.set(static_file.path, data)
+            return [data[start:start + length]]
+        if byte_range is None and 'wsgi.file_wrapper' in environ:
+            return environ['wsgi.file_wrapper'](
+                open(static_file.path, 'rb'), BLOCK_SIZE
+            )
+        return read_range(static_file.path, start, length)
@@ -0,0 +1,306 @@
+"""A file system storage spreading the files in hashed subdirectories.
+
+The names of the files (the ones stored in the database) do not change, but
+each file is kept below ``DEPTH`` levels of subdirectories, each ``WIDTH``
+characters long, taken from the hash of its name, so that no directory ends
+up holding too many files::
+
+    >>> from django.core.files.base import ContentFile
+    >>> from djc.recipe.storage import ShardedFileSystemStorage
+    >>> storage = ShardedFileSystemStorage(location=root, base_url='/media/',
+    ...                                    depth=2, width=2)
+    >>> print storage.save('uploads/spam.txt', ContentFile('spam'))
+    uploads/spam.txt
+    >>> print storage.path('uploads/spam.txt')[len(root):]
+    /b7/1e/uploads/spam.txt
+    >>> storage.open('uploads/spam.txt').read()
+    'spam'
+
+The files that are still in the flat layout (not yet moved by the
+``shard_media`` management command) are found as well::
+
+    >>> __ = ShardedFileSystemStorage(location=root, depth=0).save(
+    ...     'eggs.txt', ContentFile('eggs'))
+    >>> storage.exists('eggs.txt')
+    True
+    >>> storage.shard('eggs.txt')
+    True
+    >>> print storage.path('eggs.txt')[len(root):]
+    /d0/8e/eggs.txt
+
+The urls do not depend on the layout, so that they stay the same when the
+files are moved: the ``serve`` view finds the files they name::
+
+    >>> storage.url('eggs.txt')
+    '/media/eggs.txt'
+
+Directories are listed as if the files were all in the flat layout, even
+the ones named as the directories of the sharded layout::
+
+    >>> flat = ShardedFileSystemStorage(location=root, depth=0)
+    >>> for name in ('more/c.txt', 'ab/d.txt'):
+    ...     __ = flat.save(name, ContentFile(name))
+    >>> __ = storage.save('more/e.txt', ContentFile('e'))
+    >>> storage.listdir('')
+    ([u'ab', u'more', u'uploads'], [u'eggs.txt'])
+    >>> storage.listdir('more')
+    ([], [u'c.txt', u'e.txt'])
+    >>> storage.listdir('ab')
+    ([], [u'd.txt'])
+
+The whole tree can be moved at once, by many threads::
+
+    >>> for name in ('a.txt', 'b.txt'):
+    ...     __ = flat.save(name, ContentFile(name))
+    >>> sorted(storage.flat_files())
+    ['a.txt', 'ab/d.txt', 'b.txt', 'more/c.txt']
+    >>> storage.shard_all(workers=2)
+    4
+    >>> list(storage.flat_files())
+    []
+    >>> storage.open('more/c.txt').read()
+    'more/c.txt'
+    >>> storage.listdir('')
+    ([u'ab', u'more', u'uploads'], [u'a.txt', u'b.txt', u'eggs.txt'])
+
+Once no file is left in the flat layout, that is recorded, and the storages
+created afterwards no longer look for them::
+
+    >>> ShardedFileSystemStorage(location=root).flat
+    False
+
+The ``serve`` view sends the files, as found by the storage::
+
+    >>> from djc.recipe.storage import serve
+    >>> response = serve(None, 'more/c.txt', storage)
+    >>> response['Content-Length'], ''.join(response)
+    ('10', 'more/c.txt')
+    >>> serve(None, '../spam.txt', storage)
+    Traceback (most recent call last):
+      ...
+    Http404: '../spam.txt' does not exist
+"""
+
+import os, errno, hashlib, posixpath
+from multiprocessing.pool import ThreadPool
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.http import Http404
+from django.utils.encoding import smart_str
+
+
+# Written in the storage root once no file is left in the flat layout
+SHARDED_MARKER = '.sharded'
+
+
+class ShardedFileSystemStorage(FileSystemStorage):
+    """A ``FileSystemStorage`` that keeps the files below hashed directories,
+    configured by the ``MEDIA_SHARDING`` setting (``DEPTH`` and ``WIDTH``,
+    both defaulting to ``2``).
+    """
+
+    def __init__(self, location=None, base_url=None, depth=None, width=None):
+        super(ShardedFileSystemStorage, self).__init__(location, base_url)
+        sharding = getattr(settings, 'MEDIA_SHARDING', {})
+        if depth is None:
+            depth = sharding.get('DEPTH', 2)
+        if width is None:
+            width = sharding.get('WIDTH', 2)
+        self.depth = depth
+        self.width = width
+        # Whether files may still be in the flat layout
+        self.flat = depth > 0 and not os.path.exists(
+            os.path.join(self.location, SHARDED_MARKER)
+        )
+
+    def sharded_name(self, name):
+        """Returns the name of the file relative to the storage root.
+        """
+        name = os.path.normpath(name).replace(os.sep, '/')
+        digest = hashlib.md5(smart_str(name)).hexdigest()
+        prefix = [
+            digest[i * self.width:(i + 1) * self.width]
+            for i in range(self.depth)
+        ]
+        return '/'.join(prefix + [name])
+
+    def locate(self, name):
+        """Returns where ``name`` is, relative to the storage root: the
+        sharded position, unless the file is still only in the flat one.
+        """
+        sharded = self.sharded_name(name)
+        base = super(ShardedFileSystemStorage, self)
+        if self.flat and not os.path.exists(base.path(sharded)) and \
+                os.path.exists(base.path(name)):
+            return name
+        return sharded
+
+    def path(self, name):
+        return super(ShardedFileSystemStorage, self).path(self.locate(name))
+
+    def shard_directories(self):
+        """Returns the existing directories of the last level of the sharded
+        layout, relative to the storage root.
+        """
+        base = super(ShardedFileSystemStorage, self)
+        directories = ['']
+        for level in range(self.depth):
+            found = []
+            for directory in directories:
+                for name in os.listdir(base.path(directory)):
+                    child = directory and directory + '/' + name or name
+                    if self.is_shard_name(name) and \
+                            os.path.isdir(base.path(child)):
+                        found.append(child)
+            directories = found
+        return directories
+
+    def is_shard_name(self, name):
+        return len(name) == self.width and \
+            not name.strip('0123456789abcdef')
+
+    def is_shard_directory(self, name):
+        """Returns whether the directory ``name`` (relative to the storage
+        root) only belongs to the sharded layout: a directory of the flat
+        layout may have the same name, it then holds files of that layout.
+        """
+        parts = name.split('/')
+        if len(parts) > self.depth or \
+                not all([self.is_shard_name(p) for p in parts]):
+            return False
+        base = super(ShardedFileSystemStorage, self)
+        for entry in os.listdir(base.path(name)):
+            child = name + '/' + entry
+            if not os.path.isdir(base.path(child)):
+                if not self.is_sharded(child):
+                    return False
+            elif len(parts) < self.depth and \
+                    not self.is_shard_directory(child):
+                return False
+        return True
+
+    def listdir_as_is(self, name):
+        """Lists the directory ``name`` relative to the storage root,
+        whatever the layout.
+        """
+        path = super(ShardedFileSystemStorage, self).path(name)
+        directories, files = [], []
+        for entry in os.listdir(path):
+            if os.path.isdir(os.path.join(path, entry)):
+                directories.append(entry)
+            else:
+                files.append(entry)
+        return directories, files
+
+    def listdir(self, path):
+        """Lists ``path`` as if all the files were in the flat layout,
+        looking for the sharded ones below every shard directory.
+        """
+        base = super(ShardedFileSystemStorage, self)
+        path = '/'.join([
+            p for p in path.replace(os.sep, '/').split('/')
+            if p not in ('', '.')
+        ])
+        directories, files = set(), set()
+        if os.path.isdir(base.path(path)):
+            found, files_found = self.listdir_as_is(path)
+            if self.depth > 0:
+                # Leaving the sharded layout out
+                found = [
+                    d for d in found if not self.is_shard_directory(
+                        path and path + '/' + d or d
+                    )
+                ]
+                files_found = [
+                    f for f in files_found if not self.is_sharded(
+                        path and path + '/' + f or f
+                    ) and (path or f != SHARDED_MARKER)
+                ]
+            directories.update(found)
+            files.update(files_found)
+        if self.depth > 0:
+            for shard in self.shard_directories():
+                directory = path and shard + '/' + path or shard
+                if not os.path.isdir(base.path(directory)):
+                    continue
+                found, files_found = self.listdir_as_is(directory)
+                directories.update(found)
+                files.update([
+                    f for f in files_found if self.sharded_name(
+                        path and path + '/' + f or f
+                    ) == directory + '/' + f
+                ])
+        return sorted(directories), sorted(files)
+
+    def shard(self, name):
+        """Moves ``name`` from the flat layout to the sharded one, returns
+        whether it has been moved.
+        """
+        base = super(ShardedFileSystemStorage, self)
+        source = base.path(name)
+        target = base.path(self.sharded_name(name))
+        if source == target or not os.path.isfile(source) or \
+                os.path.exists(target):
+            return False
+        directory = os.path.dirname(target)
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        os.rename(source, target)
+        return True
+
+    def is_sharded(self, name):
+        """Returns whether ``name`` (relative to the storage root) is in the
+        sharded layout.
+        """
+        parts = name.split('/', self.depth)
+        return len(parts) > self.depth and \
+                self.sharded_name(parts[-1]) == name
+
+    def flat_files(self):
+        """Yields the names of the files still in the flat layout.
+        """
+        for root, directories, files in os.walk(self.location):
+            relative = root[len(self.location):].strip(os.sep)
+            for file_ in files:
+                name = '/'.join(
+                    [p for p in relative.split(os.sep) if p] + [file_]
+                )
+                if name != SHARDED_MARKER and not self.is_sharded(name):
+                    yield name
+
+    def shard_all(self, workers=8):
+        """Moves all the files in the flat layout, using ``workers`` threads,
+        returns how many have been moved. If none is left, that is recorded.
+        """
+        pool = ThreadPool(workers)
+        try:
+            count = sum(pool.imap_unordered(
+                self.shard, self.flat_files(), chunksize=64
+            ))
+        finally:
+            pool.close()
+            pool.join()
+        if self.depth > 0:
+            for name in self.flat_files():
+                break
+            else:
+                open(os.path.join(self.location, SHARDED_MARKER), 'w').close()
+                self.flat = False
+        return count
+
+
+def serve(request, path, storage=None):
+    """Sends the file ``path`` of ``storage`` (the default storage, if not
+    given), wherever it is: the view for the urls of a sharded storage.
+    """
+    from offload import media_response
+    if storage is None:
+        from django.core.files.storage import default_storage as storage
+    name = posixpath.normpath(path.replace('\\', '/')).lstrip('/')
+    if name in ('', '.') or name == '..' or name.startswith('../') or \
+            not storage.exists(name):
+        raise Http404("'%s' does not exist" % path)
+    return media_response(name, storage)
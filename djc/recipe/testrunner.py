@@ -0,0 +1,225 @@
+"""Runs the tests of a project in parallel, sharding the test labels (by
+default, the applications listed in the ``apps`` option) across processes.
+
+Each worker creates its own test databases (their names are suffixed with the
+number of the worker), runs the labels it has been given and reports back its
+results, which are merged into one report.
+
+The labels are spread so that the workers take about the same time, using
+the timings of the previous run where known::
+
+    >>> from djc.recipe.testrunner import shard
+    >>> shard(['a', 'b', 'c', 'd', 'e'], 2, {'a': 10, 'b': 2, 'c': 3, 'd': 4})
+    [['a', 'b'], ['e', 'd', 'c']]
+    >>> shard(['a', 'b', 'c'], 4, {})
+    [['a'], ['b'], ['c']]
+
+The names of the test databases are suffixed, unless they are in-memory
+SQLite databases::
+
+    >>> from djc.recipe.testrunner import worker_database_name
+    >>> worker_database_name({'ENGINE': 'django.db.backends.mysql',
+    ...                       'NAME': 'project', 'TEST_NAME': None}, 3)
+    'test_project_3'
+    >>> worker_database_name({'ENGINE': 'django.db.backends.sqlite3',
+    ...                       'NAME': 'project.db', 'TEST_NAME': None}, 3)
+"""
+
+import os, sys, time, Queue, optparse, traceback, multiprocessing
+from cStringIO import StringIO
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+from utils import setup_django
+
+
+def shard(labels, processes, timings):
+    """Splits ``labels`` in at most ``processes`` lists, balancing their total
+    duration according to ``timings`` (labels without timings are assumed to
+    take as long as the average).
+    """
+    known = [timings[label] for label in labels if label in timings]
+    average = known and float(sum(known)) / len(known) or 1
+    shards = [[] for __ in range(min(processes, len(labels)))]
+    totals = [0] * len(shards)
+    # The longest first, each to the least busy worker
+    for label in sorted(labels, key=lambda l: -timings.get(l, average)):
+        index = totals.index(min(totals))
+        shards[index].append(label)
+        totals[index] += timings.get(label, average)
+    return shards
+
+
+def worker_database_name(settings_dict, worker):
+    """Returns the test database name for ``worker``, or ``None`` if the
+    default one is fine.
+    """
+    name = settings_dict.get('TEST_NAME')
+    if not name:
+        if settings_dict['ENGINE'].endswith('sqlite3'):
+            # In memory, hence private to the worker
+            return None
+        name = 'test_' + settings_dict['NAME']
+    return '%s_%d' % (name, worker)
+
+
+def failure(worker, labels, error):
+    """Returns the result of a worker that could not run ``labels``.
+    """
+    return {
+        'label': ', '.join(labels),
+        'time': 0,
+        'tests': 0,
+        'failures': [],
+        'errors': [('worker %d' % worker, error)],
+    }
+
+
+def run_shard(worker, labels, verbosity, failfast, queue):
+    """Runs ``labels`` and puts the results in ``queue``.
+    """
+    stream = StringIO()
+    results = []
+    try:
+        from django.conf import settings
+        from django.db import connections
+        from django.test.utils import get_runner
+        for alias in connections:
+            settings_dict = connections[alias].settings_dict
+            if not settings_dict.get('TEST_MIRROR'):
+                name = worker_database_name(settings_dict, worker)
+                if name is not None:
+                    settings_dict['TEST_NAME'] = name
+        runner = get_runner(settings)(verbosity=verbosity, interactive=False,
+                                      failfast=failfast)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            for label in labels:
+                suite = runner.build_suite([label])
+                start = time.time()
+                result = unittest_runner(stream, verbosity, failfast).run(
+                    suite
+                )
+                results.append({
+                    'label': label,
+                    'time': time.time() - start,
+                    'tests': result.testsRun,
+                    'failures': [
+                        (str(t), e) for t, e in result.failures
+                    ],
+                    'errors': [(str(t), e) for t, e in result.errors],
+                })
+                if failfast and not result.wasSuccessful():
+                    break
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+    except (Exception, SystemExit):
+        # As when the test databases cannot be created, that exits
+        results.append(failure(worker, labels, traceback.format_exc()))
+    queue.put((worker, stream.getvalue(), results))
+
+
+def unittest_runner(stream, verbosity, failfast):
+    from django.utils import unittest
+    return unittest.TextTestRunner(stream=stream, verbosity=verbosity,
+                                   failfast=failfast)
+
+
+def report(results, elapsed, stream=sys.stderr):
+    """Writes the merged ``results`` to ``stream``, returns the number of
+    failed tests.
+    """
+    failed = 0
+    for result in results:
+        for kind, problems in (('FAIL', result['failures']),
+                               ('ERROR', result['errors'])):
+            for test, error in problems:
+                failed += 1
+                stream.write('=' * 70 + '\n')
+                stream.write('%s: %s\n' % (kind, test))
+                stream.write('-' * 70 + '\n')
+                stream.write('%s\n' % error)
+    stream.write('-' * 70 + '\n')
+    for result in sorted(results, key=lambda r: -r['time']):
+        stream.write('%8.3fs %5d tests  %s\n' % (
+            result['time'], result['tests'], result['label']
+        ))
+    stream.write('\nRan %d tests in %.3fs (%.3fs of test time)\n\n' % (
+        sum([r['tests'] for r in results]),
+        elapsed,
+        sum([r['time'] for r in results])
+    ))
+    if failed:
+        stream.write('FAILED (%d)\n' % failed)
+    else:
+        stream.write('OK\n')
+    return failed
+
+
+def main(settings, apps=[], timings=None):
+    setup_django(settings)
+    parser = optparse.OptionParser(usage="%prog [options] [label ...]")
+    parser.add_option('-p', '--processes', type='int',
+                      default=multiprocessing.cpu_count(),
+                      help="the number of worker processes")
+    parser.add_option('-v', '--verbosity', type='int', default=1)
+    parser.add_option('--failfast', action='store_true', default=False)
+    options, labels = parser.parse_args()
+    if not labels:
+        labels = [app.split('.')[-1] for app in apps]
+    if not labels:
+        from django.db.models import get_apps
+        labels = [app.__name__.split('.')[-2] for app in get_apps()]
+
+    known = {}
+    if timings and os.path.exists(timings):
+        stream = open(timings, 'rb')
+        known = json.load(stream)
+        stream.close()
+
+    start = time.time()
+    queue = multiprocessing.Queue()
+    workers = {}
+    for worker, shard_labels in enumerate(
+            shard(labels, max(1, options.processes), known)):
+        process = multiprocessing.Process(
+            target=run_shard,
+            args=(worker, shard_labels, options.verbosity, options.failfast,
+                  queue)
+        )
+        process.start()
+        workers[worker] = (process, shard_labels)
+    results = []
+    pending = set(workers)
+    while pending:
+        dead = [w for w in pending if not workers[w][0].is_alive()]
+        try:
+            worker, output, worker_results = queue.get(timeout=1)
+        except Queue.Empty:
+            # The results of the workers that were dead before waiting would
+            # have been read: they crashed before putting any
+            for worker in dead:
+                process, shard_labels = workers[worker]
+                pending.discard(worker)
+                results.append(failure(
+                    worker, shard_labels,
+                    "Exited with code %s" % process.exitcode
+                ))
+            continue
+        pending.discard(worker)
+        if options.verbosity > 1:
+            sys.stderr.write(output)
+        results.extend(worker_results)
+    for process, __ in workers.values():
+        process.join()
+
+    if timings:
+        for result in results:
+            known[result['label']] = result['time']
+        stream = open(timings, 'wb')
+        json.dump(known, stream, indent=2, sort_keys=True)
+        stream.close()
+    return report(results, time.time() - start) and 1 or 0
@@ -1 +1,16 @@
 # package
+
+
+def configure_django():
+    """Sets up the bare minimum of Django settings the doctests need.
+    """
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(
+            DATABASES={
+                'default': {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': ':memory:',
+                }
+            }
+        )
@@ -0,0 +1,246 @@
+"""Benchmarks for the install-time hot paths: ``Copier`` (scheduling, merging,
+executing and the tree hashing underneath), ``split_dburl`` and the rendering
+of the settings.
+
+The scenarios work on synthetic data: wide, deep and many overlapping origin
+trees for the copier, many database urls and buildouts with many sections and
+databases for the settings. Each stage is timed (the best of ``--repeat``
+runs is kept) and its peak memory measured with ``tracemalloc``: there is
+none on Python 2, where only the times are measured (and compared).
+
+The results are compared with a stored baseline, and the run fails if any of
+them exceeds it by more than ``--margin`` (a fraction). If the baseline does
+not exist yet, or ``--update`` is given, the results become the baseline.
+
+Run it, with the interpreter that has ``djc.recipe`` and Django on its path
+(such as the one of the buildout, or of a virtualenv it is installed in),
+with::
+
+    $ python -m djc.recipe.tests.benchmarks --baseline benchmarks.json \\
+          --margin 0.25
+"""
+
+import os, sys, gc, time, shutil, tempfile, optparse
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+from djc.recipe.copier import Copier, Store
+from djc.recipe.recipe import Recipe, split_dburl
+
+
+def create_file(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    f = open(path, 'wb')
+    f.write(content)
+    f.close()
+
+
+def make_tree(base, width, depth, files, content='x' * 512):
+    """Creates ``files`` files in each directory of a tree ``depth`` levels
+    deep, each directory having ``width`` subdirectories.
+    """
+    for i in range(files):
+        create_file(os.path.join(base, 'file%d.txt' % i), content)
+    if depth > 0:
+        for i in range(width):
+            make_tree(os.path.join(base, 'dir%d' % i), width, depth - 1,
+                      files, content)
+
+
+class Stages(object):
+    """Runs and measures the stages of a scenario.
+    """
+
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, function, *args):
+        gc.collect()
+        if tracemalloc is not None:
+            tracemalloc.start()
+        start = time.time()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.time() - start
+            peak = None
+            if tracemalloc is not None:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.results[name] = {'time': elapsed, 'memory': peak}
+
+
+def copier_scenario(origins, scale, store=False):
+    """Builds the scenario copying ``origins``, a list of ``(width, depth,
+    files)``, into the same target (through a ``Store`` if ``store``).
+    """
+
+    def scenario(stages, workdir):
+        sources = []
+        for i, (width, depth, files) in enumerate(origins):
+            source = os.path.join(workdir, 'origin%d' % i)
+            make_tree(source, width, depth, max(1, int(files * scale)))
+            sources.append(source)
+        target = os.path.join(workdir, 'target')
+        copier = Copier(link=False, store=store and Store(
+            os.path.join(workdir, 'store')
+        ) or None)
+
+        def copy():
+            for source in sources:
+                copier.copy(source, target)
+        stages.run('copy', copy)
+        stages.run('tree-hash', lambda: list(copier.targets.subtrees(os.sep)))
+        stages.run('merge', copier._merge)
+        stages.run('execute', copier.execute)
+
+    return scenario
+
+
+def dburl_scenario(stages, workdir, scale=1):
+    urls = []
+    for i in range(int(2000 * scale)):
+        urls.append(
+            'engine=django.db.backends.postgresql_psycopg2 user=user%d '
+            'password=pwd host=/var/run/postgresql port=5432 name=db%d '
+            'conn_max_age=600 pool=(min=1,max=10) options=(a=b,c=d)' % (i, i)
+        )
+        urls.append(
+            'postgresql_psycopg2://user%d:pwd@db%d.example.com:5432/db%d'
+            '(a=b,c=d)' % (i, i, i)
+        )
+    stages.run('split', lambda: [split_dburl(url) for url in urls])
+
+
+def settings_scenario(stages, workdir, scale=1):
+    buildout = {
+        'buildout': {
+            'directory': workdir,
+            'parts-directory': os.path.join(workdir, 'parts'),
+            'bin-directory': os.path.join(workdir, 'bin'),
+        }
+    }
+    for i in range(int(200 * scale)):
+        buildout['section%d' % i] = dict([
+            ('option-%d' % j, 'value %d' % j) for j in range(20)
+        ])
+    options = {
+        'recipe': 'djc.recipe',
+        'urlconf': 'project.urls',
+        'templates': os.path.join(workdir, 'templates'),
+        'apps': '\n'.join(['app%d' % i for i in range(50)]),
+        'additional-databases': '\n'.join([
+            'db%d=engine=django.db.backends.postgresql_psycopg2 '
+            'host=db%d.example.com name=db%d pool=(max=5)' % (i, i, i)
+            for i in range(int(50 * scale))
+        ]),
+    }
+    recipe = Recipe(buildout, 'django', options)
+    recipe.secret
+    stages.run('render', lambda: recipe.settings_py)
+
+
+def scenarios(scale):
+    return [
+        ('copier-wide', copier_scenario([(1, 1, 2000)], scale)),
+        ('copier-deep', copier_scenario([(1, 12, 20)], scale)),
+        ('copier-overlapping', copier_scenario([(4, 3, 5)] * 20, scale)),
+        ('copier-store', copier_scenario([(4, 3, 5)] * 20, scale, True)),
+        ('dburl', lambda stages, workdir: dburl_scenario(
+            stages, workdir, scale
+        )),
+        ('settings', lambda stages, workdir: settings_scenario(
+            stages, workdir, scale
+        )),
+    ]
+
+
+def run(scale=1, repeat=3):
+    """Runs all the scenarios, returning the best result of each stage.
+    """
+    results = {}
+    for name, scenario in scenarios(scale):
+        for __ in range(repeat):
+            workdir = tempfile.mkdtemp(prefix='djc.recipe.benchmark')
+            try:
+                stages = Stages()
+                scenario(stages, workdir)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            for stage, result in stages.results.items():
+                key = '%s/%s' % (name, stage)
+                if key not in results or \
+                        result['time'] < results[key]['time']:
+                    results[key] = result
+    return results
+
+
+def compare(results, baseline, margin):
+    """Returns the list of the measures that exceed the baseline by more than
+    ``margin``.
+    """
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        for measure in ('time', 'memory'):
+            current = results[key][measure]
+            reference = baseline[key].get(measure)
+            if current is None or not reference:
+                continue
+            if current > reference * (1 + margin):
+                regressions.append((key, measure, reference, current))
+    return regressions
+
+
+def main(args=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-b', '--baseline', default='benchmarks.json',
+                      help="the file holding the baseline results")
+    parser.add_option('-m', '--margin', type='float', default=0.25,
+                      help="the tolerated slowdown, as a fraction")
+    parser.add_option('-s', '--scale', type='float', default=1,
+                      help="scales the size of the synthetic data")
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help="how many times each scenario is run")
+    parser.add_option('-u', '--update', action='store_true', default=False,
+                      help="store the results as the new baseline")
+    options, __ = parser.parse_args(args)
+
+    results = run(options.scale, options.repeat)
+    for key in sorted(results):
+        memory = results[key]['memory']
+        print '%-32s %10.4fs %12s' % (
+            key,
+            results[key]['time'],
+            memory is None and '-' or '%dB' % memory
+        )
+
+    if options.update or not os.path.exists(options.baseline):
+        stream = open(options.baseline, 'wb')
+        json.dump(results, stream, indent=2, sort_keys=True)
+        stream.close()
+        print "Baseline written to %s" % options.baseline
+        return 0
+
+    stream = open(options.baseline, 'rb')
+    baseline = json.load(stream)
+    stream.close()
+    regressions = compare(results, baseline, options.margin)
+    for key, measure, reference, current in regressions:
+        print "REGRESSION %s %s: %s -> %s (+%d%%)" % (
+            key, measure, reference, current,
+            int((float(current) / reference - 1) * 100)
+        )
+    return len(regressions) > 0 and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+import unittest, doctest, tempfile, shutil
+from zc.buildout.testing import cat, write
+from djc.recipe import assets
+
+
+def setUp(test):
+    test.globs['cat'] = cat
+    test.globs['write'] = write
+    test.globs['directory'] = tempfile.mkdtemp(prefix='tmp-tests-djc.recipe')
+
+
+def tearDown(test):
+    shutil.rmtree(test.globs['directory'], ignore_errors=True)
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(
+                assets,
+                setUp=setUp,
+                tearDown=tearDown
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,44 @@
+import unittest, doctest, tempfile, shutil, os
+from djc.recipe import bundle
+
+
+def create_file(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def setUp(test):
+    for name in ('base', 'eggs', 'output'):
+        test.globs[name] = tempfile.mkdtemp(suffix=name,
+                                            prefix='tmp-tests-djc.recipe')
+    base = test.globs['base']
+    egg = test.globs['egg'] = os.path.join(test.globs['eggs'], 'spam.egg')
+    create_file(os.path.join(egg, 'spam.py'), "spam = 1\n")
+    create_file(os.path.join(base, 'bin', 'django'),
+                "import sys\nsys.path[0:0] = ['%s']\n" % egg)
+    create_file(os.path.join(base, 'parts', 'django', 'settings.py'),
+                "STATIC_ROOT = '%s'\n" % os.path.join(base, 'static'))
+
+
+def tearDown(test):
+    for name in ('base', 'eggs', 'output'):
+        shutil.rmtree(test.globs[name], ignore_errors=True)
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(
+                bundle,
+                setUp=setUp,
+                tearDown=tearDown
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,15 @@
+import unittest, doctest
+from djc.recipe import compression
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(compression)
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
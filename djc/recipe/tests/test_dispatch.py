@@ -0,0 +1,35 @@
+import os, time, unittest, doctest, tempfile, shutil
+from StringIO import StringIO
+from zc.buildout.testing import write
+from djc.recipe import dispatch
+
+
+def setUp(test):
+    test.globs.update({
+        'os': os,
+        'time': time,
+        'StringIO': StringIO,
+        'write': write,
+        'directory': tempfile.mkdtemp(prefix='tmp-tests-djc.recipe'),
+    })
+
+
+def tearDown(test):
+    shutil.rmtree(test.globs['directory'], ignore_errors=True)
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(
+                dispatch,
+                setUp=setUp,
+                tearDown=tearDown
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,17 @@
+import unittest, doctest
+from djc.recipe.tests import configure_django
+
+
+def test_suite():
+    configure_django()
+    from djc.recipe.management.commands import load_fixtures
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(load_fixtures)
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,39 @@
+import unittest, doctest, tempfile, shutil, os
+from djc.recipe import messages
+
+
+def write(*path):
+    directory = os.path.join(*path[:-2])
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    f = open(os.path.join(*path[:-1]), 'wb')
+    try:
+        f.write(path[-1])
+    finally:
+        f.close()
+
+
+def setUp(test):
+    test.globs['write'] = write
+    test.globs['directory'] = tempfile.mkdtemp(prefix='tmp-tests-djc.recipe')
+
+
+def tearDown(test):
+    shutil.rmtree(test.globs['directory'], ignore_errors=True)
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(
+                messages,
+                setUp=setUp,
+                tearDown=tearDown
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,19 @@
+import unittest, doctest
+from djc.recipe import metrics, wsgiutils
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(wsgiutils),
+            doctest.DocTestSuite(
+                metrics,
+                optionflags=doctest.NORMALIZE_WHITESPACE
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,17 @@
+import unittest, doctest
+from djc.recipe.tests import configure_django
+
+
+def test_suite():
+    configure_django()
+    from djc.recipe.management.commands import migrate_all
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(migrate_all)
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
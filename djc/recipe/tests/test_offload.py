@@ -0,0 +1,42 @@
+import os, unittest, doctest, tempfile, shutil
+from djc.recipe.tests import configure_django
+
+
+def write(*path):
+    directory = os.path.join(*path[:-2])
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    f = open(os.path.join(*path[:-1]), 'wb')
+    try:
+        f.write(path[-1])
+    finally:
+        f.close()
+
+
+def setUp(test):
+    test.globs['os'] = os
+    test.globs['write'] = write
+    test.globs['root'] = tempfile.mkdtemp(prefix='tmp-tests-djc.recipe')
+
+
+def tearDown(test):
+    shutil.rmtree(test.globs['root'], ignore_errors=True)
+
+
+def test_suite():
+    configure_django()
+    from djc.recipe import offload
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(
+                offload,
+                setUp=setUp,
+                tearDown=tearDown
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
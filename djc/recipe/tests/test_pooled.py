@@ -0,0 +1,17 @@
+import unittest, doctest
+from djc.recipe.tests import configure_django
+
+
+def test_suite():
+    configure_django()
+    from djc.recipe.pooled import base
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(base)
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,27 @@
+import unittest, doctest, tempfile, shutil
+from djc.recipe import profiling
+
+
+def setUp(test):
+    test.globs['directory'] = tempfile.mkdtemp(prefix='tmp-tests-djc.recipe')
+
+
+def tearDown(test):
+    shutil.rmtree(test.globs['directory'], ignore_errors=True)
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(
+                profiling,
+                setUp=setUp,
+                tearDown=tearDown
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
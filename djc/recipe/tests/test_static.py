@@ -0,0 +1,30 @@
+import unittest, doctest, tempfile, shutil
+from djc.recipe import lru, static
+
+
+def setUp(test):
+    test.globs['root'] = tempfile.mkdtemp(suffix='static',
+                                          prefix='tmp-tests-djc.recipe')
+
+
+def tearDown(test):
+    shutil.rmtree(test.globs['root'], ignore_errors=True)
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(lru),
+            doctest.DocTestSuite(
+                static,
+                setUp=setUp,
+                tearDown=tearDown,
+                optionflags=doctest.ELLIPSIS
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,29 @@
+import unittest, doctest, tempfile, shutil
+from djc.recipe.tests import configure_django
+
+
+def setUp(test):
+    test.globs['root'] = tempfile.mkdtemp(prefix='tmp-tests-djc.recipe')
+
+
+def tearDown(test):
+    shutil.rmtree(test.globs['root'], ignore_errors=True)
+
+
+def test_suite():
+    configure_django()
+    from djc.recipe import storage
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(
+                storage,
+                setUp=setUp,
+                tearDown=tearDown
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -0,0 +1,15 @@
+import unittest, doctest
+from djc.recipe import testrunner
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(testrunner)
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
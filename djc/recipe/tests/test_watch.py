@@ -0,0 +1,40 @@
+import unittest, doctest, tempfile, shutil, os
+from zc.buildout.testing import ls, cat, write
+from djc.recipe import watch
+
+
+def setUp(test):
+    test.globs['ls'] = ls
+    test.globs['cat'] = cat
+    test.globs['write'] = write
+    test.globs['one'] = tempfile.mkdtemp(suffix='one',
+                                         prefix='tmp-tests-djc.recipe')
+    test.globs['two'] = tempfile.mkdtemp(suffix='two',
+                                         prefix='tmp-tests-djc.recipe')
+    test.globs['target'] = tempfile.mkdtemp(suffix='target',
+                                            prefix='tmp-tests-djc.recipe')
+    write(test.globs['one'], 'a.css', 'one')
+    write(test.globs['one'], 'b.css', 'one')
+    write(test.globs['two'], 'a.css', 'two')
+
+
+def tearDown(test):
+    for name in ('one', 'two', 'target'):
+        shutil.rmtree(test.globs[name], ignore_errors=True)
+
+
+def test_suite():
+    suite = unittest.TestSuite(
+        [
+            doctest.DocTestSuite(
+                watch,
+                setUp=setUp,
+                tearDown=tearDown
+            )
+        ]
+    )
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
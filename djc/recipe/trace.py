@@ -0,0 +1,110 @@
+"""Finds out which modules a project needs at runtime.
+
+``main`` sets up Django with the given settings, imports everything the
+settings refer to (applications with their models and template tags,
+middleware, backends, the url configuration and its views...) and writes
+the files of all the loaded modules, as a JSON list, to the standard output.
+The recipe runs it at install time to prune the eggs that are never imported
+from the working set of the generated scripts.
+
+The dotted names are picked from the values of the settings, whatever their
+nesting::
+
+    >>> from djc.recipe.trace import dotted_names, import_runtime
+    >>> list(dotted_names({'ENGINE': 'django.db.backends.sqlite3',
+    ...                    'NAME': '/tmp/db.sqlite', 'PORT': 5432}))
+    ['django.db.backends.sqlite3']
+    >>> import_runtime()
+    >>> 'django.template.loaders.filesystem' in sys.modules
+    True
+"""
+
+import sys, pkgutil
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+from utils import setup_django
+
+
+def dotted_names(value):
+    """Yields the strings in ``value`` (a setting) that look like dotted
+    names.
+    """
+    if isinstance(value, basestring):
+        if '.' in value and ' ' not in value and '/' not in value:
+            yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            for name in dotted_names(item):
+                yield name
+    elif isinstance(value, dict):
+        for item in value.values():
+            for name in dotted_names(item):
+                yield name
+
+
+def try_import(name):
+    """Imports ``name``, or its parent if it is an attribute, quietly.
+    """
+    from django.utils.importlib import import_module
+    for candidate in (name, name.rsplit('.', 1)[0]):
+        try:
+            return import_module(candidate)
+        except Exception:
+            pass
+    return None
+
+
+def load_urls(patterns):
+    for pattern in patterns:
+        try:
+            if hasattr(pattern, 'url_patterns'):
+                load_urls(pattern.url_patterns)
+            else:
+                pattern.callback
+        except Exception:
+            pass
+
+
+def import_runtime():
+    from django.conf import settings
+    from django.db import connections
+    for name in dir(settings):
+        if name.isupper():
+            for dotted in dotted_names(getattr(settings, name)):
+                try_import(dotted)
+    for app in settings.INSTALLED_APPS:
+        try_import('%s.models' % app)
+        tags = try_import('%s.templatetags' % app)
+        if tags is not None and hasattr(tags, '__path__'):
+            for __, module, __ in pkgutil.iter_modules(tags.__path__):
+                try_import('%s.templatetags.%s' % (app, module))
+    for alias in settings.DATABASES:
+        try:
+            connections[alias]
+        except Exception:
+            pass
+    try:
+        from django.core.cache import get_cache
+        for alias in getattr(settings, 'CACHES', {}):
+            get_cache(alias)
+    except Exception:
+        pass
+    try:
+        from django.core.urlresolvers import get_resolver
+        load_urls(get_resolver(None).url_patterns)
+    except Exception:
+        pass
+    try_import('django.core.handlers.wsgi')
+    try_import('django.core.management')
+
+
+def main(settings):
+    setup_django(settings)
+    import_runtime()
+    files = [
+        module.__file__ for module in sys.modules.values()
+        if getattr(module, '__file__', None)
+    ]
+    sys.stdout.write(json.dumps(sorted(files)))
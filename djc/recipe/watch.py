@@ -0,0 +1,368 @@
+"""Keeps the static directory in sync with its origins, using Linux inotify.
+
+After copying all the origins (as the recipe does), the ``Watcher`` watches
+every directory within them and applies to the target the files that are
+changed, created or deleted. Bursts of events (for example, an editor saving
+a file or a version control checkout) are batched and applied together::
+
+    >>> from djc.recipe.watch import Watcher
+    >>> watcher = Watcher([(one, target), (two, target)], delay=0.01)
+    >>> ls(target)
+    -  a.css
+    -  b.css
+    >>> cat(target, 'a.css')
+    two
+
+The last origin is the top layer, as in the recipe: changes to a file that it
+overrides do not reach the target, while deleting it uncovers the one below::
+
+    >>> write(one, 'a.css', 'one, changed')
+    >>> watcher.poll(1)
+    []
+    >>> os.remove(os.path.join(two, 'a.css'))
+    >>> watcher.poll(1) #doctest: +ELLIPSIS
+    [('copy', '.../a.css')]
+    >>> cat(target, 'a.css')
+    one, changed
+
+New directories are watched as soon as they appear::
+
+    >>> os.makedirs(os.path.join(two, 'sub'))
+    >>> write(two, 'sub', 'c.js', 'c')
+    >>> for action, path in sorted(watcher.poll(1)):
+    ...     print action, path[len(target):]
+    copy /sub
+    copy /sub/c.js
+    >>> os.remove(os.path.join(two, 'sub', 'c.js'))
+    >>> os.remove(os.path.join(one, 'b.css'))
+    >>> for action, path in sorted(watcher.poll(1)):
+    ...     print action, path[len(target):]
+    delete /b.css
+    delete /sub/c.js
+    >>> ls(target)
+    -  a.css
+    d  sub
+    >>> watcher.close()
+
+The files are linked as the recipe does (symlinked with ``link``, hardlinked
+from a ``Store`` with ``store``), the excluded directories are not watched,
+and the ``bundles`` are written again after each change::
+
+    >>> os.makedirs(os.path.join(one, 'node_modules', 'lib'))
+    >>> watcher = Watcher([(one, target, (), ('node_modules',))], delay=0.01,
+    ...                   link=True, bundles=(target, [('all.css', ['*.css'])],
+    ...                                       os.path.join(target, 'state'),
+    ...                                       False))
+    >>> sorted(watcher.watches.values()) == [one]
+    True
+    >>> write(one, 'b.css', 'b')
+    >>> for action, path in sorted(watcher.poll(1)):
+    ...     print action, path[len(target):]
+    copy /b.css
+    >>> os.path.islink(os.path.join(target, 'b.css'))
+    True
+    >>> cat(target, 'all.css')
+    one, changed
+    b
+    >>> watcher.close()
+"""
+
+import os, sys, time, errno, select, shutil, struct, filecmp, logging, \
+        tempfile
+import ctypes, ctypes.util
+from copier import Copier, Store, excluded
+from assets import build_bundles
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | \
+        IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')
+
+logger = logging.getLogger('djc.recipe.watch')
+
+
+class Inotify(object):
+    """A minimal binding of the inotify calls of the C library.
+    """
+
+    def __init__(self):
+        library = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            self._error()
+
+    def _error(self):
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        if isinstance(path, unicode):
+            path = path.encode(sys.getfilesystemencoding())
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            self._error()
+        return wd
+
+    def read(self, timeout=None):
+        """Returns the events as ``(wd, mask, cookie, name)``, waiting at most
+        ``timeout`` seconds for them.
+        """
+        readable, __, __ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """Copies ``origins``, a list of ``(source, target)`` directories
+    (optionally followed by the ``include`` and ``exclude`` patterns of the
+    ``Copier``), then watches the sources for changes.
+
+    Events are collected until none arrives for ``delay`` seconds (but for at
+    most ``max_delay`` seconds), then applied. ``link`` and ``store`` (the
+    directory of a ``Store``) are those of the ``Copier``. ``bundles``, if
+    given, are the arguments of ``build_bundles`` (the directory, the
+    bundles, the state file and, optionally, whether to minify), called after
+    the changes.
+    """
+
+    def __init__(self, origins, delay=0.05, max_delay=1, link=False,
+                 store=None, bundles=None):
+        self.origins = []
+        for origin in origins:
+            include, exclude = (tuple(origin[2:]) + ((), ()))[:2]
+            self.origins.append((
+                os.path.abspath(origin[0]), os.path.abspath(origin[1]),
+                include, exclude
+            ))
+        self.delay = delay
+        self.max_delay = max_delay
+        self.link = link
+        self.store = store and Store(store) or None
+        self.bundles = bundles
+        self.inotify = Inotify()
+        self.watches = {}
+        for origin in self.origins:
+            self.watch(origin[0])
+        self.sync()
+
+    def sync(self):
+        """Copies all the origins.
+        """
+        copier = Copier(link=self.link, store=self.store)
+        for source, target, include, exclude in self.origins:
+            copier.copy(source, target, include, exclude)
+        copier.execute()
+        self.build_bundles()
+
+    def build_bundles(self):
+        if self.bundles is not None:
+            built, __ = build_bundles(*self.bundles)
+            for output in built:
+                logger.info("bundle %s" % output)
+
+    def watch(self, directory):
+        """Watches ``directory`` and its subdirectories, returns the files
+        found in them.
+        """
+        found = []
+        if not self.targets(directory):
+            return found
+        for root, directories, files in os.walk(directory):
+            # Watches are limited, none is wasted on what is not copied
+            directories[:] = [
+                d for d in directories if self.targets(os.path.join(root, d))
+            ]
+            try:
+                self.watches[self.inotify.add_watch(root)] = root
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            found.append(root)
+            found.extend([os.path.join(root, f) for f in files])
+        return found
+
+    def targets(self, path):
+        """Returns the targets ``path`` (within a source) is copied to.
+        """
+        targets = []
+        for source, target, include, exclude in self.origins:
+            if path == source or path.startswith(source + os.sep):
+                relative = path[len(source):].strip(os.sep)
+                # Gone paths might have been directories
+                if relative and self.is_excluded(
+                        relative, include, exclude, not os.path.isfile(path)):
+                    continue
+                targets.append(target + path[len(source):])
+        return targets
+
+    def is_excluded(self, relative, include, exclude, directory):
+        """Returns whether ``relative`` (within a source) or any of its
+        parent directories is filtered out.
+        """
+        parts = relative.split(os.sep)
+        for i in range(1, len(parts)):
+            if excluded('/'.join(parts[:i]), include, exclude, True):
+                return True
+        return excluded('/'.join(parts), include, exclude, directory)
+
+    def origin(self, target_path):
+        """Returns the file that has to be at ``target_path`` (the one from
+        the last origin having it), or ``None``.
+        """
+        for source, target, include, exclude in reversed(self.origins):
+            if target_path == target or \
+                    target_path.startswith(target + os.sep):
+                path = source + target_path[len(target):]
+                relative = target_path[len(target):].strip(os.sep)
+                if os.path.exists(path) and not (relative and self.is_excluded(
+                        relative, include, exclude, os.path.isdir(path))):
+                    return path
+        return None
+
+    def collect(self, timeout=None):
+        """Returns the paths changed in the sources.
+        """
+        events = self.inotify.read(timeout)
+        if not events:
+            return set()
+        changed = set()
+        deadline = time.time() + self.max_delay
+        while events:
+            for wd, mask, __, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    # Events have been lost, everything has to be checked
+                    for origin in self.origins:
+                        changed.update(self.watch(origin[0]))
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                directory = self.watches.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, name)
+                changed.add(path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may have been created before the watch was added
+                    changed.update(self.watch(path))
+            if time.time() >= deadline:
+                break
+            events = self.inotify.read(self.delay)
+        return changed
+
+    def apply(self, changed):
+        """Brings the targets of the ``changed`` paths up to date, returns the
+        operations done as ``(action, target)``.
+        """
+        operations = []
+        targets = set()
+        for path in changed:
+            targets.update(self.targets(path))
+        for target in sorted(targets):
+            origin = self.origin(target)
+            try:
+                if origin is None:
+                    if os.path.isdir(target) and not os.path.islink(target):
+                        shutil.rmtree(target)
+                    elif os.path.lexists(target):
+                        os.remove(target)
+                    else:
+                        continue
+                    operations.append(('delete', target))
+                elif os.path.isdir(origin):
+                    if os.path.isfile(target):
+                        os.remove(target)
+                    if not os.path.isdir(target):
+                        os.makedirs(target)
+                        operations.append(('copy', target))
+                elif not os.path.isfile(target) or \
+                        not filecmp.cmp(origin, target, shallow=False):
+                    self.copy(origin, target)
+                    operations.append(('copy', target))
+            except (IOError, OSError), e:
+                # The origin is likely gone in the meanwhile, the events that
+                # follow will take care of it
+                logger.warning("Cannot update '%s': %s" % (target, e))
+        for action, target in operations:
+            logger.info("%s %s" % (action, target))
+        if operations:
+            self.build_bundles()
+        return operations
+
+    def copy(self, origin, target):
+        directory = os.path.dirname(target)
+        if os.path.isfile(directory):
+            os.remove(directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+        # Copy and rename, so that nobody sees a partially written file
+        fd, temp = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        os.close(fd)
+        try:
+            if self.link:
+                os.remove(temp)
+                os.symlink(origin, temp)
+            elif self.store is not None:
+                os.remove(temp)
+                self.store.link(origin, temp)
+            else:
+                shutil.copy(origin, temp)
+            os.rename(temp, target)
+        except:
+            os.remove(temp)
+            raise
+
+    def poll(self, timeout=None):
+        """Waits at most ``timeout`` seconds for changes, and applies them.
+        """
+        return self.apply(self.collect(timeout))
+
+    def run(self):
+        while True:
+            self.poll()
+
+    def close(self):
+        self.inotify.close()
+
+
+def main(settings, origins, delay=0.05, link=False, store=None,
+         bundles=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    watcher = Watcher(origins, delay, link=link, store=store,
+                      bundles=bundles)
+    logger.info("Watching %s" % ', '.join([o[0] for o in origins]))
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.close()
@@ -2,7 +2,14 @@ import logging
 from utils import setup_django
 
 
-def main(settings, logfile=None, loglevel=None):
+def main(settings, logfile=None, loglevel=None, metrics=False,
+         metrics_path=None, metrics_textfile=None, metrics_interval=15,
+         profile_rate=0.0, profile_directory=None, serve_static=False,
+         static_cache_size=None, static_max_size=None, static_max_age=None,
+         warmup=False, health_path=None, memory_directory=None,
+         memory_every=None, gzip=False, gzip_min_size=None, gzip_types=None,
+         max_requests=None, max_wait=None, retry_after=None,
+         media_offload=False):
     setup_django(settings)
 
     if logfile:
@@ -16,4 +23,84 @@ def main(settings, logfile=None, loglevel=None):
     from django.core.handlers.wsgi import WSGIHandler
 
     # Run WSGI handler for the application
-    return WSGIHandler()
+    application = WSGIHandler()
+
+    if gzip:
+        from compression import GzipMiddleware
+        kwargs = {}
+        if gzip_min_size is not None:
+            kwargs['min_size'] = gzip_min_size
+        if gzip_types is not None:
+            kwargs['content_types'] = gzip_types
+        application = GzipMiddleware(application, **kwargs)
+
+    if max_requests:
+        from admission import AdmissionMiddleware
+        kwargs = {}
+        if max_wait is not None:
+            kwargs['max_wait'] = max_wait
+        if retry_after is not None:
+            kwargs['retry_after'] = retry_after
+        # Inside the metrics, that must be answered even when saturated
+        application = AdmissionMiddleware(
+            application, max_requests, **kwargs
+        )
+
+    if metrics:
+        from metrics import MetricsMiddleware
+        application = MetricsMiddleware(
+            application,
+            path=metrics_path,
+            textfile=metrics_textfile,
+            interval=metrics_interval,
+            profile_rate=profile_rate,
+            profile_directory=profile_directory
+        )
+
+    if memory_directory:
+        from memory import install, MemoryMiddleware
+        reporter = install(memory_directory)
+        if memory_every:
+            application = MemoryMiddleware(
+                application, reporter, memory_every
+            )
+
+    if media_offload:
+        from django.conf import settings as django_settings
+        from offload import OffloadMiddleware
+        offload = django_settings.MEDIA_OFFLOAD
+        # Outside the layers that would otherwise see the files' content
+        application = OffloadMiddleware(
+            application,
+            offload['SERVER'],
+            django_settings.MEDIA_ROOT,
+            offload.get('LOCATION', '/')
+        )
+
+    if serve_static:
+        from django.conf import settings as django_settings
+        from static import StaticMiddleware
+        kwargs = {'max_age': static_max_age}
+        if static_cache_size is not None:
+            kwargs['cache_size'] = static_cache_size
+        if static_max_size is not None:
+            kwargs['max_size'] = static_max_size
+        # This goes outside everything else, so that the server's file
+        # wrapper is not hidden by the other layers
+        application = StaticMiddleware(
+            application,
+            django_settings.STATIC_ROOT,
+            django_settings.STATIC_URL,
+            **kwargs
+        )
+
+    if warmup or health_path:
+        from health import HealthMiddleware, WarmUp
+        readiness = None
+        if warmup:
+            readiness = WarmUp()
+            readiness()
+        # Without a health path, only to warm up the serving processes
+        application = HealthMiddleware(application, health_path, readiness)
+
+    return application
@@ -0,0 +1,54 @@
+"""Small helpers shared by the WSGI layers wrapped around Django's handler.
+"""
+
+
+# Names the file that the response hands off to the web server
+OFFLOAD_HEADER = 'X-Offload-File'
+
+
+class ClosingIterator(object):
+    """Wraps a WSGI response iterable, calling ``callback`` once the server
+    closes it (that is, when the response has been fully sent or aborted).
+
+        >>> from djc.recipe.wsgiutils import ClosingIterator
+        >>> calls = []
+        >>> body = ClosingIterator(['a', 'b'], lambda: calls.append('done'))
+        >>> list(body)
+        ['a', 'b']
+        >>> calls
+        []
+        >>> body.close()
+        >>> calls
+        ['done']
+    """
+
+    def __init__(self, iterable, callback):
+        self._iterable = iterable
+        self._iterator = iter(iterable)
+        self._callback = callback
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._iterator.next()
+
+    __next__ = next
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._callback()
+
+
+def simple_response(start_response, status, body,
+                    content_type='text/plain; charset=utf-8', headers=[]):
+    """Answers a request directly, without reaching the wrapped application.
+    """
+    start_response(status, [
+        ('Content-Type', content_type),
+        ('Content-Length', str(len(body))),
+    ] + list(headers))
+    return [body]